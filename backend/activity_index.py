@@ -0,0 +1,46 @@
+# Precomputed activity lookup for plan_block and /activities/suggest.
+# Minute ranges are cut into elementary intervals at every range boundary; each
+# interval keeps the activities covering it sorted by age_min, so a query is two
+# bisects (minutes -> interval, age -> prefix length) instead of a catalog scan.
+from bisect import bisect_left, bisect_right
+from typing import Dict, Any, List, Tuple
+
+Activity = Dict[str, Any]
+
+class ActivityIndex:
+    def __init__(self, activities: List[Activity]):
+        self.activities = activities
+        cuts = set()
+        for a in activities:
+            lo, hi = a["minutes"]
+            cuts.add(lo); cuts.add(hi + 1)
+        self._bounds = sorted(cuts)
+        # per interval: (ages, items, calm_ages, calm_items); "calm" = energy != active
+        self._slots: List[Tuple[List[float], List[Activity], List[float], List[Activity]]] = [
+            ([], [], [], []) for _ in self._bounds[:-1]]
+        # stable sort: activities with the same age_min keep their catalog order
+        for a in sorted(activities, key=lambda a: a["age_min"]):
+            lo, hi = a["minutes"]
+            for i in range(bisect_left(self._bounds, lo), bisect_left(self._bounds, hi + 1)):
+                ages, items, calm_ages, calm_items = self._slots[i]
+                ages.append(a["age_min"]); items.append(a)
+                if a["energy"] != "active":
+                    calm_ages.append(a["age_min"]); calm_items.append(a)
+
+    def lookup(self, minutes: int, age: float, calm: bool = False) -> Tuple[List[Activity], int]:
+        """Candidates for a block of `minutes` and a child of `age`.
+
+        Returns (items, n): the first n entries of items match, in age_min order.
+        Nothing is copied, so the cost does not grow with the number of matches.
+        """
+        i = bisect_right(self._bounds, minutes) - 1
+        if i < 0 or i >= len(self._slots):
+            return [], 0
+        ages, items, calm_ages, calm_items = self._slots[i]
+        if calm:
+            return calm_items, bisect_right(calm_ages, age)
+        return items, bisect_right(ages, age)
+
+def build_index(catalog: Dict[str, Dict[str, List[Activity]]]) -> Dict[Tuple[str, str], ActivityIndex]:
+    """One ActivityIndex per (language, mode) of activities.json."""
+    return {(lang, mode): ActivityIndex(acts) for lang, modes in catalog.items() for mode, acts in modes.items()}
@@ -1,19 +1,38 @@
 from collections import defaultdict
 from datetime import datetime, timezone
 import os  # if not already imported
-import json, random, datetime, os, hashlib, base64, time
+import asyncio, json, random, datetime, os, hashlib, base64, time, atexit, threading, sys
+from contextlib import contextmanager
 from typing import Dict, Any, List, Optional
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from dateutil.relativedelta import relativedelta
-from authlib.integrations.starlette_client import OAuth
 from starlette.responses import RedirectResponse
-from pywebpush import webpush, WebPushException
+from push import PushDispatcher
 from typing import List, Dict, Any, Optional
 
-from config import ENABLE_GOOGLE, LOCAL_ONLY, RETENTION_DAYS, VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY, VAPID_CLAIMS, OIDC_CLIENT_ID, OIDC_CLIENT_SECRET, OIDC_ISSUER, REDIRECT_URI
+from config import ENABLE_GOOGLE, LOCAL_ONLY, RETENTION_DAYS, RETENTION_EVERY_H, VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY, VAPID_CLAIMS, OIDC_CLIENT_ID, OIDC_CLIENT_SECRET, OIDC_ISSUER, REDIRECT_URI
+from config import DATA_DIR, EVENT_FLUSH_EVERY, EVENT_FLUSH_MS, EVENT_DURABILITY, EVENT_QUEUE_MAX, METRICS_CHECKPOINT_EVERY
+from config import STORAGE_BACKEND, SQLITE_PATH, SQLITE_POOL_SIZE, PLAN_BATCH_MAX, MEALPLAN_CACHE_SIZE, MEALPLAN_MAX_DAYS, STORY_CACHE_SIZE, CONTENT_DIR, CONTENT_POLL_S, CONTENT_SNAPSHOT
+from config import PUSH_WORKERS, PUSH_TIMEOUT_S, PUSH_RETRIES, PUSH_BACKOFF_S, ICS_CACHE_SIZE
+from config import REMINDERS_ENABLED, REMINDER_LEAD_MIN, REMINDER_COALESCE_S
+from config import INSTRUMENTATION_ENABLED, PROFILER_ENABLED, PROFILER_INTERVAL_MS, PROFILER_SLOW_MS
+from config import COLUMNAR_EVERY_S, COLUMNAR_OPEN_MONTHS, SESSIONS_CAPACITY, SESSION_IDLE_S, SESSION_SWEEP_S
+from config import RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_SIZE, COMPRESS_MIN_BYTES
+from eventlog import EventWriter
+from segments import SegmentStore, day_of
+from metrics import Metrics
+from columnar import ColumnarStore, DIMS as COLUMNAR_DIMS, AVAILABLE as COLUMNAR_AVAILABLE
+from storage import open_storage
+from content import ContentRegistry, ContentSnapshot
+from instrumentation import Instrumentation, InstrumentationMiddleware, SamplingProfiler
+from httpcache import ResponseCache, CompressionMiddleware
+from reminders import ReminderScheduler
+from sessions import SessionTracker
+from privacy import event_subjects, scrub_event, export_stream, child_subject, email_subject
+from cache import LRUCache
+import ics
 
 # ---------- Models ----------
 class Parent(BaseModel):
@@ -26,12 +45,15 @@ class Child(BaseModel):
     age_years: float = Field(ge=0, le=12)
     language: str = "en"  # 'en' or 'nl'
     temperament: Optional[str] = "balanced"
+    org: Optional[str] = None  # employer org_id, for org-scoped KPIs
 
 class DayPlanRequest(BaseModel):
     child: Child
     wake_time: str  # "07:00"
     available_blocks_min: List[int] = [20, 30, 40]
     focus: Optional[str] = "calm"  # calm | active | learning
+    parent: Optional[str] = None  # parent email: push a reminder before each block
+    date: Optional[str] = None    # YYYY-MM-DD the plan is for (default: today)
 
 class ActivitySuggestRequest(BaseModel):
     child: Child
@@ -43,66 +65,125 @@ class StoryRequest(BaseModel):
     theme: str = "adventure"
     length_min: int = 4
     bilingual: bool = False
+    seed: Optional[int] = None  # same seed -> same story; random when omitted
+
+class StoryBatchRequest(StoryRequest):
+    nights: int = Field(7, ge=1, le=31)  # consecutive seeds, one story per night
 
 class SessionStartRequest(BaseModel):
     child: Child
     duration_min: int = 30
     goal: str = "engage" # engage | calm | learn
 
-class PushSubscription(BaseModel):
-    endpoint: str
-    keys: Dict[str, str]
+class SessionRef(BaseModel):
+    session_id: str
 
 # ---------- App ----------
 app = FastAPI(title="Haven AI Nanny — Pro")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
-def load_json(path: str):
-    with open(path,"r",encoding="utf-8") as f: return json.load(f)
+# Per-route latency/size/status metrics and named spans, exported at GET /metrics (see instrumentation.py)
+INSTRUMENTS = Instrumentation()
+span = INSTRUMENTS.span
+if INSTRUMENTATION_ENABLED:
+    app.add_middleware(InstrumentationMiddleware, registry=INSTRUMENTS)
+
+# Dashboard GETs are served from a short-TTL cache with ETags and pre-compressed variants; other large
+# responses are gzip/brotli-encoded on the way out (see httpcache.py)
+RESPONSES = ResponseCache(maxsize=RESPONSE_CACHE_SIZE, min_compress=COMPRESS_MIN_BYTES or 1 << 62)
+# cache tags each event kind makes stale; the high-volume kinds (plans, stories, suggestions, pushes)
+# only age out with the TTL, so dashboards polled under traffic still hit the cache
+EVENT_TAGS = {
+    "session_start": ("sessions",), "session_end": ("sessions",),
+    "signup": ("accounts",), "child_add": ("accounts",), "child_delete": ("accounts",),
+    "sso_mock": ("accounts",), "sso_google": ("accounts",), "org_create": ("accounts",),
+    "wipe": ("sessions", "accounts"),
+}
+if COMPRESS_MIN_BYTES > 0:
+    app.add_middleware(CompressionMiddleware, min_size=COMPRESS_MIN_BYTES)
 
-ACTIVITIES = load_json("content/activities.json")
-ST_EN = load_json("content/stories_en.json")
-ST_NL = load_json("content/stories_nl.json")
+# Wall time of each start-up phase, served at /admin/startup (import costs: bench/startup.py)
+STARTUP: Dict[str, float] = {}
 
-DB: Dict[str, Any] = {
-    "parents": [], "children": [], "sessions": [], "time_saved_min": 0,
-    "subscriptions": [], "events_path": "data/events.jsonl", "orgs": {}
-}
-os.makedirs("data", exist_ok=True)
-if not os.path.exists(DB["events_path"]):
-    with open(DB["events_path"],"w") as _f: pass
+@contextmanager
+def startup_phase(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP[name] = round((time.perf_counter() - t0) * 1000.0, 3)
+
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# Activities, stories and meals are versioned snapshots, rebuilt when content/ changes (see content.py).
+# Handlers read CONTENT.current once and use that snapshot for the whole request. The last build is
+# pickled to CONTENT_SNAPSHOT, so a restart against unchanged files loads it in one read.
+with startup_phase("content"):
+    CONTENT = ContentRegistry(CONTENT_DIR, story_cache=STORY_CACHE_SIZE, mealplan_cache=MEALPLAN_CACHE_SIZE,
+                              snapshot_path=CONTENT_SNAPSHOT)
+    CONTENT.start(CONTENT_POLL_S)
+
+# Parents, children, sessions and orgs live in a storage backend (see storage.py)
+with startup_phase("storage"):
+    STORE = open_storage(STORAGE_BACKEND, SQLITE_PATH, SQLITE_POOL_SIZE)
+
+# Event log: one segment per UTC day (see segments.py); a pre-segment events.jsonl is split on first start.
+# Each segment has a subject index, so privacy export and erasure read only that person's events.
+with startup_phase("eventlog"):
+    SEGMENTS = SegmentStore(os.path.join(DATA_DIR, "events"), subjects=event_subjects)
+    SEGMENTS.migrate(os.path.join(DATA_DIR, "events.jsonl"))
+
+# Counters materialized from the shared log, restored from their checkpoint (see metrics.py). They follow
+# the segments rather than this worker's own commits, so every uvicorn worker reports the same numbers.
+with startup_phase("metrics"):
+    METRICS = Metrics(os.path.join(DATA_DIR, "metrics.json"), checkpoint_every=METRICS_CHECKPOINT_EVERY)
+    METRICS.restore(SEGMENTS)
+
+# Events are queued and group-committed by a background writer (see eventlog.py)
+EVENTS = EventWriter(SEGMENTS, flush_every=EVENT_FLUSH_EVERY, flush_ms=EVENT_FLUSH_MS,
+                     durability=EVENT_DURABILITY, max_queue=EVENT_QUEUE_MAX)
+
+# Sealed days are folded into memory-mapped monthly column partitions for /admin/metrics/query (see columnar.py)
+COLUMNS = ColumnarStore(os.path.join(DATA_DIR, "columns"), SEGMENTS, open_months=COLUMNAR_OPEN_MONTHS)
+COLUMNS.start(COLUMNAR_EVERY_S)
+
+# Sessions are recorded in the shared store and ended exactly once, by whichever worker claims the end;
+# heartbeats are kept in a per-worker ring of compact records (see sessions.py). The ending worker logs a
+# session_end event with the measured minutes.
+SESSIONS = SessionTracker(STORE, on_end=lambda record: log_event("session_end", record), capacity=SESSIONS_CAPACITY,
+                          idle_s=SESSION_IDLE_S)
+SESSIONS.run(SESSION_SWEEP_S)
+
+def _close_all():
+    # producers first, then the event writer, then what it writes into
+    if INSTRUMENTS.profiler is not None: INSTRUMENTS.profiler.stop()
+    CONTENT.close()
+    SESSIONS.close()
+    COLUMNS.close()
+    REMINDERS.close()
+    PUSH.close()
+    EVENTS.close()
+    METRICS.follow(SEGMENTS)
+    METRICS.checkpoint()
+    STORE.close()
+atexit.register(_close_all)
 
 def log_event(kind: str, payload: Dict[str, Any]):
-    entry = {"ts": time.time(), "kind": kind, "payload": payload}
-    with open(DB["events_path"],"a") as f:
-        f.write(json.dumps(entry)+"\n")
-
-# Ensure a writable events log path even on MVP
-if "events_path" not in DB:
-    DB["events_path"] = "data/events.jsonl"
-os.makedirs("data", exist_ok=True)
-# Create the file if it doesn't exist
-try:
-    open(DB["events_path"], "a").close()
-except Exception:
-    pass
-
-def _pick(lst, i):
-    # deterministic rotate
-    return lst[i % len(lst)]
-
-def _merge_ingredients(base: Dict[str, float], extra: Dict[str, float]):
-    out = base.copy()
-    for k, v in extra.items():
-        out[k] = out.get(k, 0) + v
-    return out
-
-def _scale_for_age(ingredients: Dict[str, float], age_years: float) -> Dict[str, float]:
-    # simple scaling: 0.5x for <=2y, 0.75x for <=4y, 1.0x otherwise
-    if age_years <= 2: factor = 0.5
-    elif age_years <= 4: factor = 0.75
-    else: factor = 1.0
-    return {k: round(v * factor, 2) for k, v in ingredients.items()}
+    with span("log_event"):
+        EVENTS.emit({"ts": time.time(), "kind": kind, "payload": payload})
+    if kind in EVENT_TAGS:
+        RESPONSES.invalidate(*EVENT_TAGS[kind])
+
+async def alog_event(kind: str, payload: Dict[str, Any]):
+    # for async handlers: backpressure and fsync waits are awaited instead of blocking the loop
+    with span("log_event"):
+        await EVENTS.aemit({"ts": time.time(), "kind": kind, "payload": payload})
+    if kind in EVENT_TAGS:
+        RESPONSES.invalidate(*EVENT_TAGS[kind])
+
+@app.on_event("shutdown")
+def _shutdown():
+    _close_all()
 
 from pydantic import BaseModel
 class MealPlanRequest(BaseModel):
@@ -111,68 +192,28 @@ class MealPlanRequest(BaseModel):
     budget: str = "mid"  # low | mid | high
 
 @app.post("/mealplan/generate")
-def mealplan_generate(req: MealPlanRequest):
-    budget = req.budget.lower()
-    if budget not in ("low","mid","high"):
-        budget = "mid"
+async def mealplan_generate(req: MealPlanRequest):
+    # plans depend only on (budget, age bracket, days) and are memoized by the snapshot's planner
     days = max(1, min(14, req.days))
     age = float(req.child.get("age_years", 4.0))
+    with span("mealplan_generate"):
+        return CONTENT.current.meal_planner.plan(req.budget, age, days)
 
-    plan = []
-    grocery: Dict[str, float] = {}
-    grocery_links: Dict[str, list] = {}  # ingredient -> [recipe labels]
-
-    def link_ingredient(ing_name: str, recipe_label: str):
-        grocery_links.setdefault(ing_name, [])
-        if recipe_label not in grocery_links[ing_name]:
-            grocery_links[ing_name].append(recipe_label)
-
-    def assemble(label_prefix: str, item: dict):
-        base = item["ingredients"]
-        extras = item["budget"].get(budget, {})
-        merged = _merge_ingredients(base, extras)
-        ing = _scale_for_age(merged, age)
-        recipe_label = f"Day {label_prefix} — {item['name']}"
-        # collect totals + link each ingredient to this recipe
-        for k, v in ing.items():
-            grocery[k] = round(grocery.get(k, 0) + v, 2)
-            link_ingredient(k, recipe_label)
-        return {
-            "name": item["name"],
-            "ingredients": ing,
-            "prep_time_min": item.get("prep_time_min"),
-            "instructions": item.get("instructions", []),
-            "notes": item.get("notes", "")
-        }
-
-    for d in range(days):
-        b = _pick(MEAL_DB["breakfast"], d)
-        l = _pick(MEAL_DB["lunch"], d)
-        s = _pick(MEAL_DB["snack"], d)
-        dn = _pick(MEAL_DB["dinner"], d)
-
-        day_num = d + 1
-        day_plan = {
-            "day": day_num,
-            "breakfast": assemble(f"{day_num} Breakfast", b),
-            "lunch":     assemble(f"{day_num} Lunch",     l),
-            "snack":     assemble(f"{day_num} Snack",     s),
-            "dinner":    assemble(f"{day_num} Dinner",    dn),
-        }
-        plan.append(day_plan)
-
-    return {
-        "ok": True,
-        "days": days,
-        "budget": budget,
-        "plan": plan,
-        "grocery_list": grocery,
-        "grocery_links": grocery_links  # NEW: which recipes use each ingredient
-    }
-    
-        plan.append(day_plan)
+class MealPlanStreamRequest(BaseModel):
+    children: List[Dict[str, Any]]
+    days: int = 28
+    budget: str = "mid"  # low | mid | high
 
-    return {"ok": True, "days": days, "budget": budget, "plan": plan, "grocery_list": grocery}
+@app.post("/mealplan/stream")
+def mealplan_stream(req: MealPlanStreamRequest):
+    """Long-horizon plans for several children, streamed as NDJSON: one line per day,
+    then a final line with the combined grocery_list and grocery_links."""
+    if not req.children:
+        raise HTTPException(400, "No children")
+    days = max(1, min(MEALPLAN_MAX_DAYS, req.days))
+    children = [(c.get("name") or f"child {i+1}", float(c.get("age_years", 4.0))) for i, c in enumerate(req.children)]
+    frames = (json.dumps(f) + "\n" for f in CONTENT.current.meal_planner.stream(req.budget, children, days))
+    return StreamingResponse(frames, media_type="application/x-ndjson")
 
 class GroceryDownloadRequest(BaseModel):
     grocery_list: Dict[str, float]
@@ -185,340 +226,548 @@ def mealplan_groceries_txt(req: GroceryDownloadRequest):
     text = "\n".join(lines)
     return PlainTextResponse(text, media_type="text/plain")
 
-    # ---------- Meal Planner ----------
-MEAL_DB = {
-    "breakfast": [
-        {
-            "name": "Oatmeal with banana",
-            "ingredients": {"rolled oats (g)": 40, "milk or alt (ml)": 200, "banana": 0.5, "honey (tsp)": 1},
-            "budget": {"low": {}, "mid": {"honey (tsp)": 1}, "high": {"berries (g)": 30}},
-            "prep_time_min": 6,
-            "instructions": [
-                "Heat milk in a small pot until steaming (do not boil).",
-                "Stir in oats; simmer 3–4 minutes until thick.",
-                "Slice banana; top oatmeal with banana and honey.",
-                "High budget: add berries on top."
-            ],
-            "notes": "Use water for lighter oatmeal. Cool before serving young children."
-        },
-        {
-            "name": "Yogurt & granola cup",
-            "ingredients": {"plain yogurt (g)": 150, "granola (g)": 30, "apple": 0.5},
-            "budget": {"low": {}, "mid": {"granola (g)": 35}, "high": {"berries (g)": 40, "honey (tsp)": 1}},
-            "prep_time_min": 4,
-            "instructions": [
-                "Layer yogurt in a cup or bowl.",
-                "Top with granola and chopped apple.",
-                "High budget: add berries and a drizzle of honey."
-            ],
-            "notes": "Use low‑sugar granola for kids."
-        }
-    ],
-    "lunch": [
-        {
-            "name": "Turkey & cheese sandwich",
-            "ingredients": {"wholegrain bread (slices)": 2, "turkey slices": 2, "cheese slice": 1, "cucumber (slices)": 4},
-            "budget": {"low": {"cheese slice": 0.5}, "mid": {}, "high": {"tomato (slices)": 2, "spinach handful": 1}},
-            "prep_time_min": 5,
-            "instructions": [
-                "Layer turkey and cheese between bread.",
-                "Add cucumber; high budget: add tomato and spinach.",
-                "Cut into small squares or triangles."
-            ],
-            "notes": "Swap turkey for hummus for a veggie option."
-        },
-        {
-            "name": "Veggie pasta",
-            "ingredients": {"pasta (g)": 60, "tomato sauce (g)": 120, "frozen veggies (g)": 60},
-            "budget": {"low": {}, "mid": {"parmesan (tbsp)": 1}, "high": {"olive oil (tsp)": 1, "fresh basil (leaves)": 3}},
-            "prep_time_min": 15,
-            "instructions": [
-                "Boil pasta in salted water until tender.",
-                "Warm sauce with frozen veggies in a pan.",
-                "Stir pasta into sauce.",
-                "Mid: sprinkle parmesan. High: add olive oil and basil."
-            ],
-            "notes": "Use small pasta shapes for toddlers."
-        }
-    ],
-    "snack": [
-        {
-            "name": "Carrot sticks & hummus",
-            "ingredients": {"carrot": 0.5, "hummus (tbsp)": 2},
-            "budget": {"low": {}, "mid": {}, "high": {"cucumber (sticks)": 4}},
-            "prep_time_min": 3,
-            "instructions": [
-                "Cut carrot into sticks.",
-                "Serve with hummus. High budget: add cucumber sticks."
-            ],
-            "notes": "Steam carrots briefly for very young children."
-        },
-        {
-            "name": "Apple slices & peanut butter",
-            "ingredients": {"apple": 0.5, "peanut butter (tbsp)": 1},
-            "budget": {"low": {}, "mid": {}, "high": {"raisins (tbsp)": 1}},
-            "prep_time_min": 2,
-            "instructions": [
-                "Slice apple thinly.",
-                "Serve with peanut butter. High budget: sprinkle raisins."
-            ],
-            "notes": "Check for nut allergies; use seed butter if needed."
-        }
-    ],
-    "dinner": [
-        {
-            "name": "Chicken, rice & broccoli",
-            "ingredients": {"chicken (g)": 70, "rice (g)": 50, "broccoli (g)": 60},
-            "budget": {"low": {}, "mid": {"soy sauce (tsp)": 1}, "high": {"sesame oil (tsp)": 0.5}},
-            "prep_time_min": 20,
-            "instructions": [
-                "Steam or boil broccoli until tender.",
-                "Cook rice according to package.",
-                "Pan-cook diced chicken until no longer pink.",
-                "Combine on plate. Mid: soy sauce. High: sesame oil drizzle."
-            ],
-            "notes": "Shred chicken for younger kids."
-        },
-        {
-            "name": "Mild veggie chili",
-            "ingredients": {"kidney beans (g)": 80, "sweetcorn (g)": 40, "tomato passata (g)": 120, "rice (g)": 50},
-            "budget": {"low": {}, "mid": {"cheddar (tbsp)": 1}, "high": {"avocado": 0.25}},
-            "prep_time_min": 25,
-            "instructions": [
-                "Simmer beans, corn, and passata 10–12 minutes (no chili heat).",
-                "Cook rice separately.",
-                "Serve chili over rice. Mid: cheddar. High: sliced avocado."
-            ],
-            "notes": "Rinse canned beans to reduce sodium."
-        }
-    ]
-}
-
 # ---------- Basic endpoints ----------
 @app.post("/signup")
-def signup(parent: Parent):
-    DB["parents"].append(parent.model_dump())
-    log_event("signup", parent.model_dump())
+async def signup(parent: Parent):
+    await asyncio.to_thread(STORE.add_parent, parent.model_dump())
+    await alog_event("signup", parent.model_dump())
     return {"ok": True, "parent": parent}
 
 @app.post("/child")
-def add_child(child: Child):
-    DB["children"].append(child.model_dump())
-    log_event("child_add", child.model_dump())
+async def add_child(child: Child):
+    await asyncio.to_thread(STORE.add_child, child.model_dump())
+    await alog_event("child_add", child.model_dump())
     return {"ok": True, "child": child}
 
-def plan_block(minutes: int, child: Child, focus: str):
-    lang = child.language if child.language in ACTIVITIES else "en"
-    candidates = [a for a in ACTIVITIES[lang]["solo"] if a["minutes"][0] <= minutes <= a["minutes"][1] and child.age_years >= a["age_min"]]
-    if focus != "active":
-        candidates = [a for a in candidates if a["energy"] != "active"] or candidates
-    if not candidates: candidates = ACTIVITIES[lang]["solo"]
-    a = random.choice(candidates)
-    return {"minutes": minutes, "activity": a["name"], "energy": a["energy"]}
-
-@app.post("/plan/day")
-def plan_day(req: DayPlanRequest):
-    blocks = [{"time": req.wake_time, "title": "Wake-up & check-in"}]
-    t = datetime.datetime.strptime(req.wake_time, "%H:%M")
-    for m in req.available_blocks_min:
-        block = plan_block(m, req.child, req.focus)
+def _candidates(content: ContentSnapshot, lang: str, minutes: int, age: float, focus: str):
+    with span("catalog_lookup"):
+        idx = content.activity_index[(lang, "solo")]
+        items, n = idx.lookup(minutes, age, calm=focus != "active")
+        if not n and focus != "active": items, n = idx.lookup(minutes, age)
+        if not n: items, n = idx.activities, len(idx.activities)
+        return items, n
+
+def plan_block(minutes: int, child: Child, focus: str, memo: Optional[Dict] = None,
+               content: Optional[ContentSnapshot] = None):
+    with span("plan_block"):
+        content = content or CONTENT.current
+        lang = child.language if child.language in content.activities else "en"
+        if memo is None:
+            items, n = _candidates(content, lang, minutes, child.age_years, focus)
+        else:
+            # batch planning: jobs with the same language/minutes/age/focus share one lookup
+            key = (lang, minutes, child.age_years, focus != "active")
+            hit = memo.get(key)
+            if hit is None:
+                hit = memo[key] = _candidates(content, lang, minutes, child.age_years, focus)
+            items, n = hit
+        a = items[random.randrange(n)]
+        return {"minutes": minutes, "activity": a["name"], "energy": a["energy"]}
+
+def _day_blocks(child: Child, wake_time: str, minutes: List[int], focus: str, memo: Optional[Dict] = None,
+                content: Optional[ContentSnapshot] = None):
+    content = content or CONTENT.current
+    blocks = [{"time": wake_time, "title": "Wake-up & check-in"}]
+    t = datetime.datetime.strptime(wake_time, "%H:%M")
+    for m in minutes:
+        block = plan_block(m, child, focus, memo, content)
         t_end = t + datetime.timedelta(minutes=m)
         blocks.append({"start": t.strftime("%H:%M"), "end": t_end.strftime("%H:%M"), "plan": block})
         t = t_end + datetime.timedelta(minutes=5)
-    log_event("plan_day", {"child": req.child.model_dump(), "blocks": req.available_blocks_min})
-    return {"ok": True, "blocks": blocks, "note": "Adult supervision required."}
+    return blocks
+
+@app.post("/plan/day")
+async def plan_day(req: DayPlanRequest):
+    blocks = _day_blocks(req.child, req.wake_time, req.available_blocks_min, req.focus)
+    reminders = await asyncio.to_thread(schedule_block_reminders, req.child.name, req.date, blocks, req.parent) if req.parent else 0
+    await alog_event("plan_day", {"child": req.child.model_dump(), "blocks": req.available_blocks_min})
+    return {"ok": True, "blocks": blocks, "reminders": reminders, "note": "Adult supervision required."}
+
+class PlanJob(BaseModel):
+    child: Child
+    date: Optional[str] = None  # YYYY-MM-DD, needed for the combined ICS
+    wake_time: str = "07:00"
+    blocks: List[int] = [20, 30, 40]
+    focus: Optional[str] = "calm"
+    parent: Optional[str] = None  # parent email for block reminders (needs date)
+
+class PlanBatchRequest(BaseModel):
+    jobs: List[PlanJob]
+    org: Optional[str] = None
+    include_ics: bool = False
+
+@app.post("/plan/batch")
+def plan_batch(req: PlanBatchRequest):
+    """Plans many child/day jobs in one call, streamed back as NDJSON (one line per job).
+
+    With include_ics, a final {"ics": ...} line holds one calendar for every dated job.
+    """
+    if len(req.jobs) > PLAN_BATCH_MAX:
+        raise HTTPException(413, f"At most {PLAN_BATCH_MAX} jobs per batch")
+    log_event("plan_batch", {"jobs": len(req.jobs), "org": req.org})
+
+    def frames():
+        memo: Dict = {}  # lookups are only shared within one content snapshot
+        content = CONTENT.current
+        events: List[str] = []
+        for i, job in enumerate(req.jobs):
+            try:
+                blocks = _day_blocks(job.child, job.wake_time, job.blocks, job.focus, memo, content)
+                job_events = ics.vevents(job.child.name, job.date, blocks) if req.include_ics and job.date else []
+            except ValueError as e:  # bad wake_time or date: this job fails, the rest of the batch streams on
+                yield json.dumps({"job": i, "ok": False, "error": str(e)}) + "\n"
+                continue
+            events += job_events
+            if job.parent and job.date:
+                schedule_block_reminders(job.child.name, job.date, blocks, job.parent)
+            yield json.dumps({"job": i, "ok": True, "child": job.child.name, "date": job.date, "blocks": blocks}) + "\n"
+        if req.include_ics:
+            yield json.dumps({"ics": ics.calendar(events)}) + "\n"
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
 
 @app.post("/activities/suggest")
-def activities_suggest(req: ActivitySuggestRequest):
-    lang = req.child.language if req.child.language in ACTIVITIES else "en"
-    pool = ACTIVITIES[lang][req.mode]
-    out = [a for a in pool if a["minutes"][0] <= req.minutes <= a["minutes"][1] and req.child.age_years >= a["age_min"]]
-    if not out: out = pool
-    log_event("activities_suggest", {"minutes": req.minutes, "mode": req.mode})
+async def activities_suggest(req: ActivitySuggestRequest):
+    content = CONTENT.current
+    lang = req.child.language if req.child.language in content.activities else "en"
+    idx = content.activity_index.get((lang, req.mode))
+    if idx is None: raise HTTPException(400, "Unknown mode")
+    items, n = idx.lookup(req.minutes, req.child.age_years)
+    out = items[:min(n, 5)] if n else idx.activities
+    await alog_event("activities_suggest", {"minutes": req.minutes, "mode": req.mode, "lang": lang, "org": req.child.org,
+                                            "activity": out[0]["name"] if out else None})
     return {"ok": True, "suggestions": out[:5]}
 
 @app.post("/story/generate")
-def story_generate(req: StoryRequest):
+async def story_generate(req: StoryRequest):
     lang = req.child.language
-    seeds = ST_NL if lang == "nl" else ST_EN
-    seed = random.choice(seeds)
-    child_name = req.child.name or ("je kind" if lang=="nl" else "your child")
-    story = seed["template"].format(child=child_name)
-    if req.bilingual:
-        if lang == "nl":
-            alt = random.choice(ST_EN)["template"].format(child=child_name); story += "\n\n[English] " + alt
-        else:
-            alt = random.choice(ST_NL)["template"].format(child=child_name); story += "\n\n[Nederlands] " + alt
-    log_event("story", {"title": seed["title"], "lang": lang})
-    return {"ok": True, "title": seed["title"], "story": story}
+    seed = req.seed if req.seed is not None else random.randrange(1 << 30)
+    story = CONTENT.current.stories.render(lang, req.theme, req.length_min, seed, req.child.name, req.bilingual)
+    await alog_event("story", {"title": story["title"], "lang": lang, "org": req.child.org})
+    return {"ok": True, **story}
+
+@app.post("/story/batch")
+async def story_batch(req: StoryBatchRequest):
+    """A run of stories for consecutive nights (e.g. a week of bedtime routine), one call for the client to prefetch."""
+    seed = req.seed if req.seed is not None else random.randrange(1 << 30)
+    engine = CONTENT.current.stories
+    stories = [engine.render(req.child.language, req.theme, req.length_min, seed + n, req.child.name, req.bilingual)
+               for n in range(req.nights)]
+    await alog_event("story_batch", {"nights": req.nights, "lang": req.child.language, "org": req.child.org})
+    return {"ok": True, "stories": stories}
 
 @app.post("/session/start")
-def session_start(req: SessionStartRequest):
+async def session_start(req: SessionStartRequest):
     flow = [
         {"phase":"warmup","minutes":5,"action":"calm breathing + choose mascot plush"},
         {"phase":"core","minutes":max(5, req.duration_min-10),"action":"guided solo activity"},
         {"phase":"winddown","minutes":5,"action":"short story + tidy-up song"}
     ]
-    DB["sessions"].append({"child": req.child.model_dump(), "duration": req.duration_min})
-    DB["time_saved_min"] += req.duration_min
-    log_event("session_start", {"duration": req.duration_min})
-    return {"ok": True, "flow": flow, "safety":"Adult must be reachable at all times."}
+    sid = await asyncio.to_thread(SESSIONS.start, req.child.name, req.child.language, req.child.org, req.goal,
+                                  req.duration_min)
+    await alog_event("session_start", {"session": sid, "child": req.child.name, "duration": req.duration_min,
+                                       "lang": req.child.language, "org": req.child.org})
+    return {"ok": True, "session_id": sid, "flow": flow, "safety":"Adult must be reachable at all times."}
+
+@app.post("/session/heartbeat")
+def session_heartbeat(req: SessionRef):
+    out = SESSIONS.heartbeat(req.session_id)
+    if out is None:
+        raise HTTPException(404, "unknown session")
+    return {"ok": True, **out}
+
+@app.post("/session/end")
+def session_end(req: SessionRef):
+    record = SESSIONS.end(req.session_id)
+    if record is None:
+        raise HTTPException(404, "unknown session")
+    return {"ok": True, "session_id": req.session_id, "minutes": record["minutes"]}
+
+@app.get("/admin/metrics/sessions")
+def admin_sessions():
+    return {"ok": True, **SESSIONS.stats()}
 
 @app.get("/metrics/timesaved")
-def metrics_timesaved():
-    return {"ok": True, "minutes_saved_total": DB["time_saved_min"], "sessions": len(DB["sessions"])}
+async def metrics_timesaved(request: Request):
+    async def compute():
+        await EVENTS.aflush()
+        await asyncio.to_thread(METRICS.follow, SEGMENTS)
+        return {"ok": True, **METRICS.totals()}
+    return await RESPONSES.respond(request, compute, RESPONSE_CACHE_TTL_S, tags=("sessions",))
 
 @app.get("/admin/metrics/aggregate")
-def admin_metrics():
+async def admin_metrics(request: Request):
+    return await RESPONSES.respond(request, lambda: asyncio.to_thread(_aggregate), RESPONSE_CACHE_TTL_S,
+                                   tags=("sessions", "accounts"))
+
+def _aggregate() -> Dict[str, Any]:
+    EVENTS.flush()
+    METRICS.follow(SEGMENTS)
+    snap = METRICS.snapshot()
+    counts = STORE.counts()
     return {
-        "sessions": len(DB.get("sessions", [])),
-        "minutes_saved_total": DB.get("time_saved_min", 0),
-        "children": len(DB.get("children", [])),
-        "parents": len(DB.get("parents", [])),
+        "sessions": snap["kinds"].get("session_start", 0),
+        "minutes_saved_total": snap["minutes_total"],
+        "children": counts["children"],
+        "parents": counts["parents"],
+        "events": snap["kinds"],
+        "by_org": snap["by_org"],
+        "by_lang": snap["by_lang"],
     }
 
 @app.get("/admin/metrics/timeseries")
-def admin_timeseries():
+async def admin_timeseries(request: Request, start: Optional[str] = None, end: Optional[str] = None):
     """
-    Returns daily totals of minutes saved based on recorded sessions.
-    Also parses the events log (if present) for historical sessions.
+    Returns daily totals of minutes saved, from the 'session_end' events of finished sessions.
+    Sealed days are read from their segment summaries; only the tail of the
+    open (today's) segment is parsed, so cost scales with days, not events.
+    Optional start/end (YYYY-MM-DD) bound the range.
     """
-    series = defaultdict(int)
-
-    # 1) Count current in‑memory sessions
-    for s in DB.get("sessions", []):
-        # Bucket into "today" for simplicity (MVP doesn’t timestamp sessions)
-        today = datetime.now(timezone.utc).date()
-        series[str(today)] += int(s.get("duration", 0))
-
-    # 2) Parse events log if it exists (Pro version writes 'session_start' events)
-    path = DB.get("events_path")
-    try:
-        with open(path) as f:
-            for line in f:
-                try:
-                    obj = json.loads(line)
-                    if obj.get("kind") == "session_start":
-                        dt = datetime.fromtimestamp(obj["ts"], tz=timezone.utc).date()
-                        series[str(dt)] += int(obj["payload"].get("duration", 0))
-                except Exception:
-                    pass
-    except Exception:
-        pass
-
-    items = sorted(series.items(), key=lambda x: x[0])
-    return {"ok": True, "days": [d for d,_ in items], "minutes": [m for _,m in items]}
+    async def compute():
+        await EVENTS.aflush()
+        days, minutes = [], []
+        for day, summ in await SEGMENTS.asummaries(start, end):
+            if summ["session_minutes"]:
+                days.append(day); minutes.append(summ["session_minutes"])
+        return {"ok": True, "days": days, "minutes": minutes}
+    return await RESPONSES.respond(request, compute, RESPONSE_CACHE_TTL_S, tags=("sessions",))
+
+@app.get("/admin/metrics/query")
+async def admin_metrics_query(start: Optional[str] = None, end: Optional[str] = None, group_by: str = "",
+                              kind: str = "", org: str = "", lang: str = "", activity: str = ""):
+    """
+    Event counts and session minutes grouped by any of day, kind, org, lang and
+    activity (comma-separated group_by), filtered by comma-separated values of
+    kind/org/lang/activity and an optional start/end (YYYY-MM-DD) day range.
+    """
+    if not COLUMNAR_AVAILABLE:
+        raise HTTPException(503, "NumPy is not installed")
+    groups = [g for g in group_by.split(",") if g]
+    if any(g not in COLUMNAR_DIMS for g in groups) or len(set(groups)) != len(groups):
+        raise HTTPException(400, f"group_by takes distinct values of {', '.join(COLUMNAR_DIMS)}")
+    filters = {d: [v for v in raw.split(",") if v] for d, raw in (("kind", kind), ("org", org), ("lang", lang), ("activity", activity))}
+    await EVENTS.aflush()
+    result = await asyncio.to_thread(COLUMNS.query, start, end, filters, groups)
+    return {"ok": True, "group_by": groups, **result}
+
+@app.get("/admin/metrics/columnar")
+def admin_columnar():
+    # conversion job counters and mapped-file cache
+    return {"ok": True, **COLUMNS.stats()}
+
+@app.get("/admin/metrics/caches")
+def admin_caches():
+    content = CONTENT.current
+    return {"ok": True, "mealplan": content.meal_planner.cache.stats(), "ics": ICS_CACHE.stats(),
+            "story": content.stories.cache.stats(), "responses": RESPONSES.stats()}
+
+@app.get("/admin/startup")
+def admin_startup():
+    # init phase timings, and which optional integrations this worker has loaded so far (they load on first use)
+    lazy = {name: name in sys.modules for name in ("authlib", "pywebpush", "requests", "numpy")}
+    return {"ok": True, "phases_ms": STARTUP, "content_restored": CONTENT.stats()["restored"],
+            "modules": len(sys.modules), "loaded": lazy}
+
+@app.get("/admin/content")
+def admin_content():
+    # live content version, last build timings and reload errors
+    return {"ok": True, **CONTENT.stats()}
+
+@app.post("/admin/content/reload")
+def admin_content_reload():
+    reloaded = CONTENT.reload()
+    return {"ok": True, "reloaded": reloaded, **CONTENT.stats()}
+
+@app.get("/admin/metrics/eventlog")
+def admin_eventlog():
+    # queue depth, flush latency and backpressure counters of the background writer
+    return {"ok": True, **EVENTS.stats()}
     
 # ---------- Calendar (.ics) ----------
-from pydantic import BaseModel
+class Repeat(BaseModel):
+    freq: str = "DAILY"  # DAILY | WEEKLY
+    interval: Optional[int] = None
+    count: Optional[int] = None
+    until: Optional[str] = None  # YYYY-MM-DD
+    byday: List[str] = []        # MO..SU
+
 class ICSRequest(BaseModel):
     child: Child
     date: str  # YYYY-MM-DD
     plan: List[Dict[str, Any]]
+    parent: Optional[str] = None  # parent email: push a reminder before each block
+    repeat: Optional[Repeat] = None  # emitted as an RRULE on each event instead of one VEVENT per day
+
+# rendered bodies keyed on their ETag, so a repeated plan keeps its DTSTAMP and costs no re-render
+ICS_CACHE = LRUCache(ICS_CACHE_SIZE)
+
+def _not_modified(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm: return False
+    tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+    return "*" in tags or etag in tags
 
-def ics_escape(s:str)->str:
-    return s.replace(",", r"\,").replace(";", r"\;")
+def _ics_response(body: str, etag: str) -> PlainTextResponse:
+    return PlainTextResponse(body, media_type="text/calendar", headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def _ics_etag(req: ICSRequest) -> str:
+    repeat = req.repeat.model_dump(exclude_none=True) if req.repeat else None
+    return ics.etag_of(ics.content_hash(req.child.name, req.date, req.plan, repeat))
+
+def _ics_events(req: ICSRequest) -> List[str]:
+    try:
+        return ics.vevents(req.child.name, req.date, req.plan, req.repeat.model_dump(exclude_none=True) if req.repeat else None)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
-from fastapi.responses import PlainTextResponse
 @app.post("/integrations/calendar/ics")
-def make_ics(req: ICSRequest):
-    lines = ["BEGIN:VCALENDAR","VERSION:2.0","PRODID:-//Haven//AI Nanny//EN"]
-    for item in req.plan:
-        title = item.get("plan",{}).get("activity","Haven Activity")
-        start = item.get("start"); end = item.get("end")
-        if not (start and end): continue
-        dt = datetime.datetime.strptime(req.date+" "+start, "%Y-%m-%d %H:%M")
-        dt_end = datetime.datetime.strptime(req.date+" "+end, "%Y-%m-%d %H:%M")
-        uid = hashlib.sha1(f"{req.child.name}{dt}".encode()).hexdigest()+"@haven"
-        lines += ["BEGIN:VEVENT",
-                  f"UID:{uid}",
-                  f"DTSTAMP:{datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}",
-                  f"DTSTART:{dt.strftime('%Y%m%dT%H%M%S')}",
-                  f"DTEND:{dt_end.strftime('%Y%m%dT%H%M%S')}",
-                  f"SUMMARY:{ics_escape(title)}",
-                  "END:VEVENT"]
-    lines.append("END:VCALENDAR")
-    return PlainTextResponse("\\r\\n".join(lines), media_type="text/calendar")
+def make_ics(req: ICSRequest, request: Request):
+    etag = _ics_etag(req)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    body = ICS_CACHE.get(etag)
+    if body is None:
+        body = ics.calendar(_ics_events(req))
+        ICS_CACHE.put(etag, body)
+    schedule_block_reminders(req.child.name, req.date, req.plan, req.parent)
+    return _ics_response(body, etag)
+
+@app.post("/integrations/calendar/feeds")
+def publish_feed(req: ICSRequest):
+    """Stores a day plan in the child's subscribable feed; the day is re-rendered only if its content changed."""
+    etag, events = _ics_etag(req), _ics_events(req)
+    token = STORE.feed_token(req.child.name)
+    changed = STORE.put_feed_day(token, req.date, etag, "\n".join(events))
+    if changed:
+        schedule_block_reminders(req.child.name, req.date, req.plan, req.parent)
+    return {"ok": True, "url": f"/integrations/calendar/feeds/{token}.ics", "changed": changed}
+
+@app.get("/integrations/calendar/feeds/{token}.ics")
+def get_feed(token: str, request: Request):
+    days = STORE.feed_days(token)
+    if days is None: raise HTTPException(404, "Unknown feed")
+    etag = ics.etag_of(ics.content_hash(token, [(d, t) for d, t, _ in days]))
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    body = ICS_CACHE.get(etag)
+    if body is None:
+        body = ics.calendar((l for _, _, ev in days for l in ev.split("\n") if l), name="Haven")
+        ICS_CACHE.put(etag, body)
+    return _ics_response(body, etag)
 
 # ---------- Web Push ----------
 class PushSubscription(BaseModel):
     endpoint: str
     keys: Dict[str, str]
+    org: Optional[str] = None
+    parent: Optional[str] = None  # parent email
+
+def _import_legacy_subscriptions():
+    # subscriptions used to live in one JSON file that was rewritten on every registration
+    legacy = os.path.join(DATA_DIR, "subscriptions.json")
+    if not os.path.exists(legacy): return
+    try:
+        with open(legacy) as f: data = json.load(f)
+    except Exception:
+        data = []
+    for sub in data:
+        if sub.get("endpoint"): STORE.add_subscription(sub)
+    os.replace(legacy, legacy + ".migrated")
+
+_import_legacy_subscriptions()
 
 @app.get("/notifications/publickey")
-def publickey():
-    return {"key": VAPID_PUBLIC_KEY}
+async def publickey(request: Request):
+    return await RESPONSES.respond(request, lambda: {"key": VAPID_PUBLIC_KEY}, 3600)  # config: only a restart changes it
 
 @app.post("/notifications/register")
 def notifications_register(sub: PushSubscription):
-    subs_path = "data/subscriptions.json"
-    try:
-        data = json.load(open(subs_path,"r"))
-    except Exception:
-        data = []
-    if not any(s.get("endpoint")==sub.endpoint for s in data):
-        data.append(sub.model_dump())
-        json.dump(data, open(subs_path,"w"))
-    log_event("push_register", {"count": len(data)})
-    return {"ok": True, "registered": len(data)}
+    created, count = STORE.add_subscription({"endpoint": sub.endpoint, "keys": sub.keys}, sub.org, sub.parent)
+    log_event("push_register", {"count": count, "new": created, "org": sub.org})
+    return {"ok": True, "registered": count}
 
 from pydantic import BaseModel
 class PushMessage(BaseModel):
     title: str
     body: str
+    org: Optional[str] = None     # only this org's subscriptions
+    parent: Optional[str] = None  # only this parent's subscriptions
+
+PUSH = PushDispatcher(VAPID_PRIVATE_KEY, VAPID_CLAIMS, workers=PUSH_WORKERS, timeout=PUSH_TIMEOUT_S,
+                      retries=PUSH_RETRIES, backoff_s=PUSH_BACKOFF_S,
+                      on_expired=lambda sub: STORE.remove_subscription(sub["endpoint"]))
 
 @app.post("/notifications/test")
 def notifications_test(msg: PushMessage):
-    subs_path = "data/subscriptions.json"
-    if not os.path.exists(subs_path): 
+    subs = STORE.subscriptions(org=msg.org, parent=msg.parent)
+    if not subs:
         raise HTTPException(400,"No subscriptions")
-    subs = json.load(open(subs_path,"r"))
-    sent = 0
-    for s in subs:
+    with span("notifications_test"):
+        report = PUSH.send_all(subs, {"title": msg.title, "body": msg.body})
+    log_event("push_send", {"attempted": report["attempted"], "sent": report["sent"], "expired": report["expired"], "org": msg.org})
+    return {"ok": True, **report}
+
+@app.get("/admin/metrics/push")
+def admin_push():
+    return {"ok": True, **PUSH.stats()}
+
+# ---------- Reminders ----------
+def _fire_reminders(due: float, reminders: List[Dict[str, Any]]):
+    # one push per parent per due time, however many blocks start then
+    by_parent: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for r in reminders:
+        by_parent[r["parent"]].append(r)
+    for parent, items in by_parent.items():
+        subs = STORE.subscriptions(parent=parent)
+        if not subs: continue
+        if len(items) == 1:
+            payload = {"title": items[0]["title"], "body": items[0]["body"]}
+        else:
+            payload = {"title": f"{len(items)} Haven activities starting", "body": "\n".join(r["body"] for r in items)}
+        PUSH.send_all(subs, payload)
+    log_event("reminder_fire", {"due": due, "count": len(reminders), "parents": len(by_parent)})
+
+with startup_phase("reminders"):
+    REMINDERS = ReminderScheduler(STORE, _fire_reminders, coalesce_s=REMINDER_COALESCE_S)
+    if REMINDERS_ENABLED:
+        REMINDERS.start()
+
+def schedule_block_reminders(child_name: str, date: Optional[str], blocks: List[Dict[str, Any]], parent: Optional[str]) -> int:
+    """Queues a push REMINDER_LEAD_MIN before each future block of a plan (server local time).
+
+    Reminders are keyed on (parent, child, date, block start), so posting the same plan again
+    queues nothing new; returns how many reminders were newly queued.
+    """
+    if not (parent and REMINDERS_ENABLED): return 0
+    date = date or datetime.date.today().isoformat()
+    now = time.time()
+    pending = []
+    for b in blocks:
+        start = b.get("start")
+        if not start: continue
         try:
-            webpush(subscription_info=s, data=json.dumps({"title": msg.title, "body": msg.body}),
-                    vapid_private_key=VAPID_PRIVATE_KEY, vapid_claims=VAPID_CLAIMS)
-            sent += 1
-        except WebPushException:
+            due = time.mktime(datetime.datetime.strptime(f"{date} {start}", "%Y-%m-%d %H:%M").timetuple()) - REMINDER_LEAD_MIN * 60
+        except ValueError:
             continue
-    log_event("push_send", {"attempted": len(subs), "sent": sent})
-    return {"ok": True, "sent": sent}
+        if due <= now: continue
+        activity = (b.get("plan") or {}).get("activity", "Haven activity")
+        pending.append({"due": due, "parent": parent, "child": child_name, "title": f"{activity} at {start}",
+                        "body": f"{child_name}: {activity} starts at {start}.",
+                        "key": "\n".join((parent, child_name, date, start))})
+    return REMINDERS.schedule(pending)
+
+@app.get("/admin/metrics/reminders")
+def admin_reminders():
+    return {"ok": True, **REMINDERS.stats()}
+
+# ---------- Instrumentation ----------
+def _component_gauges():
+    ev = EVENTS.stats()
+    yield "haven_eventlog_queue_depth", {}, ev["queue_depth"]
+    yield "haven_eventlog_pending", {}, ev["pending"]
+    yield "haven_content_version", {}, CONTENT.current.version
+    content = CONTENT.current
+    for name, cache in (("mealplan", content.meal_planner.cache), ("story", content.stories.cache), ("ics", ICS_CACHE)):
+        yield "haven_cache_hit_rate", {"cache": name}, cache.stats()["hit_rate"]
+    push = PUSH.stats()
+    for k in ("sent", "failed", "expired"):
+        yield "haven_push_sends", {"status": k}, push[k]
+    yield "haven_reminders_pending", {}, REMINDERS.stats()["pending"]
+INSTRUMENTS.gauges.append(_component_gauges)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(INSTRUMENTS.render(), media_type="text/plain; version=0.0.4")
+
+class ProfilerToggle(BaseModel):
+    enabled: bool
+    slow_ms: float = PROFILER_SLOW_MS
+    interval_ms: float = PROFILER_INTERVAL_MS
+
+def _set_profiler(enabled: bool, slow_ms: float = PROFILER_SLOW_MS, interval_ms: float = PROFILER_INTERVAL_MS):
+    old, INSTRUMENTS.profiler = INSTRUMENTS.profiler, None
+    if old is not None: old.stop()
+    if enabled:
+        prof = SamplingProfiler(interval_ms=interval_ms, slow_ms=slow_ms)
+        prof.start()
+        INSTRUMENTS.profiler = prof
+if PROFILER_ENABLED:
+    _set_profiler(True)
+
+@app.post("/admin/profiler")
+def admin_profiler_toggle(req: ProfilerToggle):
+    """Starts/stops the sampling profiler; restarting drops the captured slow requests."""
+    _set_profiler(req.enabled, req.slow_ms, req.interval_ms)
+    return {"ok": True, "enabled": req.enabled}
+
+@app.get("/admin/profiler")
+def admin_profiler():
+    prof = INSTRUMENTS.profiler
+    if prof is None: return {"ok": True, "enabled": False, "slow": []}
+    return {"ok": True, "enabled": True, "slow_ms": prof.slow_s * 1000.0,
+            "slow": [{k: v for k, v in r.items() if k != "folded"} for r in prof.slow]}
+
+@app.get("/admin/profiler/folded")
+def admin_profiler_folded():
+    # collapsed stacks of the captured slow requests: feed to flamegraph.pl or speedscope
+    prof = INSTRUMENTS.profiler
+    return PlainTextResponse(prof.folded() if prof else "", media_type="text/plain")
 
 # ---------- Privacy Controls ----------
 @app.get("/privacy/export")
-def privacy_export():
-    bundle = {"parents": DB["parents"], "children": DB["children"], "sessions": DB["sessions"]}
-    return bundle
+def privacy_export(child: Optional[str] = None, email: Optional[str] = None, format: str = "ndjson",
+                   start: Optional[str] = None, end: Optional[str] = None):
+    """
+    Without a subject: the stored profiles as one JSON object. With ?child= or ?email=:
+    that subject's stored records and every logged event that mentions them, streamed
+    as NDJSON (format=ndjson) or one JSON document (format=json). Events are located
+    through the subject index; start/end (YYYY-MM-DD) bound the days read.
+    """
+    if child is None and email is None:
+        return STORE.export()
+    if child is not None and email is not None:
+        raise HTTPException(400, "export one subject at a time: child or email")
+    if format not in ("ndjson", "json"):
+        raise HTTPException(400, "format must be ndjson or json")
+    EVENTS.flush()
+    subject = child_subject(child) if child is not None else email_subject(email)
+    ext, media = ("ndjson", "application/x-ndjson") if format == "ndjson" else ("json", "application/json")
+    return StreamingResponse(export_stream(STORE, SEGMENTS, subject, format, start, end), media_type=media,
+                             headers={"Content-Disposition": f'attachment; filename="haven-export.{ext}"'})
 
 @app.delete("/privacy/child/{name}")
 def privacy_delete_child(name: str):
-    before = len(DB["children"])
-    DB["children"] = [c for c in DB["children"] if c.get("name") != name]
-    after = len(DB["children"])
-    log_event("child_delete", {"name": name})
-    return {"ok": True, "removed": before - after}
+    """Deletes the child's profiles and redacts their logged events in place (see SegmentStore.redact)."""
+    removed = STORE.delete_children(name)
+    EVENTS.flush()
+    report = SEGMENTS.redact(child_subject(name), scrub_event)
+    log_event("child_delete", {"removed": removed, **report})  # no name: the log must not re-identify them
+    return {"ok": True, "removed": removed, **report}
 
 @app.delete("/privacy/wipe")
 def privacy_wipe():
-    DB["children"].clear(); DB["parents"].clear(); DB["sessions"].clear(); DB["time_saved_min"] = 0
+    STORE.wipe()
     log_event("wipe", {}); 
     return {"ok": True}
 
+def run_retention() -> Dict[str, int]:
+    # streaming compaction: coordinates with the event writer through the segment lock
+    report = SEGMENTS.compact(time.time() - (RETENTION_DAYS*24*3600))
+    report["kept"] = sum(summ["lines"] for _, summ in SEGMENTS.summaries())
+    return report
+
+def _retention_loop():
+    while True:
+        time.sleep(RETENTION_EVERY_H * 3600)
+        try: run_retention()
+        except Exception: pass
+
+if RETENTION_EVERY_H > 0:
+    threading.Thread(target=_retention_loop, name="haven-retention", daemon=True).start()
+
 @app.post("/privacy/maintenance")
 def privacy_maintenance():
-    cutoff = time.time() - (RETENTION_DAYS*24*3600)
-    path = DB["events_path"]
-    if not os.path.exists(path): return {"ok": True, "pruned": 0}
-    kept = []
-    with open(path) as f:
-        for line in f:
-            try:
-                item = json.loads(line); 
-                if item.get("ts",0) >= cutoff: kept.append(line)
-            except: pass
-    with open(path,"w") as f:
-        for line in kept: f.write(line)
-    return {"ok": True, "kept": len(kept)}
+    return {"ok": True, **run_retention()}
 
 # ---------- Employer / SSO Scaffold ----------
 class Org(BaseModel):
@@ -528,35 +777,33 @@ class Org(BaseModel):
 
 @app.post("/admin/orgs")
 def create_org(org: Org):
-    DB["orgs"][org.org_id] = org.model_dump()
+    STORE.put_org(org.model_dump())
     log_event("org_create", org.model_dump())
-    return {"ok": True, "orgs": list(DB["orgs"].values())}
-
-@app.get("/admin/metrics/aggregate")
-def admin_metrics():
-    return {
-        "sessions": len(DB["sessions"]),
-        "minutes_saved_total": DB["time_saved_min"],
-        "children": len(DB["children"]),
-        "parents": len(DB["parents"]),
-    }
+    return {"ok": True, "orgs": STORE.list_orgs()}
 
 @app.get("/sso/mock/login")
 def sso_mock_login(email: str = "user@example.com", org_id: str = "demo"):
-    DB["parents"].append({"email": email, "name": "Mock User", "org": org_id})
+    STORE.add_parent({"email": email, "name": "Mock User", "org": org_id})
     log_event("sso_mock", {"email": email, "org": org_id})
     return {"ok": True, "email": email, "org": org_id}
 
-# OAuth scaffold (disabled by default)
-oauth = OAuth()
-if ENABLE_GOOGLE:
-    oauth.register(
-        name="google",
-        client_id=OIDC_CLIENT_ID,
-        client_secret=OIDC_CLIENT_SECRET,
-        server_metadata_url=f"{OIDC_ISSUER}/.well-known/openid-configuration",
-        client_kwargs={"scope":"openid email profile"}
-    )
+# OAuth scaffold (disabled by default); authlib is imported and the client registered on first use
+_oauth = None
+
+def google_oauth():
+    global _oauth
+    if _oauth is None:
+        from authlib.integrations.starlette_client import OAuth
+        oauth = OAuth()
+        oauth.register(
+            name="google",
+            client_id=OIDC_CLIENT_ID,
+            client_secret=OIDC_CLIENT_SECRET,
+            server_metadata_url=f"{OIDC_ISSUER}/.well-known/openid-configuration",
+            client_kwargs={"scope":"openid email profile"}
+        )
+        _oauth = oauth
+    return _oauth.google
 
 @app.get("/integrations/google/auth-url")
 def google_auth_url():
@@ -568,13 +815,13 @@ def google_auth_url():
 async def google_login(request: Request):
     if not ENABLE_GOOGLE: raise HTTPException(400,"Disabled")
     redirect_uri = REDIRECT_URI
-    return await oauth.google.authorize_redirect(request, redirect_uri)
+    return await google_oauth().authorize_redirect(request, redirect_uri)
 
 @app.get("/integrations/google/callback")
 async def google_callback(request: Request):
     if not ENABLE_GOOGLE: raise HTTPException(400,"Disabled")
-    token = await oauth.google.authorize_access_token(request)
+    token = await google_oauth().authorize_access_token(request)
     user = token.get("userinfo", {})
-    DB["parents"].append({"email": user.get("email"), "name": user.get("name")})
+    STORE.add_parent({"email": user.get("email"), "name": user.get("name")})
     log_event("sso_google", {"email": user.get("email")})
     return RedirectResponse(url="/")
@@ -0,0 +1,58 @@
+# Small thread-safe LRU cache with hit/miss counters.
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+class LRUCache:
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        # computed outside the lock; two racing misses both compute, the last put wins
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def __getstate__(self):
+        return {"maxsize": self.maxsize}  # entries and counters stay with the process
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__init__(state["maxsize"])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+_MISSING = object()
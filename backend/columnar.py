@@ -0,0 +1,383 @@
+# Columnar copies of the event log for KPI queries.
+# A background job folds sealed events/YYYY-MM-DD.jsonl segments into one
+# partition per month, columns/YYYY-MM.col: a JSON header (dictionaries, the
+# row range and source size of every day) followed by one typed array per
+# column, each 8-byte aligned: ts and session minutes float64, and day, kind,
+# org, lang and activity as int32 codes into the partition's dictionaries
+# (-1 = not set). Queries memory-map the partitions, translate their codes to
+# query-wide ids with one lookup array per dictionary, and filter/group with
+# vectorized NumPy. Days a partition does not cover yet (today, a late write,
+# or a segment rewritten by compaction) are parsed from the log instead,
+# incrementally, so answers always cover the whole log.
+#
+#     python columnar.py convert
+import importlib.util, json, os, struct, sys, threading, time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from cache import LRUCache
+from metrics import event_dims
+from segments import SegmentStore, session_minutes, today
+
+MAGIC = b"HVCOL1\0\0"
+PARTITION_SUFFIX = ".col"
+DIMS = ("day", "kind", "org", "lang", "activity")  # dictionary-encoded; any of them can be grouped on
+FILTERS = DIMS[1:]                                  # days are selected with start/end instead
+DTYPES = {"ts": "<f8", "minutes": "<f8", **{d: "<i4" for d in DIMS}}
+AVAILABLE = importlib.util.find_spec("numpy") is not None  # optional: /admin/metrics/query answers 503 without it
+BINCOUNT_MAX = 1 << 20  # group-key space above which np.unique replaces np.bincount
+np = None  # numpy is imported by _numpy() on first use, off the startup path
+
+def _numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+def event_activity(entry: Dict[str, Any]) -> Optional[str]:
+    a = (entry.get("payload") or {}).get("activity")
+    return a if isinstance(a, str) else None
+
+def month_of(day: str) -> str:
+    return day[:7]
+
+class Table:
+    """Columns (memory-mapped or in memory), their dictionaries and day -> [source bytes, first row, end row]."""
+    __slots__ = ("cols", "vocab", "codes", "days", "rows", "remap")
+
+    def __init__(self, cols: Dict[str, Any], vocab: Dict[str, List[str]], days: Dict[str, List[int]]):
+        self.cols = cols
+        self.vocab = vocab
+        self.codes = {d: {v: i for i, v in enumerate(vocab[d])} for d in DIMS}
+        self.days = days
+        self.rows = len(cols["ts"])
+        self.remap: Dict[str, Any] = {}  # dim -> local code to query-wide id (see ColumnarStore._ids_for)
+
+class ColumnBuilder:
+    """Builds a Table from log lines and from day ranges of an existing table."""
+
+    def __init__(self):
+        self.vocab: Dict[str, Dict[str, int]] = {d: {} for d in DIMS}
+        self.chunks: List[Dict[str, Any]] = []                     # column arrays ready to concatenate
+        self.rows: Dict[str, List[Any]] = {c: [] for c in DTYPES}  # parsed lines not yet in a chunk
+        self.days: Dict[str, List[int]] = {}
+        self.n = 0
+
+    def _code(self, d: str, v: Optional[str]) -> int:
+        if v is None:
+            return -1
+        table = self.vocab[d]
+        code = table.get(v)
+        if code is None:
+            code = table[v] = len(table)
+        return code
+
+    def copy_day(self, t: Table, day: str):
+        """Reuse an already converted day, re-coded into this builder's dictionaries."""
+        source_bytes, start, stop = t.days[day]
+        self._flush()
+        chunk = {"ts": t.cols["ts"][start:stop], "minutes": t.cols["minutes"][start:stop]}
+        for d in DIMS:
+            lookup = np.array([self._code(d, v) for v in t.vocab[d]] + [-1], dtype=DTYPES[d])  # code -1 hits the last slot
+            chunk[d] = lookup[t.cols[d][start:stop]]
+        self.chunks.append(chunk)
+        self.days[day] = [source_bytes, self.n, self.n + stop - start]
+        self.n += stop - start
+
+    def feed(self, day: str, path: str) -> int:
+        """Parse the complete lines of a day segment past what was already fed; returns lines added."""
+        source_bytes, start, _ = self.days.get(day, (0, self.n, self.n))
+        added = 0
+        with open(path, "rb") as f:
+            f.seek(source_bytes)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # line still being appended
+                source_bytes += len(raw)
+                try:
+                    self.add(day, json.loads(raw)); added += 1
+                except Exception:
+                    pass
+        self.n += added
+        self.days[day] = [source_bytes, start, self.n]
+        return added
+
+    def add(self, day: str, e: Dict[str, Any]):
+        kind = e.get("kind")
+        org, lang = event_dims(e)
+        minutes = session_minutes(e)
+        ts = float(e.get("ts", 0))
+        codes = [self._code(d, v) for d, v in zip(DIMS, (day, kind, org, lang, event_activity(e)))]
+        rows = self.rows
+        rows["ts"].append(ts); rows["minutes"].append(minutes)
+        for d, c in zip(DIMS, codes):
+            rows[d].append(c)
+
+    def _flush(self):
+        if self.rows["ts"]:
+            self.chunks.append({c: np.array(v, dtype=DTYPES[c]) for c, v in self.rows.items()})
+            self.rows = {c: [] for c in DTYPES}
+
+    def table(self) -> Table:
+        self._flush()
+        if len(self.chunks) > 1:
+            self.chunks = [{c: np.concatenate([ch[c] for ch in self.chunks]) for c in DTYPES}]
+        cols = self.chunks[0] if self.chunks else {c: np.zeros(0, dtype=dt) for c, dt in DTYPES.items()}
+        return Table(cols, {d: list(v) for d, v in self.vocab.items()}, {k: list(v) for k, v in self.days.items()})
+
+def _pad(n: int) -> int:
+    return (n + 7) & ~7
+
+def write_table(path: str, t: Table):
+    offsets, off = {}, 0
+    for c in DTYPES:
+        offsets[c] = off
+        off += _pad(t.cols[c].nbytes)
+    header = json.dumps({"rows": t.rows, "days": t.days, "vocab": t.vocab, "dtypes": DTYPES, "offsets": offsets}).encode()
+    header += b" " * (_pad(len(header)) - len(header))
+    tmp = f"{path}.{os.getpid()}.tmp"  # several workers may convert the same month; the last replace wins
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for c in DTYPES:
+            data = t.cols[c].tobytes()
+            f.write(data + b"\0" * (_pad(len(data)) - len(data)))
+    os.replace(tmp, path)
+
+def read_header(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            if f.read(8) != MAGIC:
+                return None
+            (n,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(n))
+    except (OSError, ValueError, struct.error):
+        return None
+    header["base"] = 16 + n  # where the columns start
+    return header
+
+def map_table(path: str) -> Optional[Table]:
+    header = read_header(path)
+    if header is None:
+        return None
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    rows, cols = header["rows"], {}
+    for c, dt in header["dtypes"].items():
+        start = header["base"] + header["offsets"][c]
+        cols[c] = np.asarray(mm[start:start + rows * np.dtype(dt).itemsize]).view(dt)
+    return Table(cols, header["vocab"], header["days"])
+
+class ColumnarStore:
+    def __init__(self, root: str, segments: SegmentStore, open_months: int = 64):
+        self.root = root
+        self.segments = segments
+        os.makedirs(root, exist_ok=True)
+        self._mapped = LRUCache(open_months)  # (month, mtime_ns, size) -> Table; each holds one mmap
+        self._tails: Dict[str, ColumnBuilder] = {}  # days no partition covers yet, parsed incrementally
+        self._tail_lock = threading.Lock()
+        self._ids: Dict[str, Dict[str, int]] = {d: {} for d in DIMS}  # query-wide ids, append-only
+        self._names: Dict[str, List[str]] = {d: [] for d in DIMS}
+        self._ids_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"converted_days": 0, "partitions_written": 0, "removed": 0, "errors": 0,
+                       "last_error": None, "last_run_ms": 0.0}
+
+    def partition_path(self, month: str) -> str:
+        return os.path.join(self.root, month + PARTITION_SUFFIX)
+
+    # ---- conversion ----
+    def convert_sealed(self) -> Dict[str, int]:
+        """(Re)writes month partitions whose sealed days changed; drops partitions of removed segments."""
+        _numpy()
+        t0 = time.perf_counter()
+        report = {"converted_days": 0, "partitions_written": 0, "removed": 0}
+        months: Dict[str, Dict[str, int]] = {}
+        cutoff = today()
+        for day in self.segments.days():
+            if day >= cutoff:
+                break
+            try:
+                months.setdefault(month_of(day), {})[day] = os.path.getsize(self.segments.segment_path(day))
+            except FileNotFoundError:
+                continue  # compacted away meanwhile
+        for month, sizes in sorted(months.items()):
+            path = self.partition_path(month)
+            header = read_header(path)
+            if header is not None and {d: v[0] for d, v in header["days"].items()} == sizes:
+                continue
+            old = map_table(path) if header is not None else None
+            b = ColumnBuilder()
+            for day, size in sorted(sizes.items()):
+                if old is not None and old.days.get(day, [None])[0] == size:
+                    b.copy_day(old, day)
+                else:
+                    b.feed(day, self.segments.segment_path(day))
+                    report["converted_days"] += 1
+            write_table(path, b.table())
+            report["partitions_written"] += 1
+        for name in os.listdir(self.root):
+            if name.endswith(PARTITION_SUFFIX) and name[:-len(PARTITION_SUFFIX)] not in months:
+                try:
+                    os.remove(os.path.join(self.root, name)); report["removed"] += 1
+                except FileNotFoundError:
+                    pass
+        for k, v in report.items():
+            self._stats[k] += v
+        self._stats["last_run_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
+        return report
+
+    def start(self, every_s: float):
+        if every_s <= 0 or self._thread is not None or not AVAILABLE: return
+        def loop():
+            while True:
+                try:
+                    self.convert_sealed()
+                    self._stats["last_error"] = None
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    self._stats["last_error"] = f"{type(e).__name__}: {e}"
+                if self._stop.wait(every_s):
+                    return
+        self._thread = threading.Thread(target=loop, name="haven-columnar", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._tail_lock:
+            log_days = sorted(self._tails)
+        return {**self._stats, "available": AVAILABLE, "mapped": self._mapped.stats(), "log_days": log_days}
+
+    # ---- reads ----
+    def _partition(self, month: str) -> Optional[Table]:
+        path = self.partition_path(month)
+        try:
+            st = os.stat(path)
+            key = (month, st.st_mtime_ns, st.st_size)
+            t = self._mapped.get(key)
+            if t is None:
+                t = map_table(path)
+                if t is not None: self._mapped.put(key, t)
+            return t
+        except (OSError, ValueError):
+            return None  # missing, or replaced while we mapped it
+
+    def _tail(self, day: str, size: int) -> Table:
+        with self._tail_lock:
+            b = self._tails.get(day)
+            if b is None or b.days[day][0] > size:  # new, or rewritten by compaction
+                b = self._tails[day] = ColumnBuilder()
+            if b.days.get(day, [0])[0] < size:
+                b.feed(day, self.segments.segment_path(day))
+            return b.table()
+
+    def tables(self, start: Optional[str] = None, end: Optional[str] = None) -> List[Tuple[Table, List[str], bool]]:
+        """(table, its days to read, from a partition?) covering every segment day in [start, end]."""
+        _numpy()
+        by_month: Dict[str, Dict[str, int]] = {}
+        for day in self.segments.days():
+            if (start and day < start) or (end and day > end):
+                continue
+            try:
+                by_month.setdefault(month_of(day), {})[day] = os.path.getsize(self.segments.segment_path(day))
+            except FileNotFoundError:
+                pass
+        out: List[Tuple[Table, List[str], bool]] = []
+        for month, sizes in sorted(by_month.items()):
+            part = self._partition(month)
+            covered = [d for d, size in sizes.items() if part is not None and part.days.get(d, [None])[0] == size]
+            if covered:
+                out.append((part, covered, True))
+                with self._tail_lock:
+                    for d in covered: self._tails.pop(d, None)
+            for day, size in sorted(sizes.items()):
+                if day not in covered:
+                    out.append((self._tail(day, size), [day], False))
+        return out
+
+    def _ids_for(self, t: Table, d: str):
+        """Lookup array from the table's codes for dimension d to query-wide ids (last slot: not set)."""
+        ids = t.remap.get(d)
+        if ids is None or len(ids) != len(t.vocab[d]) + 1:
+            with self._ids_lock:
+                table, names, out = self._ids[d], self._names[d], []
+                for v in t.vocab[d]:
+                    i = table.get(v)
+                    if i is None:
+                        i = table[v] = len(names); names.append(v)
+                    out.append(i)
+            ids = t.remap[d] = np.array(out + [-1], dtype=np.int64)
+        return ids
+
+    def query(self, start: Optional[str] = None, end: Optional[str] = None,
+              filters: Optional[Dict[str, List[str]]] = None, group_by: Iterable[str] = ()) -> Dict[str, Any]:
+        """Event counts and session minutes per group, over the days in [start, end]."""
+        t0 = time.perf_counter()
+        filters = {d: v for d, v in (filters or {}).items() if v}
+        group_by = list(group_by)
+        tables = self.tables(start, end)
+        for t, _, _ in tables:  # register every name first so the key radix is fixed for the whole query
+            for d in group_by:
+                self._ids_for(t, d)
+        radix = [len(self._names[d]) + 1 for d in group_by]  # id + 1, so 0 = not set
+        space = 1
+        for r in radix: space *= r
+        scanned = {"partition_days": 0, "log_days": 0, "rows": 0}
+        keys, counts, minutes = [], [], []
+        for t, days, mapped in tables:
+            scanned["partition_days" if mapped else "log_days"] += len(days)
+            mask = None
+            if len(days) != len(t.days):  # only some days of this partition are wanted (or current)
+                wanted = np.zeros(len(t.vocab["day"]) + 1, dtype=bool)
+                wanted[[t.codes["day"][d] for d in days]] = True
+                mask = wanted[t.cols["day"]]
+            for d, values in filters.items():
+                codes = [t.codes[d][v] for v in values if v in t.codes[d]]
+                if not codes:
+                    mask = False; break
+                m = t.cols[d] == codes[0] if len(codes) == 1 else np.isin(t.cols[d], codes)
+                mask = m if mask is None else (mask & m)
+            if mask is False:
+                continue
+            mins = t.cols["minutes"] if mask is None else t.cols["minutes"][mask]
+            scanned["rows"] += t.rows
+            # one int64 key per row: query-wide ids in mixed radix over the grouped dimensions
+            key = np.zeros(len(mins), dtype=np.int64)
+            for d, r in zip(group_by, radix):
+                col = t.cols[d] if mask is None else t.cols[d][mask]
+                key = key * r + (self._ids_for(t, d)[col] + 1)
+            if space <= BINCOUNT_MAX:
+                n = np.bincount(key, minlength=space)
+                k = np.flatnonzero(n)
+                keys.append(k); counts.append(n[k]); minutes.append(np.bincount(key, weights=mins, minlength=space)[k])
+            else:
+                k, inv = np.unique(key, return_inverse=True)
+                keys.append(k); counts.append(np.bincount(inv)); minutes.append(np.bincount(inv, weights=mins))
+        rows = []
+        if keys:
+            k, inv = np.unique(np.concatenate(keys), return_inverse=True)
+            n = np.bincount(inv, weights=np.concatenate(counts))
+            m = np.bincount(inv, weights=np.concatenate(minutes))
+            names = {}
+            for d, r in zip(reversed(group_by), reversed(radix)):
+                k, code = np.divmod(k, r)
+                vocab = self._names[d]
+                names[d] = [vocab[c - 1] if c else None for c in code.tolist()]
+            for i, (events, mins) in enumerate(zip(n.tolist(), m.tolist())):
+                row = {d: names[d][i] for d in group_by}
+                row["events"] = int(events); row["minutes"] = round(mins, 2)
+                rows.append(row)
+            rows.sort(key=lambda row: tuple("" if row[d] is None else row[d] for d in group_by))
+        return {"rows": rows, "scanned": scanned, "ms": round((time.perf_counter() - t0) * 1000.0, 3)}
+
+if __name__ == "__main__":
+    from config import DATA_DIR
+    if sys.argv[1:] != ["convert"]:
+        sys.exit("usage: python columnar.py convert")
+    if not AVAILABLE:
+        sys.exit("columnar.py needs numpy (pip install -r requirements.txt)")
+    cs = ColumnarStore(os.path.join(DATA_DIR, "columns"), SegmentStore(os.path.join(DATA_DIR, "events")))
+    print(cs.convert_sealed())
@@ -1,15 +1,66 @@
 # Configuration for Haven Pro
+import os
+
 ENABLE_GOOGLE = False   # set True after filling credentials
 LOCAL_ONLY = True       # avoid external calls by default
 RETENTION_DAYS = 180
+RETENTION_EVERY_H = 0    # run retention compaction in the background every N hours (0 = only via /privacy/maintenance)
 
 # Web Push (VAPID) placeholders — generate your own for production
 VAPID_PRIVATE_KEY = "REPLACE_WITH_BASE64URL_PRIVATE_KEY"
 VAPID_PUBLIC_KEY = "REPLACE_WITH_BASE64URL_PUBLIC_KEY"
 VAPID_CLAIMS = {"sub": "mailto:owner@example.com"}
+PUSH_WORKERS = 16      # concurrent sends per worker process
+PUSH_TIMEOUT_S = 10    # per HTTP request to the push service
+PUSH_RETRIES = 3       # extra attempts on network errors, 429 and 5xx
+PUSH_BACKOFF_S = 0.5   # first retry delay; doubles per attempt (with jitter)
+REMINDERS_ENABLED = True
+REMINDER_LEAD_MIN = 5     # push this many minutes before a plan block starts
+REMINDER_COALESCE_S = 60  # reminders due within the same window fire as one push per parent
 
 # OIDC / SSO placeholders (Employer edition)
 OIDC_CLIENT_ID = "REPLACE_ME"
 OIDC_CLIENT_SECRET = "REPLACE_ME"
 OIDC_ISSUER = "https://example-issuer"  # e.g., https://your-tenant.auth0.com
 REDIRECT_URI = "http://127.0.0.1:8000/integrations/google/callback"  # update for your domain
+
+# Storage / event log
+DATA_DIR = os.environ.get("HAVEN_DATA_DIR", "data")
+EVENT_FLUSH_EVERY = 256     # group commit: write after N queued events ...
+EVENT_FLUSH_MS = 50         # ... or after M milliseconds, whichever comes first
+EVENT_DURABILITY = "async"  # async (fire-and-forget) | fsync (request waits for its group to be fsynced)
+EVENT_QUEUE_MAX = 10000     # producers block (and blocked_puts counts up) when the queue is full
+METRICS_CHECKPOINT_EVERY = 1000  # materialized metrics are checkpointed after this many events (and on shutdown)
+COLUMNAR_EVERY_S = 300      # fold sealed segments into monthly column partitions for /admin/metrics/query this often (0 = off; needs numpy)
+COLUMNAR_OPEN_MONTHS = 64   # column partitions kept memory-mapped per worker
+SESSIONS_CAPACITY = 10000   # active sessions held per worker; when the ring is full the oldest is ended
+SESSION_IDLE_S = 300        # a session with no heartbeat for this long is ended as of its last heartbeat
+SESSION_SWEEP_S = 30        # how often heartbeats are written back and idle sessions ended (0 = off); keep
+                            # SESSION_SWEEP_S + the client's heartbeat interval (60 s) well below SESSION_IDLE_S
+STORAGE_BACKEND = "sqlite"  # sqlite (shared by all workers) | memory (per-process, lost on restart)
+SQLITE_PATH = os.path.join(DATA_DIR, "haven.db")
+SQLITE_POOL_SIZE = 4
+
+# Planning
+PLAN_BATCH_MAX = 5000  # jobs per /plan/batch request
+MEALPLAN_CACHE_SIZE = 512  # complete meal plans kept per worker, keyed on (budget, age bracket, days)
+MEALPLAN_MAX_DAYS = 92     # horizon cap for /mealplan/stream (a quarter)
+ICS_CACHE_SIZE = 256       # rendered calendars kept per worker, keyed on their content ETag
+STORY_CACHE_SIZE = 1024    # rendered stories kept per worker, keyed on (language, segments, child name, bilingual)
+
+# Response cache and compression
+RESPONSE_CACHE_TTL_S = 5      # dashboard GETs (time saved, aggregate, timeseries) are served from cache this long; writes on
+                              # this worker invalidate them at once, writes on other workers show up within the TTL
+RESPONSE_CACHE_SIZE = 256     # cached responses (route + query string) per worker
+COMPRESS_MIN_BYTES = 1024     # gzip/brotli-encode responses at least this large when the client accepts it (0 = off)
+
+# Content (activities, stories, meals)
+CONTENT_DIR = "content"  # relative to the backend dir
+CONTENT_POLL_S = 2       # re-stat content files this often and hot-swap a new snapshot on change (0 = off)
+CONTENT_SNAPSHOT = os.path.join(DATA_DIR, "content.snapshot")  # pickled last build, loaded in one read at start-up ("" = off)
+
+# Instrumentation
+INSTRUMENTATION_ENABLED = True  # per-route latency/size histograms and spans at GET /metrics (Prometheus text)
+PROFILER_ENABLED = False        # sampling profiler at start-up; toggle at runtime with POST /admin/profiler
+PROFILER_INTERVAL_MS = 5        # stack sampling interval
+PROFILER_SLOW_MS = 250          # requests slower than this keep their sampled stacks
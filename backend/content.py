@@ -0,0 +1,159 @@
+# Content registry: activities, stories and meals from backend/content/.
+# Files are parsed and their derived structures (activity index, compiled
+# stories, compiled menus) built into a ContentSnapshot off the request path.
+# The snapshot then replaces `registry.current` in one assignment. Requests read
+# `current` once and keep that snapshot, so a reload never changes content
+# mid-request. A polling thread re-stats the files and reloads when they change;
+# a snapshot that fails to build is reported and the previous one stays live.
+# Each built snapshot is also pickled to snapshot_path; a worker that starts
+# against unchanged files (and unchanged builder code) loads it in one read
+# instead of parsing and compiling the catalogs again.
+import hashlib, json, os, pickle, sys, threading, time
+from typing import Any, Dict, Optional, Tuple
+
+from activity_index import build_index
+from mealplan import MealPlanner
+from stories import StoryEngine
+
+FILES = ("activities.json", "stories_en.json", "stories_nl.json", "meals.json")
+BUILDERS = ("content", "activity_index", "mealplan", "stories", "cache")  # modules whose classes end up in the pickle
+SNAPSHOT_FORMAT = 1
+
+class ContentSnapshot:
+    """One immutable version of the content and everything derived from it."""
+
+    def __init__(self, version: int, raw: Dict[str, Any], digest: str, story_cache: int, mealplan_cache: int):
+        timings: Dict[str, float] = {}
+        t = time.perf_counter()
+        self.activities: Dict[str, Any] = raw["activities.json"]
+        self.activity_index = build_index(self.activities)  # (lang, mode) -> ActivityIndex
+        timings["activities_ms"] = _ms(t); t = time.perf_counter()
+        self.stories = StoryEngine({"en": raw["stories_en.json"], "nl": raw["stories_nl.json"]}, cache_size=story_cache)
+        timings["stories_ms"] = _ms(t); t = time.perf_counter()
+        self.meal_planner = MealPlanner(raw["meals.json"], cache_size=mealplan_cache)
+        timings["meals_ms"] = _ms(t)
+        self.version = version
+        self.digest = digest
+        self.timings = timings
+        self.loaded_at = time.time()
+
+class ContentRegistry:
+    def __init__(self, root: str, story_cache: int = 1024, mealplan_cache: int = 256, snapshot_path: Optional[str] = None):
+        self.root = root
+        self.story_cache = story_cache
+        self.mealplan_cache = mealplan_cache
+        self.snapshot_path = snapshot_path
+        self.current: Optional[ContentSnapshot] = None
+        self._stamps: Dict[str, Tuple[int, int]] = {}  # file -> (mtime_ns, size) of the live snapshot
+        self._lock = threading.Lock()  # one reload at a time
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"reloads": 0, "checks": 0, "errors": 0, "last_error": None, "load_ms": 0.0, "restored": False}
+        if not self._restore():
+            self.reload(force=True)
+
+    def reload(self, force: bool = False) -> bool:
+        """Rebuilds the snapshot if any file changed; returns True when a new version went live."""
+        with self._lock:
+            self._stats["checks"] += 1
+            stamps = self._stat()
+            if not force and stamps == self._stamps:
+                return False
+            t0 = time.perf_counter()
+            try:
+                raw, h = {}, hashlib.sha256()
+                for name in FILES:
+                    with open(os.path.join(self.root, name), "rb") as f:
+                        data = f.read()
+                    h.update(name.encode()); h.update(data)
+                    raw[name] = json.loads(data)
+                digest = h.hexdigest()
+                if self.current is not None and digest == self.current.digest:
+                    self._stamps = stamps  # touched but identical
+                    return False
+                snap = ContentSnapshot((self.current.version + 1) if self.current else 1, raw, digest,
+                                       self.story_cache, self.mealplan_cache)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                if self.current is None:
+                    raise
+                self._stats["errors"] += 1
+                self._stats["last_error"] = f"{type(e).__name__}: {e}"
+                self._stamps = stamps  # don't retry the same broken files every poll
+                return False
+            self.current = snap  # atomic swap
+            self._stamps = stamps
+            self._stats["reloads"] += 1
+            self._stats["last_error"] = None
+            self._stats["load_ms"] = _ms(t0)
+            self._save(snap, stamps)
+            return True
+
+    # ---- pickled snapshot ----
+    def _key(self, stamps: Dict[str, Tuple[int, int]]) -> Dict[str, Any]:
+        code = {}
+        for name in BUILDERS:
+            mod = sys.modules.get(name)
+            if mod is not None:
+                st = os.stat(mod.__file__)
+                code[name] = (st.st_mtime_ns, st.st_size)
+        return {"format": SNAPSHOT_FORMAT, "files": stamps, "code": code, "story_cache": self.story_cache,
+                "mealplan_cache": self.mealplan_cache}
+
+    def _restore(self) -> bool:
+        if not self.snapshot_path:
+            return False
+        t0 = time.perf_counter()
+        stamps = self._stat()
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                key, snap = pickle.loads(f.read())
+            if key != self._key(stamps):
+                return False
+        except Exception:
+            return False  # missing, stale or unreadable: build from the files
+        self.current, self._stamps = snap, stamps
+        self._stats.update(restored=True, load_ms=_ms(t0))
+        return True
+
+    def _save(self, snap: ContentSnapshot, stamps: Dict[str, Tuple[int, int]]):
+        if not self.snapshot_path:
+            return
+        tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(pickle.dumps((self._key(stamps), snap), protocol=pickle.HIGHEST_PROTOCOL))
+            os.replace(tmp, self.snapshot_path)
+        except (OSError, pickle.PicklingError, TypeError):
+            pass  # the snapshot is an optimisation; the next start simply builds again
+
+    def start(self, poll_s: float):
+        if poll_s <= 0 or self._thread is not None: return
+        def loop():
+            while not self._stop.wait(poll_s):
+                try: self.reload()
+                except Exception: pass
+        self._thread = threading.Thread(target=loop, name="haven-content", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self.current
+        return {**self._stats, "version": snap.version, "digest": snap.digest[:16], "loaded_at": snap.loaded_at,
+                "timings": snap.timings, "watching": self._thread is not None}
+
+    def _stat(self) -> Dict[str, Tuple[int, int]]:
+        out = {}
+        for name in FILES:
+            try:
+                st = os.stat(os.path.join(self.root, name))
+                out[name] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                out[name] = (0, -1)
+        return out
+
+def _ms(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000.0, 3)
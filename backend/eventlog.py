@@ -0,0 +1,268 @@
+# Background event log writer for Haven Pro.
+# Request threads only enqueue; a single writer thread drains the queue and
+# appends whole batches (group commit) to the day segments of a SegmentStore,
+# together with their subject index entries when the store keeps one.
+# Async handlers use aemit()/aflush(), which await commits through futures the
+# writer resolves on their loop, so the event loop never blocks on the log.
+import asyncio, json, queue, threading, time
+from collections import deque
+from typing import Callable, Dict, Any, List, Optional
+
+from segments import SegmentStore, day_of
+
+_FLUSH = object()  # forces the current group to commit immediately
+_STOP = object()   # drains the queue and stops the writer thread
+
+class EventWriter:
+    """Queue-backed JSON-lines writer with group commit.
+
+    durability="async": emit() returns once the event is queued (fire-and-forget).
+    durability="fsync": emit() blocks until the group containing the event is fsynced,
+    and raises OSError if that group could not be written.
+    on_commit(entries, day, offset) is called from the writer thread after each batch
+    is written, with the end offset of the last segment appended to.
+    aemit/aflush are the awaitable forms of emit/flush for async handlers.
+    """
+
+    def __init__(self, store: SegmentStore, flush_every: int = 256, flush_ms: int = 50,
+                 durability: str = "async", max_queue: int = 10000,
+                 on_commit: Optional[Callable[[List[Dict[str, Any]], str, int], None]] = None):
+        if durability not in ("async", "fsync"):
+            raise ValueError(f"unknown durability mode: {durability}")
+        self.store = store
+        self.flush_every = max(1, flush_every)
+        self.flush_s = max(0, flush_ms) / 1000.0
+        self.durability = durability
+        self.on_commit = on_commit
+        self._q: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._seq_lock = threading.Lock()
+        self._seq = 0          # last sequence number handed to a producer
+        self._committed = 0    # last sequence number written (and fsynced, if enabled)
+        self._done = 0         # last sequence number the writer is finished with: written, or dropped on an error
+        self._failed: "deque[tuple]" = deque(maxlen=1024)  # (first, last) sequence numbers of dropped batches
+        self._cond = threading.Condition()
+        self._waiters: List[tuple] = []  # (seq, loop, future) of async callers waiting for a commit
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats = {"events": 0, "flushes": 0, "errors": 0, "blocked_puts": 0, "dropped": 0,
+                       "max_queue_depth": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0,
+                       "total_flush_ms": 0.0}
+
+    # ---- producer side ----
+    def emit(self, entry: Dict[str, Any]) -> int:
+        self._ensure_started()
+        item = (day_of(entry["ts"]), json.dumps(entry) + "\n", entry)
+        try:
+            seq = self._enqueue(item, block=False)
+        except queue.Full:
+            # backpressure: the request thread waits for the writer to catch up
+            self._stats["blocked_puts"] += 1
+            seq = self._enqueue(item, block=True)
+        if self.durability == "fsync" and not self.wait(seq):
+            raise OSError(f"event {seq} could not be written to the log")
+        return seq
+
+    async def aemit(self, entry: Dict[str, Any]) -> int:
+        """emit() for async handlers: a full queue or an fsync wait is awaited, never blocked on."""
+        self._ensure_started()
+        item = (day_of(entry["ts"]), json.dumps(entry) + "\n", entry)
+        seq = self._try_enqueue(item)
+        if seq is None:
+            # queue full, or a blocked emit() holds the sequence lock: retry with backoff on the loop
+            self._stats["blocked_puts"] += 1
+            delay = 0.001
+            while seq is None:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+                seq = self._try_enqueue(item)
+        if self.durability == "fsync" and not await self.await_commit(seq):
+            raise OSError(f"event {seq} could not be written to the log")
+        return seq
+
+    def _enqueue(self, item, block: bool) -> int:
+        # the lock keeps queue order equal to sequence order, which commit acknowledgements rely on
+        with self._seq_lock:
+            seq = self._seq + 1
+            self._q.put((seq, item), block=block)  # raises queue.Full when not blocking
+            self._seq = seq
+        self._note_depth()
+        return seq
+
+    def _try_enqueue(self, item) -> Optional[int]:
+        """_enqueue() that never waits, not even for the lock; None if the item could not be queued now."""
+        if not self._seq_lock.acquire(blocking=False):
+            return None
+        try:
+            seq = self._seq + 1
+            self._q.put_nowait((seq, item))
+            self._seq = seq
+        except queue.Full:
+            return None
+        finally:
+            self._seq_lock.release()
+        self._note_depth()
+        return seq
+
+    def _note_depth(self):
+        depth = self._q.qsize()
+        if depth > self._stats["max_queue_depth"]:
+            self._stats["max_queue_depth"] = depth
+
+    def wait(self, seq: int, timeout: Optional[float] = None) -> bool:
+        """True once event seq is committed; False on timeout or if its batch was dropped."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._done >= seq, timeout) and not self._lost(seq)
+
+    async def await_commit(self, seq: int, timeout: Optional[float] = None) -> bool:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self._cond:
+            if self._done >= seq:
+                return not self._lost(seq)
+            self._waiters.append((seq, loop, fut))
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Commit everything queued so far and wait for it."""
+        if self._thread is None:
+            return True
+        seq = self._seq
+        self._q.put(_FLUSH)
+        return self.wait(seq, timeout)
+
+    async def aflush(self, timeout: Optional[float] = 5.0) -> bool:
+        if self._thread is None:
+            return True
+        seq = self._seq
+        try:
+            self._q.put_nowait(_FLUSH)
+        except queue.Full:
+            await asyncio.to_thread(self._q.put, _FLUSH)
+        return await self.await_commit(seq, timeout)
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Flush pending events and stop the writer thread (idempotent)."""
+        with self._start_lock:
+            t = self._thread
+            if t is None or not t.is_alive():
+                return
+            self._q.put(_STOP)
+        t.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        s = dict(self._stats)
+        flushes = s.pop("total_flush_ms")
+        s["avg_flush_ms"] = round(flushes / s["flushes"], 3) if s["flushes"] else 0.0
+        s["queue_depth"] = self._q.qsize()
+        s["pending"] = self._seq - self._done
+        s["durability"] = self.durability
+        return s
+
+    # ---- writer side ----
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="haven-eventlog", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._q.get()
+            batch, first_seq, last_seq, stop = [], 0, 0, False
+            deadline = time.monotonic() + self.flush_s
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif item is not _FLUSH:
+                    last_seq, rec = item
+                    first_seq = first_seq or last_seq
+                    batch.append(rec)
+                if stop or item is _FLUSH or len(batch) >= self.flush_every:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+            if stop:
+                # pick up anything enqueued behind the stop marker
+                while True:
+                    try:
+                        item = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _FLUSH and item is not _STOP:
+                        last_seq, rec = item
+                        first_seq = first_seq or last_seq
+                        batch.append(rec)
+            if last_seq:
+                ok = self._commit(batch)
+                with self._cond:
+                    if ok:
+                        self._committed = max(self._committed, last_seq)
+                    else:
+                        self._failed.append((first_seq, last_seq))
+                    self._done = max(self._done, last_seq)
+                    self._wake()
+            elif item is _FLUSH or stop:
+                with self._cond:
+                    self._wake()
+            if stop:
+                return
+
+    def _lost(self, seq: int) -> bool:
+        # called with self._cond held
+        return any(first <= seq <= last for first, last in self._failed)
+
+    def _wake(self):
+        # called with self._cond held
+        self._cond.notify_all()
+        if self._waiters:
+            done = [w for w in self._waiters if w[0] <= self._done]
+            self._waiters = [w for w in self._waiters if w[0] > self._done]
+            for seq, loop, fut in done:
+                try:
+                    loop.call_soon_threadsafe(_resolve, fut, not self._lost(seq))
+                except RuntimeError:
+                    pass  # the waiter's loop is closed
+
+    def _commit(self, batch) -> bool:
+        t0 = time.perf_counter()
+        by_day: Dict[str, list] = {}
+        subjects = self.store.subjects
+        for day, line, entry in batch:
+            lines, index, pos = by_day.setdefault(day, ([], [] if subjects else None, [0]))
+            lines.append(line)
+            if subjects:
+                index.extend((subj, pos[0], len(line)) for subj in subjects(entry))  # json.dumps output is ASCII
+            pos[0] += len(line)
+        try:
+            for day, (lines, index, _) in by_day.items():
+                offset = self.store.append(day, "".join(lines), fsync=self.durability == "fsync", index=index)
+        except OSError:
+            self._stats["errors"] += 1
+            self._stats["dropped"] += len(batch)
+            return False
+        if self.on_commit is not None:
+            try:
+                self.on_commit([e for _, _, e in batch], day, offset)
+            except Exception:
+                self._stats["errors"] += 1
+        ms = (time.perf_counter() - t0) * 1000.0
+        st = self._stats
+        st["events"] += len(batch)
+        st["flushes"] += 1
+        st["last_flush_ms"] = round(ms, 3)
+        st["total_flush_ms"] += ms
+        if ms > st["max_flush_ms"]:
+            st["max_flush_ms"] = round(ms, 3)
+        return True
+
+def _resolve(fut: "asyncio.Future", ok: bool):
+    if not fut.done():
+        fut.set_result(ok)
@@ -0,0 +1,228 @@
+# Response cache and compression for Haven Pro.
+# ResponseCache keeps rendered JSON bodies of read-heavy GET endpoints, keyed on
+# route and query string, for a short TTL. Entries carry tags; invalidate(tag)
+# (called when an event the entry depends on is logged) makes every entry with that tag stale
+# at once. Concurrent misses of one key share a single computation. Each entry
+# has a weak ETag, so pollers revalidate with If-None-Match and get a 304, and its
+# gzip/brotli variants are compressed once and then served from the entry.
+# CompressionMiddleware compresses other large responses (streams included) the
+# same way. Brotli is optional: without the `brotli` package only gzip is offered.
+import asyncio, gzip, hashlib, importlib.util, inspect, threading, time, zlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Union
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+BROTLI = importlib.util.find_spec("brotli") is not None
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+SKIP_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip", "text/event-stream")
+
+_brotli = None
+
+def _brotli_mod():
+    global _brotli
+    if _brotli is None:
+        import brotli
+        _brotli = brotli
+    return _brotli
+
+def choose_encoding(accept: str) -> Optional[str]:
+    """br or gzip, whichever the Accept-Encoding header allows (br preferred), else None."""
+    allowed = {}
+    for part in accept.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try: q = float(params.strip()[2:])
+            except ValueError: q = 0.0
+        allowed[name.strip().lower()] = q
+    for enc in (("br", "gzip") if BROTLI else ("gzip",)):
+        if allowed.get(enc, allowed.get("*", 0)) > 0:
+            return enc
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return _brotli_mod().compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # weak comparison (RFC 9110 8.8.3.2): W/ prefixes are ignored
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+class _Entry:
+    __slots__ = ("body", "etag", "expires", "tags", "gens", "variants")
+
+    def __init__(self, body: bytes, etag: str, expires: float, tags: Tuple[str, ...], gens: Tuple[int, ...]):
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+        self.tags = tags
+        self.gens = gens
+        self.variants: Dict[str, bytes] = {}  # encoding -> compressed body
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 256, min_compress: int = 1024):
+        self.maxsize = maxsize
+        self.min_compress = min_compress
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._gens: Dict[str, int] = {}
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "shared": 0, "not_modified": 0, "invalidations": 0,
+                       "evictions": 0, "compressed": 0}
+        self._routes: Dict[str, list] = {}  # path -> [hits, misses]
+
+    def invalidate(self, *tags: str):
+        with self._lock:
+            for t in tags:
+                self._gens[t] = self._gens.get(t, 0) + 1
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    async def respond(self, request: Request, compute: Callable[[], Union[Any, Awaitable[Any]]],
+                      ttl: float, tags: Iterable[str] = ()) -> Response:
+        """The cached response for this route and query, computing it with compute() on a miss.
+
+        compute returns the JSON-able result (sync or async); it runs once per key
+        however many requests miss at the same time.
+        """
+        key = request.url.path + "?" + str(request.query_params)
+        tags = tuple(tags)
+        now = time.monotonic()
+        with self._lock:
+            e = self._data.get(key)
+            fresh = e is not None and e.expires > now and e.gens == self._gen_of(tags)
+            if fresh:
+                self._data.move_to_end(key)
+            self._count(request.url.path, fresh)
+        if not fresh:
+            e = await self._fill(key, compute, ttl, tags)
+        return self._render(request, e)
+
+    async def _fill(self, key: str, compute, ttl: float, tags: Tuple[str, ...]) -> _Entry:
+        fut = self._inflight.get(key)  # only touched from the event loop
+        if fut is not None:
+            self._stats["shared"] += 1
+            return await asyncio.shield(fut)
+        fut = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            with self._lock:
+                gens = self._gen_of(tags)  # taken before computing: a write meanwhile leaves the entry stale
+            value = compute()
+            if inspect.isawaitable(value):
+                value = await value
+            body = JSONResponse(value).body
+            e = _Entry(body, 'W/"' + hashlib.sha1(body).hexdigest()[:20] + '"', time.monotonic() + ttl, tags, gens)
+            with self._lock:
+                self._data[key] = e
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self._stats["evictions"] += 1
+            fut.set_result(e)
+            return e
+        except BaseException as exc:
+            fut.set_exception(exc)
+            fut.exception()  # retrieved here, so a future nobody else awaited does not warn
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _render(self, request: Request, e: _Entry) -> Response:
+        headers = {"ETag": e.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        inm = request.headers.get("if-none-match")
+        if inm and etag_matches(inm, e.etag):
+            with self._lock:
+                self._stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        body = e.body
+        enc = choose_encoding(request.headers.get("accept-encoding", "")) if len(body) >= self.min_compress else None
+        if enc:
+            variant = e.variants.get(enc)
+            if variant is None:
+                variant = e.variants[enc] = compress(body, enc)  # racing threads both compress; same bytes
+                with self._lock:
+                    self._stats["compressed"] += 1
+            body = variant
+            headers["Content-Encoding"] = enc
+        return Response(body, media_type="application/json", headers=headers)
+
+    def _gen_of(self, tags: Tuple[str, ...]) -> Tuple[int, ...]:
+        return tuple(self._gens.get(t, 0) for t in tags)
+
+    def _count(self, path: str, hit: bool):
+        self._stats["hits" if hit else "misses"] += 1
+        r = self._routes.get(path)
+        if r is None: r = self._routes[path] = [0, 0]
+        r[0 if hit else 1] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._stats["hits"] + self._stats["misses"]
+            return {**self._stats, "size": len(self._data), "maxsize": self.maxsize, "brotli": BROTLI,
+                    "hit_rate": round(self._stats["hits"] / total, 4) if total else 0.0,
+                    "routes": {p: {"hits": h, "misses": m, "hit_rate": round(h / (h + m), 4)}
+                               for p, (h, m) in sorted(self._routes.items())}}
+
+class CompressionMiddleware:
+    """Pure ASGI middleware: gzip/brotli-encodes responses of at least min_size bytes,
+    and streamed responses chunk by chunk (each chunk is flushed, so NDJSON still streams).
+    Responses that already carry a Content-Encoding are passed through untouched."""
+
+    def __init__(self, app, min_size: int = 1024):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept-encoding"), "")
+        enc = choose_encoding(accept)
+        if enc is None:
+            return await self.app(scope, receive, send)
+        start: Dict[str, Any] = {}
+        state = {"mode": None, "compressor": None}  # mode: None (undecided) | "pass" | "whole" | "stream"
+
+        async def wrapped_send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)  # held back until the first body chunk shows how large the body is
+                return
+            if message["type"] != "http.response.body" or state["mode"] == "pass":
+                return await send(message)
+            body, more = message.get("body", b""), message.get("more_body", False)
+            if state["mode"] is None:
+                headers = {k.lower(): v for k, v in start.get("headers", [])}
+                ctype = headers.get(b"content-type", b"").decode("latin-1")
+                if (b"content-encoding" in headers or start["status"] < 200 or start["status"] in (204, 304)
+                        or ctype.startswith(SKIP_TYPES) or (not more and len(body) < self.min_size)):
+                    state["mode"] = "pass"
+                    await send(start)
+                    return await send(message)
+                state["mode"] = "stream" if more else "whole"
+                hdrs = [(k, v if k.lower() != b"etag" or v.startswith(b"W/") else b"W/" + v)  # encoded: no longer byte-identical
+                        for k, v in start.get("headers", []) if k.lower() != b"content-length"]
+                hdrs += [(b"content-encoding", enc.encode()), (b"vary", b"Accept-Encoding")]
+                if not more:
+                    body = compress(body, enc)
+                    hdrs.append((b"content-length", str(len(body)).encode()))
+                else:
+                    state["compressor"] = _brotli_mod().Compressor(quality=BROTLI_QUALITY) if enc == "br" \
+                        else zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+                await send({**start, "headers": hdrs})
+                if not more:
+                    return await send({"type": "http.response.body", "body": body})
+            c = state["compressor"]
+            if enc == "br":
+                out = c.process(body) + (c.flush() if more else c.finish())
+            else:
+                out = c.compress(body) + c.flush(zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH)
+            await send({"type": "http.response.body", "body": out, "more_body": more})
+
+        await self.app(scope, receive, wrapped_send)
@@ -0,0 +1,94 @@
+# iCalendar (RFC 5545) rendering for day plans.
+# Calendars are built in one pass: the date is parsed once, block times are
+# sliced from "HH:MM" strings, UIDs derive from a single hash per plan, and
+# lines are escaped, folded at 75 octets and joined with CRLF. The plan's
+# content hash doubles as its ETag.
+import datetime, hashlib, json, time
+from typing import Any, Dict, Iterable, List, Optional
+
+CRLF = "\r\n"
+FREQS = ("DAILY", "WEEKLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+def escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def fold(line: str) -> str:
+    """Folds a content line to at most 75 octets per physical line, never splitting a UTF-8 sequence."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line
+    parts, start, limit = [], 0, 75
+    while start < len(raw):
+        end = min(start + limit, len(raw))
+        while end < len(raw) and (raw[end] & 0xC0) == 0x80:
+            end -= 1  # don't cut inside a multi-byte character
+        parts.append(raw[start:end].decode("utf-8"))
+        start, limit = end, 74  # continuation lines start with a space
+    return (CRLF + " ").join(parts)
+
+def content_hash(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def etag_of(digest: str) -> str:
+    return f'"{digest[:32]}"'
+
+def rrule(repeat: Optional[Dict[str, Any]]) -> Optional[str]:
+    """{"freq": "DAILY"|"WEEKLY", "count": n, "until": "YYYY-MM-DD", "byday": ["MO", ...]} -> RRULE value."""
+    if not repeat:
+        return None
+    freq = str(repeat.get("freq", "DAILY")).upper()
+    if freq not in FREQS:
+        raise ValueError(f"unsupported repeat frequency: {freq}")
+    rule = [f"FREQ={freq}"]
+    if repeat.get("interval"):
+        rule.append(f"INTERVAL={int(repeat['interval'])}")
+    if repeat.get("count"):
+        rule.append(f"COUNT={int(repeat['count'])}")
+    elif repeat.get("until"):
+        rule.append("UNTIL=" + str(repeat["until"]).replace("-", "") + "T235959")
+    byday = [d.upper() for d in repeat.get("byday") or []]
+    if byday:
+        if any(d not in WEEKDAYS for d in byday):
+            raise ValueError("byday must use MO..SU")
+        rule.append("BYDAY=" + ",".join(byday))
+    return ";".join(rule)
+
+def _hhmm(s: str) -> str:
+    h, m = s.split(":")
+    h, m = int(h), int(m)
+    if not (0 <= h < 24 and 0 <= m < 60):
+        raise ValueError(f"bad time: {s}")
+    return f"{h:02d}{m:02d}00"
+
+def vevents(uid_seed: str, date: str, plan: Iterable[Dict[str, Any]], repeat: Optional[Dict[str, Any]] = None,
+            stamp: Optional[float] = None) -> List[str]:
+    """VEVENT content lines (unfolded) for the timed blocks of one day plan."""
+    try:
+        day = datetime.date.fromisoformat(date).strftime("%Y%m%dT")
+    except (TypeError, ValueError):
+        raise ValueError(f"bad date: {date}") from None
+    dtstamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(stamp))
+    rule = rrule(repeat)
+    uid_base = hashlib.sha1(f"{uid_seed}|{date}".encode()).hexdigest()[:20]
+    lines: List[str] = []
+    for i, item in enumerate(plan):
+        start = item.get("start"); end = item.get("end")
+        if not (start and end): continue
+        title = (item.get("plan") or {}).get("activity", "Haven Activity")
+        lines += ["BEGIN:VEVENT",
+                  f"UID:{uid_base}-{i}@haven",
+                  f"DTSTAMP:{dtstamp}",
+                  f"DTSTART:{day}{_hhmm(start)}",
+                  f"DTEND:{day}{_hhmm(end)}",
+                  f"SUMMARY:{escape(title)}"]
+        if rule:
+            lines.append(f"RRULE:{rule}")
+        lines.append("END:VEVENT")
+    return lines
+
+def calendar(events: Iterable[str], name: Optional[str] = None) -> str:
+    head = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Haven//AI Nanny//EN", "CALSCALE:GREGORIAN"]
+    if name:
+        head.append(f"X-WR-CALNAME:{escape(name)}")
+    return CRLF.join(fold(l) for l in [*head, *events, "END:VCALENDAR"]) + CRLF
@@ -0,0 +1,214 @@
+# Request instrumentation for Haven Pro.
+# An ASGI middleware records per-route latency histograms, status counts, request
+# and response sizes and the number of in-flight requests; span("name") times a
+# block inside a handler. render() emits everything in the Prometheus text format.
+# The optional sampling profiler snapshots every thread's stack at a fixed interval
+# and keeps the folded stacks (flamegraph.pl / speedscope input) of slow requests.
+import sys, threading, time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# leaf frames of threads parked on a lock, queue or selector; such samples are idle time, not work
+IDLE_LEAVES = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+               ("selectors.py", "select"), ("selectors.py", "poll")}
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # seconds
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(BUCKETS, v)] += 1
+        self.sum += v
+        self.count += 1
+
+class Instrumentation:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: Dict[Tuple[str, str], Histogram] = {}   # (method, route)
+        self.requests: Dict[Tuple[str, str, int], int] = {}   # (method, route, status)
+        self.req_bytes: Dict[Tuple[str, str], List[float]] = {}   # (method, route) -> [sum, count]
+        self.resp_bytes: Dict[Tuple[str, str], List[float]] = {}
+        self.spans: Dict[str, Histogram] = {}
+        self.in_flight = 0
+        self.gauges: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+        self.profiler: Optional["SamplingProfiler"] = None
+
+    # ---- recording ----
+    def observe_request(self, method: str, route: str, status: int, seconds: float, req_bytes: int, resp_bytes: int):
+        key = (method, route)
+        with self._lock:
+            h = self.latency.get(key)
+            if h is None: h = self.latency[key] = Histogram()
+            h.observe(seconds)
+            k = (method, route, status)
+            self.requests[k] = self.requests.get(k, 0) + 1
+            for table, n in ((self.req_bytes, req_bytes), (self.resp_bytes, resp_bytes)):
+                s = table.get(key)
+                if s is None: s = table[key] = [0, 0]
+                s[0] += n; s[1] += 1
+
+    def observe_span(self, name: str, seconds: float):
+        with self._lock:
+            h = self.spans.get(name)
+            if h is None: h = self.spans[name] = Histogram()
+            h.observe(seconds)
+
+    @contextmanager
+    def span(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_span(name, time.perf_counter() - t0)
+
+    # ---- exposition ----
+    def render(self) -> str:
+        out: List[str] = []
+        with self._lock:
+            _histograms(out, "haven_http_request_duration_seconds", "Request latency by route.",
+                        {_labels(method=m, route=r): h for (m, r), h in self.latency.items()})
+            out += ["# HELP haven_http_requests_total Requests by route and status.",
+                    "# TYPE haven_http_requests_total counter"]
+            out += [f"haven_http_requests_total{_labels(method=m, route=r, status=str(s))} {n}"
+                    for (m, r, s), n in sorted(self.requests.items())]
+            out += ["# HELP haven_http_requests_in_flight Requests being served.",
+                    "# TYPE haven_http_requests_in_flight gauge", f"haven_http_requests_in_flight {self.in_flight}"]
+            for name, table, help_ in (("haven_http_request_size_bytes", self.req_bytes, "Request body size."),
+                                       ("haven_http_response_size_bytes", self.resp_bytes, "Response body size.")):
+                out += [f"# HELP {name} {help_}", f"# TYPE {name} summary"]
+                for (m, r), (total, n) in sorted(table.items()):
+                    out += [f"{name}_sum{_labels(method=m, route=r)} {total}", f"{name}_count{_labels(method=m, route=r)} {n}"]
+            _histograms(out, "haven_span_duration_seconds", "Time spent in named spans.",
+                        {_labels(span=n): h for n, h in self.spans.items()})
+        seen = set()
+        for fn in self.gauges:
+            try:
+                for name, labels, value in fn():
+                    if name not in seen:
+                        out.append(f"# TYPE {name} gauge"); seen.add(name)
+                    out.append(f"{name}{_labels(**labels)} {value}")
+            except Exception:
+                pass
+        return "\n".join(out) + "\n"
+
+def _labels(**kv: str) -> str:
+    if not kv: return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in kv.items()) + "}"
+
+def _histograms(out: List[str], name: str, help_: str, series: Dict[str, Histogram]):
+    out += [f"# HELP {name} {help_}", f"# TYPE {name} histogram"]
+    for labels, h in sorted(series.items()):
+        base = labels[:-1] + "," if labels else "{"
+        cum = 0
+        for le, c in zip((*(str(b) for b in BUCKETS), "+Inf"), h.counts):
+            cum += c
+            out.append(f'{name}_bucket{base}le="{le}"}} {cum}')
+        out += [f"{name}_sum{labels} {round(h.sum, 6)}", f"{name}_count{labels} {h.count}"]
+
+class InstrumentationMiddleware:
+    """Pure ASGI middleware (no per-request task or body buffering)."""
+
+    def __init__(self, app, registry: Instrumentation):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        reg = self.registry
+        sizes = [0, 0]
+        status = [500]
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        reg.in_flight += 1
+        t0 = time.perf_counter()
+        wall0 = time.time()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            reg.in_flight -= 1
+            seconds = time.perf_counter() - t0
+            route = getattr(scope.get("route"), "path", None) or "unmatched"  # template, not the raw path
+            reg.observe_request(scope["method"], route, status[0], seconds, sizes[0], sizes[1])
+            if reg.profiler is not None:
+                reg.profiler.request_done(scope["method"], route, wall0, seconds)
+
+class SamplingProfiler:
+    """Samples all thread stacks every interval_ms while running; requests slower than
+    slow_ms keep the folded stacks sampled during their lifetime."""
+
+    def __init__(self, interval_ms: float = 5.0, slow_ms: float = 250.0, keep: int = 50, max_depth: int = 64):
+        self.interval = interval_ms / 1000.0
+        self.slow_s = slow_ms / 1000.0
+        self.max_depth = max_depth
+        self._samples: "deque[Tuple[float, str]]" = deque(maxlen=max(1000, int(60 / self.interval)))  # ~1 min
+        self.slow: "deque[Dict[str, Any]]" = deque(maxlen=keep)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="haven-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            now = time.time()
+            for tid, frame in sys._current_frames().items():
+                if tid == me: continue
+                leaf = frame.f_code
+                if (leaf.co_filename.rsplit('/', 1)[-1], leaf.co_name) in IDLE_LEAVES: continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if tid not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(tid, str(tid)))
+                self._samples.append((now, ";".join(reversed(stack))))
+
+    def request_done(self, method: str, route: str, start: float, seconds: float):
+        if seconds < self.slow_s:
+            return
+        end = start + seconds
+        folded: Dict[str, int] = {}
+        for ts, stack in list(self._samples):
+            if start <= ts <= end:
+                folded[stack] = folded.get(stack, 0) + 1
+        self.slow.append({"method": method, "route": route, "start": start, "ms": round(seconds * 1000.0, 3),
+                          "samples": sum(folded.values()), "folded": folded})
+
+    def folded(self) -> str:
+        """All slow-request stacks merged, one "frame;frame;frame count" line per stack."""
+        merged: Dict[str, int] = {}
+        for r in list(self.slow):
+            for stack, n in r["folded"].items():
+                merged[stack] = merged.get(stack, 0) + n
+        return "".join(f"{s} {n}\n" for s, n in sorted(merged.items()))
@@ -0,0 +1,141 @@
+# Meal-plan engine for /mealplan/generate and /mealplan/stream.
+# Recipes are compiled once per (budget, age bracket): merged + age-scaled
+# ingredients and a sparse recipes x ingredients matrix. A plan then only counts
+# how often each recipe is used and reduces the matrix columns for the grocery
+# totals. Complete plans are memoized in an LRU keyed on the normalized inputs.
+from typing import Dict, Any, Iterator, List, Tuple
+
+from cache import LRUCache
+
+MEALS = ("breakfast", "lunch", "snack", "dinner")
+BUDGETS = ("low", "mid", "high")
+AGE_FACTORS = (0.5, 0.75, 1.0)
+
+def normalize_budget(budget: str) -> str:
+    budget = (budget or "").lower()
+    return budget if budget in BUDGETS else "mid"
+
+def age_factor(age_years: float) -> float:
+    # simple scaling: 0.5x for <=2y, 0.75x for <=4y, 1.0x otherwise
+    if age_years <= 2: return 0.5
+    if age_years <= 4: return 0.75
+    return 1.0
+
+def _merge_ingredients(base: Dict[str, float], extra: Dict[str, float]):
+    out = base.copy()
+    for k, v in extra.items():
+        out[k] = out.get(k, 0) + v
+    return out
+
+def _scale(ingredients: Dict[str, float], factor: float) -> Dict[str, float]:
+    return {k: round(v * factor, 2) for k, v in ingredients.items()}
+
+class CompiledMenu:
+    """Recipes of one (budget, age factor), flattened to rows of an ingredient matrix."""
+
+    def __init__(self, meal_db: Dict[str, List[Dict[str, Any]]], budget: str, factor: float):
+        self.columns: List[str] = []
+        col_of: Dict[str, int] = {}
+        self.recipes: List[Dict[str, Any]] = []  # rendered recipe per row
+        self.row_cols: List[List[int]] = []      # ingredient columns used by each row
+        self.rows: Dict[str, List[int]] = {}     # meal -> row ids, in rotation order
+        entries: List[List[Tuple[int, float]]] = []  # column-major non-zeros: (row, qty)
+        for meal in MEALS:
+            self.rows[meal] = []
+            for item in meal_db[meal]:
+                ing = _scale(_merge_ingredients(item["ingredients"], item["budget"].get(budget, {})), factor)
+                r = len(self.recipes)
+                self.rows[meal].append(r)
+                self.recipes.append({
+                    "name": item["name"],
+                    "ingredients": ing,
+                    "prep_time_min": item.get("prep_time_min"),
+                    "instructions": item.get("instructions", []),
+                    "notes": item.get("notes", ""),
+                })
+                cols = []
+                for k, v in ing.items():
+                    j = col_of.get(k)
+                    if j is None:
+                        j = col_of[k] = len(self.columns)
+                        self.columns.append(k); entries.append([])
+                    entries[j].append((r, v))
+                    cols.append(j)
+                self.row_cols.append(cols)
+        self.entries = entries
+
+    def totals(self, counts: List[int]) -> List[float]:
+        """counts (uses per row) x matrix -> quantity per ingredient column."""
+        return [round(sum(counts[r] * q for r, q in col), 2) for col in self.entries]
+
+class MealPlanner:
+    def __init__(self, meal_db: Dict[str, List[Dict[str, Any]]], cache_size: int = 256):
+        self.menus = {(b, f): CompiledMenu(meal_db, b, f) for b in BUDGETS for f in AGE_FACTORS}
+        self.cache = LRUCache(cache_size)
+
+    def plan(self, budget: str, age_years: float, days: int) -> Dict[str, Any]:
+        budget = normalize_budget(budget)
+        key = (budget, age_factor(age_years), days)
+        return self.cache.get_or_compute(key, lambda: self._build(*key))
+
+    def _build(self, budget: str, factor: float, days: int) -> Dict[str, Any]:
+        menu = self.menus[(budget, factor)]
+        counts = [0] * len(menu.recipes)
+        plan = []
+        links: Dict[str, Dict[str, None]] = {}  # ingredient -> recipe labels (dict as an ordered set)
+        for d in range(days):
+            day_num = d + 1
+            day_plan: Dict[str, Any] = {"day": day_num}
+            for meal in MEALS:
+                rows = menu.rows[meal]
+                r = rows[d % len(rows)]
+                counts[r] += 1
+                recipe = menu.recipes[r]
+                day_plan[meal] = recipe
+                label = f"Day {day_num} {meal.title()} — {recipe['name']}"
+                for j in menu.row_cols[r]:
+                    links.setdefault(menu.columns[j], {})[label] = None
+            plan.append(day_plan)
+        totals = dict(zip(menu.columns, menu.totals(counts)))
+        return {
+            "ok": True,
+            "days": days,
+            "budget": budget,
+            "plan": plan,
+            "grocery_list": {k: totals[k] for k in links},  # in order of first use
+            "grocery_links": {k: list(v) for k, v in links.items()},  # which recipes use each ingredient
+        }
+
+    def stream(self, budget: str, children: List[Tuple[str, float]], days: int) -> Iterator[Dict[str, Any]]:
+        """Yields one frame per day for all children, then a final grocery frame.
+
+        Only per-recipe use counts and per-ingredient label sets are kept between
+        days, so memory does not grow with the horizon.
+        """
+        budget = normalize_budget(budget)
+        menus = [(name, self.menus[(budget, age_factor(age))]) for name, age in children]
+        counts = {id(m): (m, [0] * len(m.recipes)) for _, m in menus}
+        links: Dict[str, set] = {}
+        for d in range(days):
+            frame_children = []
+            for name, menu in menus:
+                uses = counts[id(menu)][1]
+                meals: Dict[str, Any] = {"name": name}
+                for meal in MEALS:
+                    rows = menu.rows[meal]
+                    r = rows[d % len(rows)]
+                    uses[r] += 1
+                    recipe = menu.recipes[r]
+                    meals[meal] = recipe
+                    label = f"{meal.title()} — {recipe['name']}"
+                    for j in menu.row_cols[r]:
+                        links.setdefault(menu.columns[j], set()).add(label)
+                frame_children.append(meals)
+            yield {"day": d + 1, "children": frame_children}
+        grocery: Dict[str, float] = {}
+        for menu, uses in counts.values():
+            for k, v in zip(menu.columns, menu.totals(uses)):
+                if v:
+                    grocery[k] = round(grocery.get(k, 0) + v, 2)
+        yield {"done": True, "days": days, "budget": budget, "grocery_list": grocery,
+               "grocery_links": {k: sorted(v) for k, v in links.items()}}
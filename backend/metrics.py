@@ -0,0 +1,181 @@
+# Materialized metrics for Haven Pro.
+# Counters (per kind, org, day and language, plus the minutes of ended sessions) are updated in
+# O(1) per event and checkpointed to disk together with the log position they
+# cover. The app folds events by following the shared segment log (follow()), so
+# with several workers each one counts every worker's events exactly once and
+# all report the same numbers. A "wipe" event zeroes the counters as it is folded,
+# so every worker, and any rebuild, clears them at the same point. Startup loads the checkpoint and replays only the
+# log written after it; a schema change needs a full rebuild:
+#
+#     python metrics.py rebuild
+import json, os, sys, threading
+from typing import Dict, Any, Iterable
+
+from segments import SegmentStore, day_of, session_minutes
+
+SCHEMA_VERSION = 3   # 2: minutes are the measured length of ended sessions; 3: a wipe clears the counters
+
+def event_dims(entry: Dict[str, Any]):
+    """(org, lang) of an event, from whatever the payload carries."""
+    p = entry.get("payload") or {}
+    child = p.get("child") if isinstance(p.get("child"), dict) else {}
+    org = p.get("org") or p.get("org_id") or child.get("org")
+    lang = p.get("lang") or p.get("language") or child.get("language")
+    return org, lang
+
+def _bump(table: Dict[str, Dict[str, float]], key: str, kind: str, n: float = 1):
+    row = table.get(key)
+    if row is None:
+        row = table[key] = {}
+    row[kind] = row.get(kind, 0) + n
+
+class Metrics:
+    def __init__(self, path: str, checkpoint_every: int = 1000):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.lock = threading.Lock()
+        self._since_checkpoint = 0
+        self.reset()
+
+    def reset(self):
+        self._clear()
+        self.position: Dict[str, Any] = {"day": None, "offset": 0}
+
+    def _clear(self):
+        self.kinds: Dict[str, int] = {}
+        self.by_org: Dict[str, Dict[str, float]] = {}
+        self.by_day: Dict[str, Dict[str, float]] = {}
+        self.by_lang: Dict[str, Dict[str, float]] = {}
+        self.minutes_total = 0
+        self.events = 0
+
+    # ---- updates ----
+    def record(self, entry: Dict[str, Any]):
+        kind = entry.get("kind")
+        if kind == "wipe":
+            self._clear()  # counted afresh from here; the position is kept
+        day = day_of(entry.get("ts", 0))
+        org, lang = event_dims(entry)
+        minutes = session_minutes(entry)
+        self.events += 1
+        self.kinds[kind] = self.kinds.get(kind, 0) + 1
+        _bump(self.by_day, day, kind)
+        if org: _bump(self.by_org, org, kind)
+        if lang: _bump(self.by_lang, lang, kind)
+        if minutes:
+            self.minutes_total += minutes
+            _bump(self.by_day, day, "minutes", minutes)
+            if org: _bump(self.by_org, org, "minutes", minutes)
+            if lang: _bump(self.by_lang, lang, "minutes", minutes)
+
+    def on_commit(self, entries: Iterable[Dict[str, Any]], day: str, offset: int):
+        """EventWriter hook: fold a committed batch and remember how far the log is covered.
+
+        Single-writer alternative to follow(); use one or the other, not both.
+        """
+        with self.lock:
+            n = 0
+            for e in entries:
+                self.record(e); n += 1
+            self.position = {"day": day, "offset": offset}
+            self._since_checkpoint += n
+            due = self._since_checkpoint >= self.checkpoint_every
+        if due:
+            self.checkpoint()
+
+    def follow(self, store: SegmentStore) -> int:
+        """Fold whatever any process appended to the log since our position."""
+        n = self.catch_up(store)
+        with self.lock:
+            self._since_checkpoint += n
+            due = self._since_checkpoint >= self.checkpoint_every
+        if due:
+            self.checkpoint()
+        return n
+
+    # ---- reads ----
+    def totals(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"sessions": self.kinds.get("session_start", 0), "minutes_saved_total": round(self.minutes_total, 2)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "schema": SCHEMA_VERSION, "events": self.events, "minutes_total": self.minutes_total,
+                "kinds": dict(self.kinds), "position": dict(self.position),
+                "by_org": {k: dict(v) for k, v in self.by_org.items()},
+                "by_day": {k: dict(v) for k, v in self.by_day.items()},
+                "by_lang": {k: dict(v) for k, v in self.by_lang.items()},
+            }
+
+    # ---- persistence ----
+    def checkpoint(self):
+        snap = self.snapshot()
+        tmp = f"{self.path}.{os.getpid()}.tmp"  # workers checkpoint independently; the last replace wins
+        with open(tmp, "w") as f:
+            json.dump(snap, f)
+        os.replace(tmp, self.path)
+        with self.lock:
+            self._since_checkpoint = 0
+
+    def load(self) -> bool:
+        """Restore the last checkpoint; False if there is none or its schema is outdated."""
+        try:
+            with open(self.path) as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if snap.get("schema") != SCHEMA_VERSION:
+            return False
+        with self.lock:
+            self.kinds = snap["kinds"]; self.by_org = snap["by_org"]
+            self.by_day = snap["by_day"]; self.by_lang = snap["by_lang"]
+            self.minutes_total = snap["minutes_total"]; self.events = snap["events"]
+            self.position = snap["position"]
+        return True
+
+    def catch_up(self, store: SegmentStore) -> int:
+        """Replay log lines written after the checkpointed position."""
+        start_day, start_off = self.position.get("day"), self.position.get("offset", 0)
+        n = 0
+        with self.lock:
+            for day in store.days():
+                if start_day and day < start_day:
+                    continue
+                off = start_off if day == start_day else 0
+                with open(store.segment_path(day), "rb") as f:
+                    f.seek(off)
+                    for raw in f:
+                        if not raw.endswith(b"\n"):
+                            break  # line still being written
+                        off += len(raw)
+                        try:
+                            self.record(json.loads(raw)); n += 1
+                        except ValueError:
+                            pass
+                self.position = {"day": day, "offset": off}
+        return n
+
+    def rebuild(self, store: SegmentStore) -> int:
+        """Recompute everything from the full log (after a schema change)."""
+        with self.lock:
+            self.reset()
+        n = self.catch_up(store)
+        self.checkpoint()
+        return n
+
+    def restore(self, store: SegmentStore) -> int:
+        """Startup: checkpoint + tail replay, or a full rebuild if the checkpoint is unusable."""
+        if not self.load():
+            return self.rebuild(store)
+        n = self.catch_up(store)
+        if n:
+            self.checkpoint()
+        return n
+
+if __name__ == "__main__":
+    from config import DATA_DIR
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python metrics.py rebuild")
+    m = Metrics(os.path.join(DATA_DIR, "metrics.json"))
+    print(f"replayed {m.rebuild(SegmentStore(os.path.join(DATA_DIR, 'events')))} events")
@@ -0,0 +1,62 @@
+# Data-subject access and erasure for Haven Pro.
+# A subject is "child:<name>" or "email:<address>". event_subjects() names the
+# subjects an event mentions; the segment store indexes events by it as they are
+# written (see segments.py), so an export or erasure reads one person's events
+# without scanning the log. scrub_event() is what erasure leaves of an event:
+# its time, kind and non-identifying dimensions, so aggregate metrics still hold.
+import json, time
+from typing import Any, Dict, Iterator, List, Optional
+
+from segments import SegmentStore
+
+IDENTIFYING = ("name", "email")  # payload fields removed on erasure, besides the child's name
+
+def child_subject(name: str) -> str:
+    return f"child:{name}"
+
+def email_subject(email: str) -> str:
+    return f"email:{email.strip().lower()}"
+
+def event_subjects(entry: Dict[str, Any]) -> List[str]:
+    p = entry.get("payload") or {}
+    if not isinstance(p, dict):
+        return []
+    out = []
+    child = p.get("child")
+    if isinstance(child, dict): child = child.get("name")
+    if isinstance(child, str) and child: out.append(child_subject(child))
+    if entry.get("kind") == "child_add" and p.get("name"): out.append(child_subject(p["name"]))
+    if isinstance(p.get("email"), str) and p["email"]: out.append(email_subject(p["email"]))
+    return out
+
+def scrub_event(entry: Dict[str, Any]) -> Dict[str, Any]:
+    p = {k: v for k, v in (entry.get("payload") or {}).items() if k not in IDENTIFYING}
+    if isinstance(p.get("child"), dict):
+        p["child"] = {k: p["child"][k] for k in ("language", "org") if k in p["child"]}  # what metrics read
+    elif "child" in p:
+        del p["child"]
+    return {**entry, "payload": p}
+
+def export_stream(store, segments: SegmentStore, subject: str, fmt: str = "ndjson",
+                  start: Optional[str] = None, end: Optional[str] = None) -> Iterator[bytes]:
+    """The subject's stored records, then each of their events, as NDJSON lines or one JSON document.
+
+    Event lines are passed through from the log as they are, a chunk at a time.
+    """
+    kind, _, value = subject.partition(":")
+    profile = store.export_subject(child=value if kind == "child" else None, email=value if kind == "email" else None)
+    head = {"subject": subject, "exported_at": time.time(), **profile}
+    events = segments.find(subject, start, end)
+    n = 0
+    if fmt == "ndjson":
+        yield (json.dumps({"type": "profile", **head}) + "\n").encode()
+        for _, raw in events:
+            n += 1
+            yield b'{"type": "event", "event": ' + raw.rstrip() + b"}\n"
+        yield (json.dumps({"type": "end", "events": n}) + "\n").encode()
+    else:
+        yield json.dumps(head)[:-1].encode() + b', "events": ['
+        for _, raw in events:
+            yield (b", " if n else b"") + raw.rstrip()
+            n += 1
+        yield b'], "event_count": ' + str(n).encode() + b"}\n"
@@ -0,0 +1,136 @@
+# Web-push dispatch for Haven Pro.
+# Sends fan out over a bounded thread pool; each push-service host gets its own
+# pooled requests.Session so connections are reused. Transient failures (network
+# errors, 429, 5xx) are retried with exponential backoff; 404/410 mark the
+# subscription as expired so the caller can prune it, and so does any other error
+# raised for one subscription (e.g. malformed keys), which counts as failed. pywebpush and requests
+# are imported on the first send, so workers that never push don't load them.
+import json, random, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+EXPIRED_STATUS = (404, 410)
+
+def _retryable(status: Optional[int]) -> bool:
+    return status is None or status == 429 or status >= 500
+
+class PushDispatcher:
+    def __init__(self, vapid_private_key: str, vapid_claims: Dict[str, Any], workers: int = 8,
+                 timeout: float = 10.0, retries: int = 3, backoff_s: float = 0.5,
+                 on_expired: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.vapid_private_key = vapid_private_key
+        self.vapid_claims = vapid_claims
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.on_expired = on_expired
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._sessions: Dict[str, Any] = {}  # host -> requests.Session
+        self._vapid = None
+        self._lock = threading.Lock()
+        self._latencies: "deque[float]" = deque(maxlen=2048)  # ms of recent sends
+        self._stats = {"sent": 0, "failed": 0, "expired": 0, "retries": 0}
+
+    # ---- public ----
+    def send_all(self, subs: List[Dict[str, Any]], payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Pushes payload to every subscription and waits for all of them."""
+        data = json.dumps(payload)
+        results = list(self._executor().map(lambda s: self.send(s, data), subs))
+        report = {"attempted": len(subs), "sent": 0, "failed": 0, "expired": 0, "retries": 0}
+        for r in results:
+            report[r["status"]] += 1
+            report["retries"] += r["attempts"] - 1
+        report["latency_ms"] = _percentiles([r["latency_ms"] for r in results])
+        return report
+
+    def send(self, sub: Dict[str, Any], data: str) -> Dict[str, Any]:
+        """One push with retries; returns {"status": sent|failed|expired, "attempts", "latency_ms"}."""
+        import requests
+        from pywebpush import webpush, WebPushException
+        t0 = time.perf_counter()
+        status, attempt, prune = "failed", 0, False
+        while True:
+            attempt += 1
+            code = None
+            try:
+                webpush(subscription_info=sub, data=data, vapid_private_key=self._vapid_key(),
+                        vapid_claims=dict(self.vapid_claims),  # webpush adds aud/exp to the dict it is given
+                        timeout=self.timeout, requests_session=self._session(sub["endpoint"]))
+                status = "sent"
+                break
+            except WebPushException as e:
+                code = e.response.status_code if e.response is not None else None
+                if code in EXPIRED_STATUS:
+                    status = "expired"
+                    break
+                if code is not None and not _retryable(code):
+                    break
+            except requests.RequestException:
+                pass  # connection error / timeout: retry
+            except Exception:
+                prune = True  # unusable subscription (bad keys, bad endpoint): retrying will not help
+                break
+            if attempt > self.retries:
+                break
+            time.sleep(self.backoff_s * (2 ** (attempt - 1)) * (0.5 + random.random()))
+        ms = (time.perf_counter() - t0) * 1000.0
+        with self._lock:
+            self._stats[status] += 1
+            self._stats["retries"] += attempt - 1
+            self._latencies.append(ms)
+        if (status == "expired" or prune) and self.on_expired is not None:
+            self.on_expired(sub)
+        return {"status": status, "attempts": attempt, "latency_ms": round(ms, 3)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "hosts": len(self._sessions), "workers": self.workers,
+                    "latency_ms": _percentiles(list(self._latencies))}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        for s in list(self._sessions.values()):
+            s.close()
+        self._sessions.clear()
+
+    # ---- internals ----
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="haven-push")
+        return self._pool
+
+    def _session(self, endpoint: str):
+        import requests
+        from requests.adapters import HTTPAdapter
+        parts = urlsplit(endpoint)
+        host = f"{parts.scheme}://{parts.netloc}"
+        s = self._sessions.get(host)
+        if s is None:
+            with self._lock:
+                s = self._sessions.get(host)
+                if s is None:
+                    s = requests.Session()
+                    s.mount(host, HTTPAdapter(pool_connections=1, pool_maxsize=self.workers))
+                    self._sessions[host] = s
+        return s
+
+    def _vapid_key(self):
+        # parse the VAPID key once instead of on every send
+        if self._vapid is None:
+            from py_vapid import Vapid
+            self._vapid = Vapid.from_string(private_key=self.vapid_private_key)
+        return self._vapid
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    v = sorted(values)
+    pick = lambda q: round(v[min(len(v) - 1, int(q * len(v)))], 3)
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": round(v[-1], 3)}
@@ -0,0 +1,96 @@
+# Reminder scheduler for plan blocks.
+# Pending reminders are persisted in the storage backend and held in memory as a
+# min-heap of due buckets (due time rounded down to `coalesce_s`). Reminders in
+# the same bucket fire together. The scheduler thread sleeps on a condition until
+# the earliest bucket is due, so an idle scheduler costs no CPU however many
+# timers are pending.
+import heapq, threading, time
+from typing import Any, Callable, Dict, List, Optional
+
+from storage import Storage
+
+Reminder = Dict[str, Any]  # {"id", "due", "parent", "title", "body", optional "key" and "child"}
+
+class ReminderScheduler:
+    def __init__(self, store: Storage, fire: Callable[[float, List[Reminder]], None], coalesce_s: int = 60):
+        self.store = store
+        self.fire = fire
+        self.coalesce_s = max(1, coalesce_s)
+        self._heap: List[float] = []                    # bucket keys
+        self._buckets: Dict[float, List[Reminder]] = {}  # bucket key -> reminders
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = False
+        self._stats = {"scheduled": 0, "fired": 0, "batches": 0, "skipped": 0, "errors": 0, "duplicate": 0}
+
+    def bucket(self, due: float) -> float:
+        return due - (due % self.coalesce_s)
+
+    def start(self):
+        """Load persisted reminders and start the scheduler thread."""
+        self._add(self.store.pending_reminders())
+        self._thread = threading.Thread(target=self._run, name="haven-reminders", daemon=True)
+        self._thread.start()
+
+    def schedule(self, reminders: List[Reminder]) -> int:
+        if not reminders:
+            return 0
+        added = [{**r, "id": i} for r, i in zip(reminders, self.store.add_reminders(reminders)) if i is not None]
+        self._add(added)  # a reminder whose key is already pending is not queued twice
+        with self._cond:
+            self._stats["scheduled"] += len(added)
+            self._stats["duplicate"] += len(reminders) - len(added)
+        return len(added)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {**self._stats, "pending": sum(len(v) for v in self._buckets.values()),
+                    "buckets": len(self._buckets), "next_due": self._heap[0] if self._heap else None}
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _add(self, reminders: List[Reminder]):
+        with self._cond:
+            earliest = self._heap[0] if self._heap else None
+            for r in reminders:
+                key = self.bucket(r["due"])
+                b = self._buckets.get(key)
+                if b is None:
+                    b = self._buckets[key] = []
+                    heapq.heappush(self._heap, key)
+                b.append(r)
+            if self._heap and self._heap[0] != earliest:
+                self._cond.notify()  # wake the thread: there is a new earliest bucket
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    now = time.time()
+                    if self._heap and self._heap[0] <= now:
+                        break
+                    self._cond.wait(timeout=(self._heap[0] - now) if self._heap else None)
+                if self._stop:
+                    return
+                key = heapq.heappop(self._heap)
+                batch = self._buckets.pop(key)
+            self._fire(key, batch)
+
+    def _fire(self, key: float, batch: List[Reminder]):
+        try:
+            claimed = set(self.store.claim_reminders([r["id"] for r in batch]))
+            due = [r for r in batch if r["id"] in claimed]
+            if due:
+                self.fire(key, due)
+        except Exception:
+            with self._cond: self._stats["errors"] += 1
+            return
+        with self._cond:
+            self._stats["fired"] += len(due)
+            self._stats["skipped"] += len(batch) - len(due)
+            self._stats["batches"] += 1 if due else 0
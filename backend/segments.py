@@ -0,0 +1,440 @@
+# Day-partitioned event log for Haven Pro.
+# events/YYYY-MM-DD.jsonl holds the events of one UTC day; once a day is over its
+# segment is sealed and a YYYY-MM-DD.summary.json sidecar (per-kind counts and
+# session minutes) is written next to it, so queries never re-parse old days.
+# Appends, compaction and migration hold an flock on events/.lock as well as a
+# thread lock, so several uvicorn workers can share one log without interleaving.
+#
+# With a subjects function, every segment also has a YYYY-MM-DD.subjects index:
+# one "key offset length" line per (data subject, event), where key is a hash of
+# the subject ("child:Ava", "email:a@b.c"). It is appended together with the
+# segment, so finding or redacting one person's events reads the small index
+# files and then only their lines.
+import asyncio, hashlib, json, os, threading
+try:
+    import fcntl
+except ImportError:  # non-POSIX: single-process only
+    fcntl = None
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+SEGMENT_SUFFIX = ".jsonl"
+SUMMARY_SUFFIX = ".summary.json"
+INDEX_SUFFIX = ".subjects"
+
+def subject_key(subject: str) -> str:
+    """Index key of a data subject; the index holds hashes, not names or emails."""
+    return hashlib.sha256(subject.encode("utf-8")).hexdigest()[:16]
+
+def day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d")
+
+def today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def empty_summary() -> Dict[str, Any]:
+    return {"lines": 0, "bytes": 0, "kinds": {}, "session_minutes": 0}
+
+def session_minutes(obj: Dict[str, Any]) -> float:
+    """Child minutes an event accounts for: the measured length of a session_end, or the
+    planned duration of a session_start logged before sessions were tracked (no session id)."""
+    kind = obj.get("kind")
+    if kind == "session_end":
+        return float((obj.get("payload") or {}).get("minutes", 0))
+    if kind == "session_start":
+        p = obj.get("payload") or {}
+        return 0 if "session" in p else int(p.get("duration", 0))
+    return 0
+
+def fold_event(summary: Dict[str, Any], obj: Dict[str, Any]):
+    kind = obj.get("kind")
+    summary["kinds"][kind] = summary["kinds"].get(kind, 0) + 1
+    summary["session_minutes"] += session_minutes(obj)
+
+def _count_lines(path: str) -> int:
+    n = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            n += chunk.count(b"\n")
+    return n
+
+class ProcessLock:
+    """Re-entrant lock held across threads of this process and, via flock, across processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._rlock.release()
+
+class SegmentStore:
+    def __init__(self, root: str, subjects: Optional[Callable[[Dict[str, Any]], Iterable[str]]] = None):
+        self.root = root
+        self.subjects = subjects  # event -> data subjects it mentions; None disables the subject index
+        os.makedirs(root, exist_ok=True)
+        self.lock = ProcessLock(os.path.join(root, ".lock"))  # held while a segment file is appended to or rewritten
+        self._cache: Dict[str, Dict[str, Any]] = {}  # day -> summary (covers summary["bytes"] of the file)
+        self._sidecar_bytes: Dict[str, int] = {}     # day -> bytes covered by the sidecar on disk
+
+    # ---- paths ----
+    def segment_path(self, day: str) -> str:
+        return os.path.join(self.root, day + SEGMENT_SUFFIX)
+
+    def summary_path(self, day: str) -> str:
+        return os.path.join(self.root, day + SUMMARY_SUFFIX)
+
+    def index_path(self, day: str) -> str:
+        return os.path.join(self.root, day + INDEX_SUFFIX)
+
+    def days(self) -> List[str]:
+        return sorted(n[:-len(SEGMENT_SUFFIX)] for n in os.listdir(self.root) if n.endswith(SEGMENT_SUFFIX))
+
+    # ---- writes ----
+    def append(self, day: str, data: str, fsync: bool = False,
+               index: Optional[List[Tuple[str, int, int]]] = None) -> int:
+        """Append whole lines to a day segment; returns the segment's new end offset.
+
+        index holds (subject, offset in data, length) of the lines that mention a
+        data subject; it is appended to the day's subject index under the same lock.
+        """
+        raw = data.encode("utf-8")
+        buf = memoryview(raw)
+        with self.lock:
+            fd = os.open(self.segment_path(day), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                while buf:
+                    buf = buf[os.write(fd, buf):]
+                if fsync:
+                    os.fsync(fd)
+                end = os.lseek(fd, 0, os.SEEK_END)
+            finally:
+                os.close(fd)
+            if index is not None:
+                self._append_index(day, [(subject_key(subj), end - len(raw) + off, n) for subj, off, n in index])
+            return end
+
+    def _append_index(self, day: str, entries: List[Tuple[str, int, int]]):
+        # always opened, so a day written with indexing on has an index file even if it mentions nobody
+        fd = os.open(self.index_path(day), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if entries:
+                os.write(fd, "".join(f"{k} {off} {n}\n" for k, off, n in entries).encode())
+        finally:
+            os.close(fd)
+
+    def invalidate(self, day: str):
+        """Forget the cached/sidecar summary of a segment that was rewritten or removed."""
+        self._cache.pop(day, None)
+        self._sidecar_bytes.pop(day, None)
+        try:
+            os.remove(self.summary_path(day))
+        except FileNotFoundError:
+            pass
+
+    # ---- retention ----
+    def compact(self, cutoff_ts: float) -> Dict[str, int]:
+        """Drop events older than cutoff_ts in O(1) memory.
+
+        Segments of days before the cutoff day are unlinked without being parsed.
+        The cutoff day itself is streamed into a temp file that atomically replaces
+        it; bytes appended while it was being filtered are copied over under the
+        lock, so concurrent writes are never lost. If a redaction rewrote the day
+        meanwhile, the day is filtered again under the lock, so it is not undone.
+        """
+        cutoff_day = day_of(cutoff_ts)
+        report = {"segments_dropped": 0, "lines_reclaimed": 0, "bytes_reclaimed": 0}
+        for day in self.days():
+            if day > cutoff_day:
+                break
+            path = self.segment_path(day)
+            if day < cutoff_day:
+                with self.lock:
+                    if not os.path.exists(path):
+                        continue  # dropped by another worker
+                    size = os.path.getsize(path)
+                    lines = self._known_lines(day, size)
+                    if lines is None:
+                        lines = _count_lines(path)
+                    os.remove(path)
+                    self.invalidate(day)
+                    self._remove_index(day)
+                report["segments_dropped"] += 1
+                report["bytes_reclaimed"] += size
+                report["lines_reclaimed"] += lines
+                continue
+            tmp = f"{path}.{os.getpid()}.compact"
+            dropped = [0, 0]  # lines, bytes
+            index: Optional[List[Tuple[str, int, int]]] = [] if self.subjects else None  # rebuilt for the kept lines
+            with open(path, "rb") as src, open(tmp, "wb") as dst:
+                seen = self._index_stamp(day)
+                done = self._filter(src, dst, 0, cutoff_ts, dropped, index)
+                with self.lock:
+                    if os.stat(path).st_ino != os.fstat(src.fileno()).st_ino:
+                        os.remove(tmp)  # another worker compacted this segment first
+                        continue
+                    if self._index_stamp(day) != seen:
+                        # the index was rewritten (a redaction, in place) or appended to since the pass began:
+                        # the copy may hold lines from before a redaction, so filter the day again from the start
+                        dst.seek(0); dst.truncate()
+                        dropped[:] = [0, 0]
+                        if index is not None: index.clear()
+                        done = 0
+                    self._filter(src, dst, done, cutoff_ts, dropped, index)  # whatever was appended meanwhile
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                    if index is not None:
+                        self._write_index(day, index)
+                    os.replace(tmp, path)
+                    self.invalidate(day)
+            report["lines_reclaimed"] += dropped[0]
+            report["bytes_reclaimed"] += dropped[1]
+        return report
+
+    def _filter(self, src, dst, offset: int, cutoff_ts: float, dropped: List[int],
+                index: Optional[List[Tuple[str, int, int]]] = None) -> int:
+        """Copy complete lines from offset on that are not older than cutoff_ts; returns the new offset.
+
+        With index, the subject entries of the kept lines (at their offsets in dst) are added to it.
+        """
+        src.seek(offset)
+        for raw in src:
+            if not raw.endswith(b"\n"):
+                break  # line still being appended
+            offset += len(raw)
+            try:
+                obj = json.loads(raw)
+                keep = obj.get("ts", 0) >= cutoff_ts
+            except ValueError:
+                keep = False
+            if keep:
+                if index is not None:
+                    pos = dst.tell()
+                    index.extend((subject_key(subj), pos, len(raw)) for subj in self.subjects(obj))
+                dst.write(raw)
+            else:
+                dropped[0] += 1; dropped[1] += len(raw)
+        return offset
+
+    def _known_lines(self, day: str, size: int) -> Optional[int]:
+        s = self._cache.get(day) or self._load_sidecar(day)
+        return s["lines"] if s and s["bytes"] == size else None
+
+    def migrate(self, legacy_path: str) -> int:
+        """Split a single events.jsonl into day segments; the old file is kept as *.migrated."""
+        if not os.path.exists(legacy_path):
+            return 0
+        moved, cur_day, out = 0, None, None
+        with self.lock:
+            if not os.path.exists(legacy_path):
+                return 0  # another worker migrated it while we waited for the lock
+            try:
+                with open(legacy_path) as f:
+                    for line in f:
+                        try:
+                            day = day_of(json.loads(line)["ts"])
+                        except Exception:
+                            continue
+                        if day != cur_day:  # the legacy log is chronological, so days change rarely
+                            if out: out.close()
+                            cur_day, out = day, open(self.segment_path(day), "a")
+                        out.write(line if line.endswith("\n") else line + "\n")
+                        moved += 1
+            finally:
+                if out: out.close()
+            os.replace(legacy_path, legacy_path + ".migrated")
+        return moved
+
+    # ---- data subjects ----
+    def find(self, subject: str, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Tuple[str, bytes]]:
+        """(day, line) of every event that mentions subject, read through the subject index."""
+        key = subject_key(subject)
+        for day in self.days():
+            if (start and day < start) or (end and day > end):
+                continue
+            hits = [(off, n) for k, off, n in self._read_index(day) if k == key]
+            if not hits:
+                continue
+            with open(self.segment_path(day), "rb") as f:
+                for off, n in hits:
+                    f.seek(off)
+                    raw = f.read(n)
+                    if self._mentions(raw, subject):  # guards against a stale or colliding entry
+                        yield day, raw
+
+    def redact(self, subject: str, scrub: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, int]:
+        """Rewrite every event that mentions subject as scrub(event), in place and at the same length.
+
+        The scrubbed line is padded with spaces, so no offset moves and nothing else is
+        rewritten; scrub must keep "ts" and "kind" (summaries and metrics stay valid).
+        The redacted lines are dropped from the subject index.
+        """
+        key = subject_key(subject)
+        report = {"events_redacted": 0, "days": 0}
+        for day in self.days():
+            if not any(k == key for k, _, _ in self._read_index(day)):
+                continue
+            with self.lock:
+                entries = self._read_index(day)
+                done = set()
+                with open(self.segment_path(day), "r+b") as f:
+                    for k, off, n in entries:
+                        if k != key or off in done:
+                            continue
+                        f.seek(off)
+                        raw = f.read(n)
+                        if not self._mentions(raw, subject):
+                            continue
+                        obj = json.loads(raw)
+                        for out in (scrub(obj), {"ts": obj.get("ts"), "kind": obj.get("kind")}):
+                            line = json.dumps(out).encode("utf-8")
+                            if len(line) < n:
+                                break
+                        else:
+                            continue  # cannot happen for a well-formed line; leave it rather than corrupt the log
+                        f.seek(off)
+                        f.write(line + b" " * (n - 1 - len(line)) + b"\n")
+                        done.add(off)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._write_index(day, [e for e in entries if e[1] not in done])
+            if done:
+                report["events_redacted"] += len(done)
+                report["days"] += 1
+        return report
+
+    def _mentions(self, raw: bytes, subject: str) -> bool:
+        try:
+            return subject in self.subjects(json.loads(raw))
+        except (ValueError, TypeError, AttributeError):
+            return False
+
+    def _read_index(self, day: str) -> List[Tuple[str, int, int]]:
+        if self.subjects is None:
+            return []
+        if not os.path.exists(self.index_path(day)):
+            self._build_index(day)
+        out = []
+        try:
+            with open(self.index_path(day)) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 3:
+                        out.append((parts[0], int(parts[1]), int(parts[2])))
+        except FileNotFoundError:
+            pass  # segment dropped meanwhile
+        return out
+
+    def _build_index(self, day: str):
+        """One-time index of a segment written before indexing was on (or by migrate())."""
+        with self.lock:
+            path = self.segment_path(day)
+            if os.path.exists(self.index_path(day)) or not os.path.exists(path):
+                return
+            index, off = [], 0
+            with open(path, "rb") as f:
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        break
+                    try:
+                        index.extend((subject_key(subj), off, len(raw)) for subj in self.subjects(json.loads(raw)))
+                    except (ValueError, TypeError, AttributeError):
+                        pass
+                    off += len(raw)
+            self._write_index(day, index)
+
+    def _write_index(self, day: str, entries: List[Tuple[str, int, int]]):
+        # called with the lock held
+        tmp = f"{self.index_path(day)}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write("".join(f"{k} {off} {n}\n" for k, off, n in entries))
+        os.replace(tmp, self.index_path(day))
+
+    def _index_stamp(self, day: str) -> Optional[Tuple[int, int, int]]:
+        # redact() replaces the index file and appends grow it, so any change shows up here
+        try:
+            st = os.stat(self.index_path(day))
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _remove_index(self, day: str):
+        try:
+            os.remove(self.index_path(day))
+        except FileNotFoundError:
+            pass
+
+    # ---- summaries ----
+    def summary(self, day: str) -> Dict[str, Any]:
+        path = self.segment_path(day)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            self._cache.pop(day, None)
+            return empty_summary()
+        s = self._cache.get(day)
+        if s is None:
+            s = self._load_sidecar(day)
+            if s is not None:
+                self._sidecar_bytes[day] = s["bytes"]
+        if s is None or s["bytes"] > size:
+            s = empty_summary()
+        if s["bytes"] < size:
+            s = self._scan_tail(path, s)
+        self._cache[day] = s
+        if day < today() and self._sidecar_bytes.get(day) != s["bytes"]:
+            self._write_sidecar(day, s)
+            self._sidecar_bytes[day] = s["bytes"]
+        return s
+
+    def summaries(self, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for day in self.days():
+            if (start and day < start) or (end and day > end):
+                continue
+            yield day, self.summary(day)
+
+    async def asummaries(self, start: Optional[str] = None, end: Optional[str] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        # the sidecar reads and tail scan run in one worker-thread hop, off the event loop
+        return await asyncio.to_thread(lambda: list(self.summaries(start, end)))
+
+    def _scan_tail(self, path: str, s: Dict[str, Any]) -> Dict[str, Any]:
+        s = {"lines": s["lines"], "bytes": s["bytes"], "kinds": dict(s["kinds"]), "session_minutes": s["session_minutes"]}
+        with open(path, "rb") as f:
+            f.seek(s["bytes"])
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # partially written line; picked up on the next call
+                s["bytes"] += len(raw)
+                s["lines"] += 1
+                try:
+                    fold_event(s, json.loads(raw))
+                except Exception:
+                    pass
+        return s
+
+    def _load_sidecar(self, day: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.summary_path(day)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_sidecar(self, day: str, s: Dict[str, Any]):
+        tmp = f"{self.summary_path(day)}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(s, f)
+        os.replace(tmp, self.summary_path(day))
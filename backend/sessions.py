@@ -0,0 +1,175 @@
+# Live session tracking for Haven Pro.
+# Every session is recorded in the storage backend when it starts (child, lang, org,
+# goal, planned minutes, start, last heartbeat, end), so all uvicorn workers see the
+# same sessions: an id that was never recorded is refused, and a session is ended
+# exactly once, by whichever worker's "end it if it is still open" update wins. Only
+# that worker logs the session_end, so the log holds one end per session and the
+# segment summaries, column partitions and metrics all count it once.
+#
+# Heartbeats are the hot path and stay in memory: a worker keeps the sessions it
+# serves as fixed-size __slots__ records (id and three numbers) in a ring of
+# `capacity` slots, and writes their last heartbeat back in one batch per sweep.
+# The sweep then ends every session, whichever worker it was on, whose recorded
+# last heartbeat is older than idle_s, as of that heartbeat (or with its planned
+# length if it never heartbeated). A session pushed out of a full ring is only
+# forgotten by this worker; its next heartbeat picks it up again.
+import itertools, secrets, threading, time
+from typing import Any, Callable, Dict, List, Optional
+
+class Session:
+    __slots__ = ("sid", "slot", "started", "planned", "last_seen", "dirty")
+
+    def __init__(self, sid: str, started: float, planned: float, last_seen: float):
+        self.sid = sid
+        self.slot = -1
+        self.started = started
+        self.planned = planned
+        self.last_seen = last_seen
+        self.dirty = False  # heartbeat not yet written back
+
+def make_id(started: float) -> str:
+    # start time first, so ids sort by age; the random part keeps live ids unguessable
+    return f"{int(started * 1000):x}-{secrets.token_hex(8)}"
+
+class SessionTracker:
+    def __init__(self, store, on_end: Callable[[Dict[str, Any]], None], capacity: int = 10000, idle_s: float = 300,
+                 keep_hours: float = 24):
+        self.store = store
+        self.on_end = on_end
+        self.capacity = capacity
+        self.idle_s = idle_s
+        self.keep_s = keep_hours * 3600  # ended records are pruned after this long
+        self._ring: List[Optional[Session]] = [None] * capacity
+        self._head = 0
+        self._by_id: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"started": 0, "ended": 0, "idle": 0, "overflow": 0, "adopted": 0, "rejected": 0}
+
+    # ---- lifecycle ----
+    def start(self, child: str, lang: Optional[str], org: Optional[str], goal: Optional[str], planned: float,
+              now: Optional[float] = None) -> str:
+        now = time.time() if now is None else now
+        sid = make_id(now)
+        self.store.add_live_session({"session": sid, "child": child, "lang": lang, "org": org, "goal": goal,
+                                     "planned": planned, "started": now})
+        with self._lock:
+            evicted = self._insert(Session(sid, now, planned, now))
+            self._stats["started"] += 1
+        self._write_back(evicted)
+        return sid
+
+    def heartbeat(self, sid: str, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        now = time.time() if now is None else now
+        evicted = None
+        with self._lock:
+            s = self._by_id.get(sid)
+        if s is None:
+            row = self.store.live_session(sid)  # served by another worker, or before a restart
+            if row is None:
+                self._stats["rejected"] += 1
+                return None
+            with self._lock:
+                s = self._by_id.get(sid)
+                if s is None:
+                    s = Session(sid, row["started"], row["planned"], row["last_seen"])
+                    evicted = self._insert(s)
+                    self._stats["adopted"] += 1
+        with self._lock:
+            s.last_seen = max(s.last_seen, now)
+            s.dirty = True
+            out = {"session_id": sid, "elapsed_min": round((now - s.started) / 60.0, 2), "planned_min": s.planned}
+        self._write_back(evicted)
+        return out
+
+    def end(self, sid: str, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        now = time.time() if now is None else now
+        with self._lock:
+            s = self._by_id.get(sid)
+            if s is not None:
+                self._forget(s)
+        row = self.store.end_live_session(sid, now)
+        if row is None:
+            self._stats["rejected"] += 1  # unknown, or already ended
+            return None
+        record = self._record(row, "end")
+        self.on_end(record)
+        return record
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Writes back heartbeats, then ends every session whose last heartbeat is older than idle_s."""
+        now = time.time() if now is None else now
+        with self._lock:
+            beats = [(s.sid, s.last_seen) for s in self._by_id.values() if s.dirty]
+            for s in self._by_id.values():
+                s.dirty = False
+        gone = self.store.touch_live_sessions(beats)  # ended meanwhile, by this worker or another
+        rows = self.store.end_idle_sessions(now - self.idle_s)
+        with self._lock:
+            for sid in itertools.chain(gone, (r["session"] for r in rows)):
+                s = self._by_id.get(sid)
+                if s is not None:
+                    self._forget(s)
+        self.store.prune_live_sessions(now - self.keep_s)
+        for row in rows:
+            self.on_end(self._record(row, "idle"))
+        return len(rows)
+
+    def run(self, every_s: float):
+        if every_s <= 0 or self._thread is not None: return
+        def loop():
+            while not self._stop.wait(every_s):
+                try: self.sweep()
+                except Exception: pass
+        self._thread = threading.Thread(target=loop, name="haven-sessions", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        # sessions stay open in the store; pending heartbeats are written back so a restart does not idle them early
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        with self._lock:
+            beats = [(s.sid, s.last_seen) for s in self._by_id.values() if s.dirty]
+        try: self.store.touch_live_sessions(beats)
+        except Exception: pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "active": len(self._by_id), "capacity": self.capacity, "idle_s": self.idle_s}
+
+    # ---- internals ----
+    def _insert(self, s: Session) -> Optional[Session]:
+        """Puts s in the next ring slot (lock held); returns the session it displaced, if any."""
+        slot = self._head
+        self._head = (slot + 1) % self.capacity
+        old = self._ring[slot]
+        if old is not None:
+            self._forget(old)
+            self._stats["overflow"] += 1
+        s.slot = slot
+        self._ring[slot] = s
+        self._by_id[s.sid] = s
+        return old
+
+    def _forget(self, s: Session):
+        # lock held
+        self._by_id.pop(s.sid, None)
+        if self._ring[s.slot] is s:
+            self._ring[s.slot] = None
+
+    def _write_back(self, s: Optional[Session]):
+        if s is not None and s.dirty:
+            self.store.touch_live_sessions([(s.sid, s.last_seen)])
+
+    def _record(self, row: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        self._stats["ended"] += 1
+        if reason != "end":
+            self._stats[reason] += 1
+        minutes = (row["ended"] - row["started"]) / 60.0
+        if reason != "end" and row["last_seen"] == row["started"]:
+            minutes = row["planned"]  # never heartbeated: credit the plan rather than nothing
+        return {"session": row["session"], "child": row["child"], "lang": row["lang"], "org": row["org"],
+                "goal": row["goal"], "planned": row["planned"], "started": row["started"], "ended": row["ended"],
+                "reason": reason, "minutes": round(minutes, 2)}
@@ -0,0 +1,539 @@
+# Storage backends for Haven Pro (parents, children, sessions, orgs, push subscriptions,
+# reminders, calendar feeds).
+# "sqlite" persists to one WAL-mode database file that every uvicorn worker can
+# share; "memory" keeps the old process-local behaviour (demos, tests).
+import hashlib, json, queue, secrets, sqlite3, threading, time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+def subscription_id(endpoint: str) -> str:
+    return hashlib.sha256(endpoint.encode()).hexdigest()
+
+def _live_export(r) -> Dict[str, Any]:
+    return {k: r[k] for k in ("session", "child", "goal", "planned", "started", "ended")}
+
+def _reminder_export(r) -> Dict[str, Any]:
+    return {k: r.get(k) for k in ("due", "parent", "child", "title", "body")}
+
+def _subscription_export(r) -> Dict[str, Any]:
+    return {k: r.get(k) for k in ("endpoint", "org", "parent")}
+
+class Storage(ABC):
+    """Interface every backend implements; a backend missing a method cannot be instantiated."""
+    @abstractmethod
+    def add_parent(self, parent: Dict[str, Any]): ...
+    @abstractmethod
+    def add_child(self, child: Dict[str, Any]): ...
+    @abstractmethod
+    def put_org(self, org: Dict[str, Any]): ...
+    @abstractmethod
+    def list_orgs(self) -> List[Dict[str, Any]]: ...
+    @abstractmethod
+    def counts(self) -> Dict[str, int]: ...
+    @abstractmethod
+    def delete_children(self, name: str) -> int: ...
+    @abstractmethod
+    def wipe(self): ...
+    @abstractmethod
+    def export(self) -> Dict[str, List[Dict[str, Any]]]: ...
+    @abstractmethod
+    def export_subject(self, child: Optional[str] = None, email: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]: ...
+    # push subscriptions, keyed by subscription_id(endpoint)
+    @abstractmethod
+    def add_subscription(self, sub: Dict[str, Any], org: Optional[str] = None,
+                         parent: Optional[str] = None) -> Tuple[bool, int]: ...
+    @abstractmethod
+    def remove_subscription(self, endpoint: str) -> bool: ...
+    @abstractmethod
+    def subscriptions(self, org: Optional[str] = None, parent: Optional[str] = None) -> List[Dict[str, Any]]: ...
+    # pending reminders; claim_reminders deletes and returns the ids this caller won. A reminder with a "key"
+    # is added only if no pending reminder has that key: its id comes back as None otherwise
+    @abstractmethod
+    def add_reminders(self, reminders: List[Dict[str, Any]]) -> List[Optional[int]]: ...
+    @abstractmethod
+    def pending_reminders(self) -> List[Dict[str, Any]]: ...
+    @abstractmethod
+    def claim_reminders(self, ids: List[int]) -> List[int]: ...
+    # calendar feeds: one token per child, rendered VEVENT text per (token, date)
+    @abstractmethod
+    def feed_token(self, child_name: str) -> str: ...
+    @abstractmethod
+    def put_feed_day(self, token: str, date: str, etag: str, events: str) -> bool: ...
+    @abstractmethod
+    def feed_days(self, token: str) -> Optional[List[Tuple[str, str, str]]]: ...
+    # live sessions (see sessions.py); ending one is a claim: it succeeds once, on whichever worker gets there first
+    @abstractmethod
+    def add_live_session(self, session: Dict[str, Any]): ...
+    @abstractmethod
+    def live_session(self, sid: str) -> Optional[Dict[str, Any]]: ...
+    @abstractmethod
+    def touch_live_sessions(self, beats: List[Tuple[str, float]]) -> List[str]: ...
+    @abstractmethod
+    def end_live_session(self, sid: str, at: float) -> Optional[Dict[str, Any]]: ...
+    @abstractmethod
+    def end_idle_sessions(self, cutoff: float) -> List[Dict[str, Any]]: ...
+    @abstractmethod
+    def prune_live_sessions(self, before: float) -> int: ...
+    def close(self): pass
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.orgs: Dict[str, Dict[str, Any]] = {}
+        self._reminder_seq = 0
+        self._reset()
+
+    def add_parent(self, parent):
+        with self.lock: self.parents.append(parent)
+
+    def add_child(self, child):
+        with self.lock: self.children.setdefault(child.get("name"), []).append(child)
+
+    def put_org(self, org):
+        with self.lock: self.orgs[org["org_id"]] = org
+
+    def list_orgs(self):
+        with self.lock: return list(self.orgs.values())
+
+    def counts(self):
+        with self.lock:
+            return {"parents": len(self.parents), "children": sum(len(v) for v in self.children.values()),
+                    "sessions": len(self.live)}
+
+    def delete_children(self, name):
+        with self.lock:
+            token = self.feed_tokens.pop(name, None)
+            if token: self.feeds.pop(token, None)
+            for r in self.live.values():
+                if r.get("child") == name: r["child"] = None
+            for i in [i for i, r in self.reminders.items() if r.get("child") == name]:
+                self.reminder_keys.pop(self.reminders.pop(i).get("key"), None)
+            return len(self.children.pop(name, []))
+
+    def wipe(self):
+        with self.lock: self._reset()
+
+    def _reset(self):
+        # orgs are employer configuration, not family data, and survive a wipe
+        self.parents: List[Dict[str, Any]] = []
+        self.children: Dict[str, List[Dict[str, Any]]] = {}  # name -> profiles
+        self.feed_tokens: Dict[str, str] = {}  # child name -> token
+        self.feeds: Dict[str, Dict[str, Tuple[str, str]]] = {}  # token -> date -> (etag, events)
+        self.live: Dict[str, Dict[str, Any]] = {}  # session id -> record
+        self.subs: Dict[str, Dict[str, Any]] = {}  # id -> {"sub", "org", "parent"}
+        self.subs_by_org: Dict[str, set] = {}
+        self.subs_by_parent: Dict[str, set] = {}
+        self.reminders: Dict[int, Dict[str, Any]] = {}
+        self.reminder_keys: Dict[str, int] = {}  # key -> id of the pending reminder holding it
+
+    def export(self):
+        with self.lock:
+            return {"parents": list(self.parents), "children": [c for v in self.children.values() for c in v],
+                    "sessions": [_live_export(r) for r in self.live.values()],
+                    "subscriptions": [_subscription_export({"endpoint": r["sub"]["endpoint"], **r}) for r in self.subs.values()],
+                    "reminders": [_reminder_export(r) for r in self.reminders.values()]}
+
+    def export_subject(self, child=None, email=None):
+        with self.lock:
+            return {"parents": [p for p in self.parents if email and (p.get("email") or "").lower() == email],
+                    "children": list(self.children.get(child, [])) if child else [],
+                    "sessions": [_live_export(r) for r in self.live.values() if child and r.get("child") == child],
+                    "subscriptions": [_subscription_export({"endpoint": r["sub"]["endpoint"], **r}) for r in self.subs.values()
+                                      if email and (r["parent"] or "").lower() == email],
+                    "reminders": [_reminder_export(r) for r in self.reminders.values()
+                                  if (child and r.get("child") == child) or (email and (r.get("parent") or "").lower() == email)]}
+
+    def add_subscription(self, sub, org=None, parent=None):
+        sid = subscription_id(sub["endpoint"])
+        with self.lock:
+            if sid in self.subs:
+                return False, len(self.subs)
+            self.subs[sid] = {"sub": sub, "org": org, "parent": parent}
+            if org: self.subs_by_org.setdefault(org, set()).add(sid)
+            if parent: self.subs_by_parent.setdefault(parent, set()).add(sid)
+            return True, len(self.subs)
+
+    def remove_subscription(self, endpoint):
+        sid = subscription_id(endpoint)
+        with self.lock:
+            rec = self.subs.pop(sid, None)
+            if rec is None:
+                return False
+            if rec["org"]: self.subs_by_org.get(rec["org"], set()).discard(sid)
+            if rec["parent"]: self.subs_by_parent.get(rec["parent"], set()).discard(sid)
+            return True
+
+    def subscriptions(self, org=None, parent=None):
+        with self.lock:
+            ids = None
+            if org is not None: ids = set(self.subs_by_org.get(org, ()))
+            if parent is not None:
+                p = self.subs_by_parent.get(parent, set())
+                ids = p.copy() if ids is None else ids & p
+            recs = self.subs.values() if ids is None else (self.subs[i] for i in ids)
+            return [r["sub"] for r in recs]
+
+    def add_reminders(self, reminders):
+        with self.lock:
+            ids = []
+            for r in reminders:
+                key = r.get("key")
+                if key is not None and key in self.reminder_keys:
+                    ids.append(None)
+                    continue
+                self._reminder_seq += 1
+                self.reminders[self._reminder_seq] = {**r, "id": self._reminder_seq}
+                if key is not None: self.reminder_keys[key] = self._reminder_seq
+                ids.append(self._reminder_seq)
+            return ids
+
+    def pending_reminders(self):
+        with self.lock: return list(self.reminders.values())
+
+    def claim_reminders(self, ids):
+        with self.lock:
+            won = []
+            for i in ids:
+                r = self.reminders.pop(i, None)
+                if r is None: continue
+                self.reminder_keys.pop(r.get("key"), None)
+                won.append(i)
+            return won
+
+    def feed_token(self, child_name):
+        with self.lock:
+            token = self.feed_tokens.get(child_name)
+            if token is None:
+                token = self.feed_tokens[child_name] = secrets.token_urlsafe(16)
+                self.feeds[token] = {}
+            return token
+
+    def put_feed_day(self, token, date, etag, events):
+        with self.lock:
+            days = self.feeds.get(token)
+            if days is None or days.get(date, ("",))[0] == etag:
+                return False
+            days[date] = (etag, events)
+            return True
+
+    def feed_days(self, token):
+        with self.lock:
+            days = self.feeds.get(token)
+            return None if days is None else [(d, *days[d]) for d in sorted(days)]
+
+    def add_live_session(self, session):
+        with self.lock: self.live[session["session"]] = {**session, "last_seen": session["started"], "ended": None}
+
+    def live_session(self, sid):
+        with self.lock:
+            r = self.live.get(sid)
+            return dict(r) if r is not None and r["ended"] is None else None
+
+    def touch_live_sessions(self, beats):
+        gone = []
+        with self.lock:
+            for sid, ts in beats:
+                r = self.live.get(sid)
+                if r is None or r["ended"] is not None: gone.append(sid)
+                else: r["last_seen"] = max(r["last_seen"], ts)
+        return gone
+
+    def end_live_session(self, sid, at):
+        with self.lock:
+            r = self.live.get(sid)
+            if r is None or r["ended"] is not None: return None
+            r["last_seen"] = r["ended"] = max(r["last_seen"], at)
+            return dict(r)
+
+    def end_idle_sessions(self, cutoff):
+        with self.lock:
+            out = []
+            for r in self.live.values():
+                if r["ended"] is None and r["last_seen"] < cutoff:
+                    r["ended"] = r["last_seen"]
+                    out.append(dict(r))
+            return out
+
+    def prune_live_sessions(self, before):
+        with self.lock:
+            old = [sid for sid, r in self.live.items() if r["ended"] is not None and r["ended"] < before]
+            for sid in old: del self.live[sid]
+            return len(old)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parents (id INTEGER PRIMARY KEY, email TEXT, name TEXT, org_id TEXT);
+CREATE INDEX IF NOT EXISTS parents_email ON parents(email);
+CREATE INDEX IF NOT EXISTS parents_email_nocase ON parents(email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS parents_org ON parents(org_id);
+CREATE TABLE IF NOT EXISTS children (id INTEGER PRIMARY KEY, name TEXT NOT NULL, age_years REAL,
+                                     language TEXT, temperament TEXT);
+CREATE INDEX IF NOT EXISTS children_name ON children(name);
+CREATE TABLE IF NOT EXISTS live_sessions (id TEXT PRIMARY KEY, child TEXT, lang TEXT, org TEXT, goal TEXT,
+                                          planned REAL, started REAL NOT NULL, last_seen REAL NOT NULL, ended REAL);
+CREATE INDEX IF NOT EXISTS live_sessions_open ON live_sessions(last_seen) WHERE ended IS NULL;
+CREATE INDEX IF NOT EXISTS live_sessions_ended ON live_sessions(ended) WHERE ended IS NOT NULL;
+CREATE INDEX IF NOT EXISTS live_sessions_child ON live_sessions(child);
+CREATE TABLE IF NOT EXISTS orgs (org_id TEXT PRIMARY KEY, name TEXT, domain TEXT);
+CREATE TABLE IF NOT EXISTS subscriptions (id TEXT PRIMARY KEY, endpoint TEXT NOT NULL, keys TEXT,
+                                          org_id TEXT, parent_email TEXT, created REAL);
+CREATE INDEX IF NOT EXISTS subscriptions_org ON subscriptions(org_id);
+CREATE INDEX IF NOT EXISTS subscriptions_parent ON subscriptions(parent_email);
+CREATE INDEX IF NOT EXISTS subscriptions_parent_nocase ON subscriptions(parent_email COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, n INTEGER NOT NULL);
+INSERT OR IGNORE INTO counters (name, n) VALUES ('subscriptions', 0);
+CREATE TABLE IF NOT EXISTS reminders (id INTEGER PRIMARY KEY, due REAL NOT NULL, parent_email TEXT,
+                                      title TEXT, body TEXT, key TEXT, child_name TEXT);
+CREATE INDEX IF NOT EXISTS reminders_due ON reminders(due);
+CREATE TABLE IF NOT EXISTS feeds (child_name TEXT PRIMARY KEY, token TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS feed_days (token TEXT NOT NULL, date TEXT NOT NULL, etag TEXT NOT NULL, events TEXT NOT NULL,
+                                      PRIMARY KEY (token, date));
+"""
+
+def _add_column(c: sqlite3.Connection, table: str, column: str, decl: str):
+    if column not in {r["name"] for r in c.execute(f"PRAGMA table_info({table})")}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migrate_reminder_keys(c: sqlite3.Connection):
+    _add_column(c, "reminders", "key", "TEXT")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS reminders_key ON reminders(key)")
+
+def _migrate_reminder_children(c: sqlite3.Connection):
+    _add_column(c, "reminders", "child_name", "TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS reminders_child ON reminders(child_name)")
+    c.execute("CREATE INDEX IF NOT EXISTS reminders_parent ON reminders(parent_email COLLATE NOCASE)")
+
+def _migrate_drop_sessions(c: sqlite3.Connection):
+    # sessions are recorded in live_sessions now (see sessions.py); nothing reads the old table
+    c.execute("DROP TABLE IF EXISTS sessions")
+
+# One-time upgrades of databases written by older versions, applied in order; PRAGMA user_version
+# records how many have run. SCHEMA already has the current shape, so each step must also be
+# harmless on a new database.
+MIGRATIONS = (_migrate_reminder_keys, _migrate_reminder_children, _migrate_drop_sessions)
+
+class SqliteStorage(Storage):
+    """SQLite in WAL mode behind a small connection pool.
+
+    Statements are fixed SQL strings with ? parameters, so sqlite3's per-connection
+    statement cache reuses the prepared statements.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4):
+        self.path = path
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        self._slots = threading.BoundedSemaphore(pool_size)
+        with self._conn() as c:
+            c.executescript(SCHEMA)
+            c.execute("BEGIN IMMEDIATE")  # workers starting together: one migrates, the rest then find nothing to do
+            version = c.execute("PRAGMA user_version").fetchone()[0]
+            for step in MIGRATIONS[version:]:
+                step(c)
+            if version < len(MIGRATIONS):
+                c.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+    def _connect(self) -> sqlite3.Connection:
+        c = sqlite3.connect(self.path, timeout=10, check_same_thread=False, cached_statements=128)
+        c.row_factory = sqlite3.Row
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        self._all.append(c)
+        return c
+
+    @contextmanager
+    def _conn(self):
+        with self._slots:
+            try:
+                c = self._pool.get_nowait()
+            except queue.Empty:
+                c = self._connect()
+            try:
+                with c:  # one transaction per use
+                    yield c
+            finally:
+                self._pool.put(c)
+
+    def add_parent(self, parent):
+        with self._conn() as c:
+            c.execute("INSERT INTO parents (email, name, org_id) VALUES (?, ?, ?)",
+                      (parent.get("email"), parent.get("name"), parent.get("org")))
+
+    def add_child(self, child):
+        with self._conn() as c:
+            c.execute("INSERT INTO children (name, age_years, language, temperament) VALUES (?, ?, ?, ?)",
+                      (child["name"], child.get("age_years"), child.get("language"), child.get("temperament")))
+
+    def put_org(self, org):
+        with self._conn() as c:
+            c.execute("INSERT OR REPLACE INTO orgs (org_id, name, domain) VALUES (?, ?, ?)",
+                      (org["org_id"], org.get("name"), org.get("domain")))
+
+    def list_orgs(self):
+        with self._conn() as c:
+            return [dict(r) for r in c.execute("SELECT org_id, name, domain FROM orgs")]
+
+    def counts(self):
+        with self._conn() as c:
+            return {k: c.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                    for k, t in (("parents", "parents"), ("children", "children"), ("sessions", "live_sessions"))}
+
+    def delete_children(self, name):
+        with self._conn() as c:
+            c.execute("DELETE FROM feed_days WHERE token IN (SELECT token FROM feeds WHERE child_name = ?)", (name,))
+            c.execute("DELETE FROM feeds WHERE child_name = ?", (name,))
+            c.execute("UPDATE live_sessions SET child = NULL WHERE child = ?", (name,))
+            c.execute("DELETE FROM reminders WHERE child_name = ?", (name,))
+            return c.execute("DELETE FROM children WHERE name = ?", (name,)).rowcount
+
+    def wipe(self):
+        with self._conn() as c:
+            for t in ("parents", "children", "feeds", "feed_days", "live_sessions", "subscriptions", "reminders"):
+                c.execute(f"DELETE FROM {t}")
+            c.execute("UPDATE counters SET n = 0 WHERE name = 'subscriptions'")
+
+    def export(self):
+        with self._conn() as c:
+            return {
+                "parents": [{"email": r["email"], "name": r["name"], "org": r["org_id"]}
+                            for r in c.execute("SELECT email, name, org_id FROM parents")],
+                "children": [dict(r) for r in c.execute("SELECT name, age_years, language, temperament FROM children")],
+                "sessions": [_live_export(r) for r in c.execute(f"SELECT {self._LIVE} FROM live_sessions")],
+                "subscriptions": [dict(r) for r in c.execute(f"SELECT {self._SUB} FROM subscriptions")],
+                "reminders": [dict(r) for r in c.execute(f"SELECT {self._REMINDER} FROM reminders")],
+            }
+
+    _SUB = "endpoint, org_id AS org, parent_email AS parent"
+    _REMINDER = "due, parent_email AS parent, child_name AS child, title, body"
+
+    def export_subject(self, child=None, email=None):
+        # indexed lookups (parents_email_nocase, children_name, live_sessions_child, subscriptions_parent_nocase,
+        # reminders_child, reminders_parent)
+        with self._conn() as c:
+            return {
+                "parents": [{"email": r["email"], "name": r["name"], "org": r["org_id"]}
+                            for r in c.execute("SELECT email, name, org_id FROM parents WHERE email = ? COLLATE NOCASE", (email,))],
+                "children": [dict(r) for r in c.execute("SELECT name, age_years, language, temperament FROM children WHERE name = ?", (child,))],
+                "sessions": [_live_export(r) for r in c.execute(f"SELECT {self._LIVE} FROM live_sessions WHERE child = ?", (child,))],
+                "subscriptions": [dict(r) for r in c.execute(
+                    f"SELECT {self._SUB} FROM subscriptions WHERE parent_email = ? COLLATE NOCASE", (email,))],
+                "reminders": [dict(r) for r in c.execute(
+                    f"SELECT {self._REMINDER} FROM reminders WHERE child_name = ? OR parent_email = ? COLLATE NOCASE",
+                    (child, email))],
+            }
+
+    def add_subscription(self, sub, org=None, parent=None):
+        # O(1): primary-key dedup plus a maintained counter instead of COUNT(*)
+        with self._conn() as c:
+            created = c.execute(
+                "INSERT OR IGNORE INTO subscriptions (id, endpoint, keys, org_id, parent_email, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (subscription_id(sub["endpoint"]), sub["endpoint"], json.dumps(sub.get("keys") or {}), org, parent, time.time())
+            ).rowcount == 1
+            if created:
+                c.execute("UPDATE counters SET n = n + 1 WHERE name = 'subscriptions'")
+            return created, c.execute("SELECT n FROM counters WHERE name = 'subscriptions'").fetchone()[0]
+
+    def remove_subscription(self, endpoint):
+        with self._conn() as c:
+            removed = c.execute("DELETE FROM subscriptions WHERE id = ?", (subscription_id(endpoint),)).rowcount == 1
+            if removed:
+                c.execute("UPDATE counters SET n = n - 1 WHERE name = 'subscriptions'")
+            return removed
+
+    def subscriptions(self, org=None, parent=None):
+        sql, args = "SELECT endpoint, keys FROM subscriptions WHERE 1=1", []
+        if org is not None: sql += " AND org_id = ?"; args.append(org)
+        if parent is not None: sql += " AND parent_email = ?"; args.append(parent)
+        with self._conn() as c:
+            return [{"endpoint": r["endpoint"], "keys": json.loads(r["keys"])} for r in c.execute(sql, args)]
+
+    def add_reminders(self, reminders):
+        with self._conn() as c:
+            rows = [c.execute("INSERT INTO reminders (due, parent_email, title, body, key, child_name) VALUES (?, ?, ?, ?, ?, ?) "
+                              "ON CONFLICT (key) DO NOTHING RETURNING id",
+                              (r["due"], r.get("parent"), r.get("title"), r.get("body"), r.get("key"),
+                               r.get("child"))).fetchone()
+                    for r in reminders]
+            return [r["id"] if r is not None else None for r in rows]
+
+    def pending_reminders(self):
+        with self._conn() as c:
+            return [{"id": r["id"], "due": r["due"], "parent": r["parent_email"], "title": r["title"], "body": r["body"]}
+                    for r in c.execute("SELECT id, due, parent_email, title, body FROM reminders")]
+
+    def claim_reminders(self, ids):
+        # several workers may hold the same reminder after a restart; only the one whose DELETE hits fires it
+        with self._conn() as c:
+            return [i for i in ids if c.execute("DELETE FROM reminders WHERE id = ?", (i,)).rowcount == 1]
+
+    def feed_token(self, child_name):
+        with self._conn() as c:
+            c.execute("INSERT OR IGNORE INTO feeds (child_name, token) VALUES (?, ?)", (child_name, secrets.token_urlsafe(16)))
+            return c.execute("SELECT token FROM feeds WHERE child_name = ?", (child_name,)).fetchone()[0]
+
+    def put_feed_day(self, token, date, etag, events):
+        # the WHERE on the upsert leaves an unchanged day untouched, so rowcount says whether the plan changed
+        with self._conn() as c:
+            if c.execute("SELECT 1 FROM feeds WHERE token = ?", (token,)).fetchone() is None:
+                return False
+            return c.execute(
+                "INSERT INTO feed_days (token, date, etag, events) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(token, date) DO UPDATE SET etag = excluded.etag, events = excluded.events "
+                "WHERE feed_days.etag != excluded.etag", (token, date, etag, events)).rowcount == 1
+
+    def feed_days(self, token):
+        with self._conn() as c:
+            if c.execute("SELECT 1 FROM feeds WHERE token = ?", (token,)).fetchone() is None:
+                return None
+            return [(r["date"], r["etag"], r["events"])
+                    for r in c.execute("SELECT date, etag, events FROM feed_days WHERE token = ? ORDER BY date", (token,))]
+
+    _LIVE = "id AS session, child, lang, org, goal, planned, started, last_seen, ended"
+
+    def add_live_session(self, session):
+        with self._conn() as c:
+            c.execute("INSERT INTO live_sessions (id, child, lang, org, goal, planned, started, last_seen) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                      (session["session"], session.get("child"), session.get("lang"), session.get("org"),
+                       session.get("goal"), session.get("planned"), session["started"], session["started"]))
+
+    def live_session(self, sid):
+        with self._conn() as c:
+            r = c.execute(f"SELECT {self._LIVE} FROM live_sessions WHERE id = ? AND ended IS NULL", (sid,)).fetchone()
+            return dict(r) if r is not None else None
+
+    def touch_live_sessions(self, beats):
+        if not beats: return []
+        with self._conn() as c:
+            return [sid for sid, ts in beats
+                    if c.execute("UPDATE live_sessions SET last_seen = MAX(last_seen, ?) WHERE id = ? AND ended IS NULL",
+                                 (ts, sid)).rowcount == 0]
+
+    def end_live_session(self, sid, at):
+        # one statement: of two workers ending the same session, exactly one gets the row back
+        with self._conn() as c:
+            r = c.execute("UPDATE live_sessions SET last_seen = MAX(last_seen, ?), ended = MAX(last_seen, ?) "
+                          f"WHERE id = ? AND ended IS NULL RETURNING {self._LIVE}", (at, at, sid)).fetchone()
+            return dict(r) if r is not None else None
+
+    def end_idle_sessions(self, cutoff):
+        with self._conn() as c:
+            return [dict(r) for r in c.execute(f"UPDATE live_sessions SET ended = last_seen "
+                                               f"WHERE ended IS NULL AND last_seen < ? RETURNING {self._LIVE}", (cutoff,))]
+
+    def prune_live_sessions(self, before):
+        with self._conn() as c:
+            return c.execute("DELETE FROM live_sessions WHERE ended IS NOT NULL AND ended < ?", (before,)).rowcount
+
+    def close(self):
+        for c in self._all:
+            try: c.close()
+            except sqlite3.Error: pass
+        self._all.clear()
+
+def open_storage(backend: str, sqlite_path: str, pool_size: int = 4) -> Storage:
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SqliteStorage(sqlite_path, pool_size)
+    raise ValueError(f"unknown storage backend: {backend}")
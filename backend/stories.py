@@ -0,0 +1,80 @@
+# Story engine for /story/generate and /story/batch.
+# Templates are compiled once: "{child}" placeholders are split out so rendering
+# is a single str.join, and each language's stories are indexed by theme in a
+# stable order. A story "seed" selects where to start in that order; longer
+# stories are composed from consecutive templates until the requested length is
+# reached. Rendered stories are memoized per (language, segments, child, bilingual).
+import string
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import LRUCache
+
+WORDS_PER_MIN = 100  # read-aloud pace used when a template has no "minutes"
+DEFAULT_THEME = "adventure"
+DEFAULT_CHILD = {"en": "your child", "nl": "je kind"}
+BILINGUAL_LABEL = {"en": "[English]", "nl": "[Nederlands]"}
+
+class CompiledStory:
+    __slots__ = ("id", "title", "theme", "minutes", "pieces")
+
+    def __init__(self, sid: int, item: Dict[str, Any]):
+        self.id = sid
+        self.title = item["title"]
+        self.theme = item.get("theme", DEFAULT_THEME)
+        pieces, buf = [], ""
+        for literal, field, spec, conv in string.Formatter().parse(item["template"]):
+            buf += literal
+            if field is None: continue
+            if field != "child" or spec or conv:
+                raise ValueError(f"story {self.title!r}: unsupported placeholder {{{field}}}")
+            pieces.append(buf); buf = ""
+        pieces.append(buf)
+        self.pieces = pieces  # render = child.join(pieces)
+        self.minutes = float(item.get("minutes") or len(item["template"].split()) / WORDS_PER_MIN)
+
+    def render(self, child: str) -> str:
+        return child.join(self.pieces)
+
+class StoryEngine:
+    def __init__(self, catalogs: Dict[str, List[Dict[str, Any]]], cache_size: int = 1024, default_lang: str = "en"):
+        self.default_lang = default_lang
+        self.stories = {lang: [CompiledStory(i, it) for i, it in enumerate(items)] for lang, items in catalogs.items()}
+        self.by_theme: Dict[Tuple[str, str], List[CompiledStory]] = {}
+        for lang, stories in self.stories.items():
+            for s in stories:
+                self.by_theme.setdefault((lang, s.theme), []).append(s)
+        self.cache = LRUCache(cache_size)
+
+    def themes(self, lang: str) -> List[str]:
+        return sorted(t for l, t in self.by_theme if l == lang)
+
+    def compose(self, lang: str, theme: str, length_min: float, seed: int) -> Tuple[int, ...]:
+        """Ids of consecutive stories of the theme, starting at seed, until length_min is covered."""
+        pool = self.by_theme.get((lang, theme)) or self.stories[lang]
+        start, ids, total = seed % len(pool), [], 0.0
+        for k in range(len(pool)):
+            s = pool[(start + k) % len(pool)]
+            ids.append(s.id); total += s.minutes
+            if total >= length_min: break
+        return tuple(ids)
+
+    def render(self, lang: str, theme: str, length_min: float, seed: int, child: Optional[str] = None,
+               bilingual: bool = False) -> Dict[str, Any]:
+        lang = lang if lang in self.stories else self.default_lang
+        ids = self.compose(lang, theme, length_min, seed)
+        name = child or DEFAULT_CHILD.get(lang, DEFAULT_CHILD["en"])
+        story = self.cache.get_or_compute((lang, ids, name, bilingual), lambda: self._render(lang, ids, name, bilingual))
+        return {**story, "seed": seed}
+
+    def _render(self, lang: str, ids: Tuple[int, ...], name: str, bilingual: bool) -> Dict[str, Any]:
+        stories = self.stories[lang]
+        text = "\n\n".join(stories[i].render(name) for i in ids)
+        if bilingual:
+            alt = next((l for l in self.stories if l != lang), None)
+            if alt is not None:
+                # catalogs are parallel translations; fall back to the first story when the other side is shorter
+                alt_stories = self.stories[alt]
+                text += f"\n\n{BILINGUAL_LABEL.get(alt, '[' + alt + ']')} " + "\n\n".join(
+                    (alt_stories[i] if i < len(alt_stories) else alt_stories[0]).render(name) for i in ids)
+        return {"title": stories[ids[0]].title, "story": text, "segments": len(ids),
+                "minutes": round(sum(stories[i].minutes for i in ids), 1)}
@@ -0,0 +1,52 @@
+"""Per-call latency of the activity index vs. the old linear scan.
+
+    python bench/bench_activities.py [--sizes 10,100,1000,10000,100000] [--json out.json]
+
+The index should stay flat as the catalog grows; the scan grows linearly.
+"""
+import argparse, json, os, random, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from activity_index import ActivityIndex
+
+def synth_catalog(n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        lo = rnd.choice([5, 10, 15, 20, 25, 30])
+        out.append({"name": f"activity {i}", "minutes": [lo, lo + rnd.choice([5, 10, 15, 20])],
+                    "energy": rnd.choice(["calm", "balanced", "active"]), "age_min": rnd.randint(1, 8)})
+    return out
+
+def scan(acts, minutes, age):
+    c = [a for a in acts if a["minutes"][0] <= minutes <= a["minutes"][1] and age >= a["age_min"]]
+    return [a for a in c if a["energy"] != "active"] or c
+
+def per_call_us(fn, queries, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for m, age in queries:
+            fn(m, age)
+    return (time.perf_counter() - t0) / (repeat * len(queries)) * 1e6
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,100,1000,10000,100000")
+    ap.add_argument("--json")
+    args = ap.parse_args()
+    rnd = random.Random(7)
+    queries = [(rnd.choice([10, 20, 30, 40]), rnd.uniform(1, 9)) for _ in range(200)]
+    rows = []
+    print(f"{'catalog':>8} {'build ms':>9} {'index us':>9} {'scan us':>9}")
+    for n in map(int, args.sizes.split(",")):
+        acts = synth_catalog(n)
+        t0 = time.perf_counter(); idx = ActivityIndex(acts); build_ms = (time.perf_counter() - t0) * 1e3
+        index_us = per_call_us(lambda m, a: idx.lookup(m, a, calm=True), queries, 50)
+        scan_us = per_call_us(lambda m, a: scan(acts, m, a), queries, max(1, 2000 // n))
+        rows.append({"catalog": n, "build_ms": round(build_ms, 2), "index_us": round(index_us, 3), "scan_us": round(scan_us, 3)})
+        print(f"{n:>8} {build_ms:>9.2f} {index_us:>9.3f} {scan_us:>9.3f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Benchmark suite for every API endpoint, in-process (ASGI) and over a real uvicorn server.
+
+    python bench/bench_api.py [--mode asgi|uvicorn|both] [--requests 200] [--concurrency 8] [--json out.json]
+    python bench/bench_api.py --compare base.json head.json [--threshold 20]
+
+Each endpoint gets --requests calls with randomized, realistic payloads (children
+of different ages and languages, block mixes, story themes, meal-plan horizons).
+Results are per-endpoint throughput and p50/p95/p99 latency. In asgi mode two
+scaling curves are added: read endpoints vs. event-log size and planning
+endpoints vs. activity-catalog size. Push sends are stubbed (no network), and
+/privacy/wipe is left out because it would reset the data the other endpoints use.
+
+--json writes the whole run (with the git commit) so that --compare can flag
+p99 regressions larger than --threshold percent between two commits.
+"""
+import argparse, asyncio, json, os, platform, random, socket, subprocess, sys, tempfile, time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCH, "..", "backend")
+NAMES = ["Ava", "Noor", "Liam", "Sem", "Mila", "Daan", "Emma", "Finn", "Zoë", "Lucas"]
+THEMES = ["adventure", "calm", "animals"]
+
+# ---------- payloads ----------
+def child(rnd: random.Random):
+    return {"name": rnd.choice(NAMES), "age_years": round(rnd.uniform(1, 10), 1), "language": rnd.choice(["en", "en", "nl"])}
+
+def plan_blocks(rnd):
+    return [{"start": f"{9 + i:02d}:00", "end": f"{9 + i:02d}:{rnd.choice([20, 30, 40])}",
+             "plan": {"activity": rnd.choice(["Sticker sorting", "Blocks, towers & bridges", "Drawing; colours"])}}
+            for i in range(rnd.randint(2, 6))]
+
+def date(rnd):
+    return f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+
+# name -> (method, path or path(rnd), body(rnd) or None)
+ENDPOINTS = {
+    "signup": ("POST", "/signup", lambda r: {"email": f"p{r.randrange(10**6)}@example.com", "name": "Parent", "org": r.choice([None, "acme", "globex"])}),
+    "child": ("POST", "/child", child),
+    "plan_day": ("POST", "/plan/day", lambda r: {"child": child(r), "wake_time": r.choice(["06:30", "07:00", "07:45"]),
+                                                 "available_blocks_min": r.sample([15, 20, 30, 40, 45], r.randint(2, 4)),
+                                                 "focus": r.choice(["calm", "active", "learning"])}),
+    "plan_batch": ("POST", "/plan/batch", lambda r: {"jobs": [{"child": child(r), "date": date(r)} for _ in range(r.randint(5, 30))],
+                                                     "org": "acme", "include_ics": r.random() < 0.3}),
+    "activities_suggest": ("POST", "/activities/suggest", lambda r: {"child": child(r), "minutes": r.choice([10, 20, 30, 45]),
+                                                                     "mode": r.choice(["solo", "together"])}),
+    "story_generate": ("POST", "/story/generate", lambda r: {"child": child(r), "theme": r.choice(THEMES),
+                                                             "length_min": r.choice([2, 4, 8]), "bilingual": r.random() < 0.2}),
+    "story_batch": ("POST", "/story/batch", lambda r: {"child": child(r), "nights": 7, "seed": r.randrange(1000)}),
+    "session_start": ("POST", "/session/start", lambda r: {"child": child(r), "duration_min": r.choice([20, 30, 45, 60])}),
+    "mealplan_generate": ("POST", "/mealplan/generate", lambda r: {"child": child(r), "days": r.randint(1, 14),
+                                                                   "budget": r.choice(["low", "mid", "high"])}),
+    "mealplan_stream": ("POST", "/mealplan/stream", lambda r: {"children": [child(r) for _ in range(r.randint(1, 3))],
+                                                               "days": r.choice([7, 28, 90])}),
+    "mealplan_groceries": ("POST", "/mealplan/groceries.txt", lambda r: {"grocery_list": {f"item {i}": i * 1.5 for i in range(r.randint(5, 40))}}),
+    "ics": ("POST", "/integrations/calendar/ics", lambda r: {"child": child(r), "date": date(r), "plan": plan_blocks(r),
+                                                             **({"repeat": {"freq": "WEEKLY", "count": 8}} if r.random() < 0.3 else {})}),
+    "feed_publish": ("POST", "/integrations/calendar/feeds", lambda r: {"child": child(r), "date": date(r), "plan": plan_blocks(r)}),
+    "notifications_register": ("POST", "/notifications/register", lambda r: {"endpoint": f"https://push.bench.invalid/{r.randrange(10**9)}",
+                                                                             "keys": {"p256dh": "k", "auth": "a"}, "org": "bench"}),
+    "notifications_test": ("POST", "/notifications/test", lambda r: {"title": "Bench", "body": "Dinner in 10", "org": "bench"}),
+    "privacy_export": ("GET", "/privacy/export", None),
+    "privacy_delete_child": ("DELETE", lambda r: f"/privacy/child/bench-{r.randrange(50)}", None),
+    "metrics_timesaved": ("GET", "/metrics/timesaved", None),
+    "admin_aggregate": ("GET", "/admin/metrics/aggregate", None),
+    "admin_timeseries": ("GET", "/admin/metrics/timeseries", None),
+    "admin_query": ("GET", "/admin/metrics/query?group_by=day,kind", None),
+    "admin_caches": ("GET", "/admin/metrics/caches", None),
+    "admin_eventlog": ("GET", "/admin/metrics/eventlog", None),
+    "admin_push": ("GET", "/admin/metrics/push", None),
+    "admin_reminders": ("GET", "/admin/metrics/reminders", None),
+}
+
+# ---------- runner ----------
+def pct(values, q):
+    v = sorted(values)
+    return round(v[min(len(v) - 1, int(q * len(v)))], 3) if v else 0.0
+
+async def drive(client, name: str, n: int, concurrency: int, seed: int):
+    method, path, body = ENDPOINTS[name]
+    rnd = random.Random(seed)
+    calls = [(path(rnd) if callable(path) else path, body(rnd) if body else None) for _ in range(n)]
+    lat, errors = [], 0
+    it = iter(calls)
+    async def worker():
+        nonlocal errors
+        for p, b in it:
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(method, p, json=b)
+                await r.aread()
+                ok = r.status_code < 500
+            except Exception:
+                ok = False
+            if ok: lat.append((time.perf_counter() - t0) * 1000.0)
+            else: errors += 1
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    return {"n": n, "errors": errors, "rps": round(len(lat) / wall, 1) if wall else 0.0,
+            "p50_ms": pct(lat, 0.5), "p95_ms": pct(lat, 0.95), "p99_ms": pct(lat, 0.99)}
+
+async def run_endpoints(client, n: int, concurrency: int):
+    # a couple of subscriptions so /notifications/test has targets
+    for i in range(20):
+        await client.post("/notifications/register", json={"endpoint": f"https://push.bench.invalid/seed-{i}",
+                                                             "keys": {"p256dh": "k", "auth": "a"}, "org": "bench"})
+    out = {}
+    for i, name in enumerate(ENDPOINTS):
+        await drive(client, name, min(10, n), 1, 1000 + i)  # warm-up
+        out[name] = await drive(client, name, n, concurrency, i)
+        e = out[name]
+        print(f"  {name:<24} {e['rps']:>8} req/s  p50 {e['p50_ms']:>8}  p95 {e['p95_ms']:>8}  p99 {e['p99_ms']:>8}  err {e['errors']}")
+    return out
+
+# ---------- in-process ----------
+def load_app():
+    os.environ.setdefault("HAVEN_DATA_DIR", tempfile.mkdtemp(prefix="haven-bench-"))
+    os.chdir(BACKEND)
+    sys.path.insert(0, BACKEND)
+    import app as appmod
+    appmod.PUSH.send = lambda sub, data: {"status": "sent", "attempts": 1, "latency_ms": 0.0}  # stubbed sender
+    return appmod
+
+def synth_activities(n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    def acts(lang):
+        out = []
+        for i in range(n):
+            lo = rnd.choice([5, 10, 15, 20, 25, 30])
+            out.append({"name": f"{lang} activity {i}", "minutes": [lo, lo + rnd.choice([5, 10, 15, 20])],
+                        "energy": rnd.choice(["calm", "balanced", "active"]), "age_min": rnd.randint(1, 8)})
+        return out
+    return {lang: {"solo": acts(lang), "together": acts(lang)} for lang in ("en", "nl")}
+
+async def curve_event_log(appmod, client, sizes, n, concurrency):
+    from segments import day_of
+    rows, have = [], 0
+    now = time.time()
+    for size in sizes:
+        # bulk-append synthetic events spread over the last 90 days, bypassing the request path
+        lines: dict = {}
+        for i in range(have, size):
+            ts = now - (i % 90) * 86400 - 1
+            e = {"ts": ts, "kind": "session_start", "payload": {"duration": 30, "lang": "en"}}
+            lines.setdefault(day_of(ts), []).append(json.dumps(e) + "\n")
+        for day, ls in lines.items():
+            appmod.SEGMENTS.append(day, "".join(ls))
+        have = size
+        row = {"events": size}
+        for name in ("metrics_timesaved", "admin_aggregate", "admin_timeseries"):
+            await drive(client, name, 3, 1, 0)  # let counters/summaries catch up once
+            row[name] = await drive(client, name, n, concurrency, 0)
+        rows.append(row)
+        print(f"  events {size:>8}: " + "  ".join(f"{k} p99 {v['p99_ms']}" for k, v in row.items() if k != "events"))
+    return rows
+
+async def curve_catalog(appmod, client, sizes, n, concurrency):
+    from content import ContentSnapshot, FILES
+    raw = {}
+    for name in FILES:
+        with open(os.path.join(appmod.CONTENT_DIR, name), encoding="utf-8") as f:
+            raw[name] = json.load(f)
+    live = appmod.CONTENT.current
+    rows = []
+    try:
+        for size in sizes:
+            t0 = time.perf_counter()
+            snap = ContentSnapshot(live.version, {**raw, "activities.json": synth_activities(size)}, f"bench-{size}", 1024, 256)
+            appmod.CONTENT.current = snap  # same stories and meals, synthetic activities
+            row = {"catalog": size, "build_ms": round((time.perf_counter() - t0) * 1000.0, 2)}
+            for name in ("plan_day", "activities_suggest"):
+                row[name] = await drive(client, name, n, concurrency, 0)
+            rows.append(row)
+            print(f"  catalog {size:>7}: build {row['build_ms']} ms  " + "  ".join(f"{k} p99 {row[k]['p99_ms']}" for k in ("plan_day", "activities_suggest")))
+    finally:
+        appmod.CONTENT.current = live
+    return rows
+
+async def bench_asgi(args):
+    import httpx
+    appmod = load_app()
+    transport = httpx.ASGITransport(app=appmod.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        print("asgi: endpoints")
+        res = {"endpoints": await run_endpoints(client, args.requests, args.concurrency)}
+        if not args.no_curves:
+            print("asgi: event-log size")
+            res["event_log_curve"] = await curve_event_log(appmod, client, [int(x) for x in args.log_sizes.split(",")],
+                                                           max(20, args.requests // 4), args.concurrency)
+            print("asgi: catalog size")
+            res["catalog_curve"] = await curve_catalog(appmod, client, [int(x) for x in args.catalog_sizes.split(",")],
+                                                       max(20, args.requests // 4), args.concurrency)
+    return res
+
+# ---------- uvicorn ----------
+def serve(port: int):
+    import uvicorn
+    appmod = load_app()
+    uvicorn.run(appmod.app, host="127.0.0.1", port=port, log_level="warning")
+
+async def bench_uvicorn(args):
+    import httpx
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); port = s.getsockname()[1]
+    env = {**os.environ, "HAVEN_DATA_DIR": tempfile.mkdtemp(prefix="haven-bench-")}
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port)], env=env)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 30
+        while True:
+            try:
+                httpx.get(url + "/admin/metrics/eventlog", timeout=1); break
+            except httpx.HTTPError:
+                if time.time() > deadline: raise SystemExit("server did not start")
+                time.sleep(0.2)
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+            print("uvicorn: endpoints")
+            return {"endpoints": await run_endpoints(client, args.requests, args.concurrency)}
+    finally:
+        proc.terminate(); proc.wait(timeout=10)
+
+# ---------- results ----------
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(base_path, head_path, threshold):
+    with open(base_path) as f: base = json.load(f)
+    with open(head_path) as f: head = json.load(f)
+    worse = 0
+    print(f"{base.get('commit')} -> {head.get('commit')}")
+    for mode in sorted(set(base["modes"]) & set(head["modes"])):
+        print(f"{mode}: {'endpoint':<24} {'base p99':>9} {'head p99':>9} {'change':>8}  {'base rps':>9} {'head rps':>9}")
+        a, b = base["modes"][mode]["endpoints"], head["modes"][mode]["endpoints"]
+        for name in sorted(set(a) & set(b)):
+            pa, pb = a[name]["p99_ms"], b[name]["p99_ms"]
+            change = (pb - pa) / pa * 100 if pa else 0.0
+            flag = "  REGRESSION" if change > threshold else ""
+            worse += bool(flag)
+            print(f"{'':<{len(mode) + 2}}{name:<24} {pa:>9} {pb:>9} {change:>+7.1f}%  {a[name]['rps']:>9} {b[name]['rps']:>9}{flag}")
+    return 1 if worse else 0
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["asgi", "uvicorn", "both"], default="both")
+    ap.add_argument("--requests", type=int, default=200, help="calls per endpoint")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--log-sizes", default="1000,10000,100000")
+    ap.add_argument("--catalog-sizes", default="10,1000,100000")
+    ap.add_argument("--no-curves", action="store_true")
+    ap.add_argument("--json")
+    ap.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"))
+    ap.add_argument("--threshold", type=float, default=20.0, help="p99 increase (%%) reported as a regression")
+    ap.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)  # load_app() changes into backend/
+    if args.serve:
+        return serve(args.serve)
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    results = {"commit": git_commit(), "time": time.time(), "python": platform.python_version(),
+               "requests": args.requests, "concurrency": args.concurrency, "modes": {}}
+    if args.mode in ("uvicorn", "both"):
+        results["modes"]["uvicorn"] = asyncio.run(bench_uvicorn(args))  # before load_app() chdirs
+    if args.mode in ("asgi", "both"):
+        results["modes"]["asgi"] = asyncio.run(bench_asgi(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
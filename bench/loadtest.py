@@ -0,0 +1,127 @@
+"""HTTP load test for the core endpoints: p50/p99 latency and requests per second.
+
+    python bench/loadtest.py [--concurrency 200] [--requests 5000] [--json out.json]
+    python bench/loadtest.py --url http://127.0.0.1:8000 ...   # an already running server
+    python bench/loadtest.py --compare before.json after.json
+
+Without --url a uvicorn server is started from backend/ on a free port with a
+throwaway HAVEN_DATA_DIR. To compare before/after, run it once on each checkout
+with --json and then pass both files to --compare.
+"""
+import argparse, asyncio, json, os, random, socket, subprocess, sys, tempfile, time
+
+import httpx
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+CHILD = {"name": "Ava", "age_years": 4.0, "language": "en"}
+MIX = [  # (weight, method, path, body)
+    (4, "POST", "/plan/day", {"child": CHILD, "wake_time": "07:00", "available_blocks_min": [20, 30, 40], "focus": "calm"}),
+    (3, "POST", "/activities/suggest", {"child": CHILD, "minutes": 20, "mode": "solo"}),
+    (3, "POST", "/story/generate", {"child": CHILD}),
+    (2, "POST", "/session/start", {"child": CHILD, "duration_min": 30}),
+    (2, "POST", "/mealplan/generate", {"child": CHILD, "days": 7, "budget": "mid"}),
+    (1, "GET", "/metrics/timesaved", None),
+    (1, "GET", "/admin/metrics/timeseries", None),
+]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    env = {**os.environ, "HAVEN_DATA_DIR": tempfile.mkdtemp(prefix="haven-load-")}
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(workers),
+                             "--log-level", "warning"], cwd=BACKEND, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/metrics/timesaved", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("server did not start")
+
+def pct(values, q):
+    v = sorted(values)
+    return round(v[min(len(v) - 1, int(q * len(v)))], 3) if v else 0.0
+
+async def run(url: str, concurrency: int, total: int, seed: int = 1):
+    rnd = random.Random(seed)
+    plan = rnd.choices(MIX, weights=[m[0] for m in MIX], k=total)
+    lat: dict = {}
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        it = iter(plan)
+        async def worker():
+            nonlocal errors
+            for _, method, path, body in it:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.request(method, path, json=body)
+                    ok = r.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                ms = (time.perf_counter() - t0) * 1000.0
+                if ok: lat.setdefault(path, []).append(ms)
+                else: errors += 1
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - t0
+    everything = [x for v in lat.values() for x in v]
+    return {
+        "concurrency": concurrency, "requests": total, "errors": errors, "seconds": round(wall, 3),
+        "rps": round(len(everything) / wall, 1), "p50_ms": pct(everything, 0.5), "p99_ms": pct(everything, 0.99),
+        "endpoints": {p: {"n": len(v), "p50_ms": pct(v, 0.5), "p99_ms": pct(v, 0.99)} for p, v in sorted(lat.items())},
+    }
+
+def print_report(r):
+    print(f"{r['requests']} requests, concurrency {r['concurrency']}: {r['rps']} req/s, "
+          f"p50 {r['p50_ms']} ms, p99 {r['p99_ms']} ms, {r['errors']} errors")
+    print(f"{'endpoint':<28} {'n':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    for path, e in r["endpoints"].items():
+        print(f"{path:<28} {e['n']:>6} {e['p50_ms']:>9} {e['p99_ms']:>9}")
+
+def compare(before_path, after_path):
+    with open(before_path) as f: a = json.load(f)
+    with open(after_path) as f: b = json.load(f)
+    print(f"{'':<28} {'before':>10} {'after':>10} {'change':>8}")
+    for key in ("rps", "p50_ms", "p99_ms"):
+        change = (b[key] - a[key]) / a[key] * 100 if a[key] else 0.0
+        print(f"{key:<28} {a[key]:>10} {b[key]:>10} {change:>+7.1f}%")
+    for path in sorted(set(a["endpoints"]) & set(b["endpoints"])):
+        pa, pb = a["endpoints"][path]["p99_ms"], b["endpoints"][path]["p99_ms"]
+        print(f"{path + ' p99':<28} {pa:>10} {pb:>10} {((pb - pa) / pa * 100 if pa else 0.0):>+7.1f}%")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url")
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--requests", type=int, default=5000)
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn workers when starting a server")
+    ap.add_argument("--json")
+    ap.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = ap.parse_args()
+    if args.compare:
+        return compare(*args.compare)
+    proc = None
+    url = args.url
+    if not url:
+        port = free_port()
+        proc = start_server(port, args.workers)
+        url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(run(url, min(20, args.concurrency), min(200, args.requests)))  # warm-up
+        report = asyncio.run(run(url, args.concurrency, args.requests))
+    finally:
+        if proc is not None:
+            proc.terminate(); proc.wait(timeout=10)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Cold-start profile: import cost per module and time to first request.
+
+    python bench/startup.py [--runs 5] [--top 20] [--json out.json]
+    python bench/startup.py --compare before.json after.json
+
+Every run is a fresh interpreter with a throwaway HAVEN_DATA_DIR:
+- `python -X importtime -c "import app"` gives the self/cumulative import time
+  of every module; self times are summed per top-level package.
+- a uvicorn process is started and timed until its first successful response.
+  The first server start builds the content snapshot, so later starts show
+  the restored path.
+Medians over --runs are reported.
+"""
+import argparse, http.client, json, os, socket, statistics, subprocess, sys, tempfile, time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCH, "..", "backend")
+
+def import_profile(data_dir: str):
+    """(wall ms of `import app`, {package: self ms}, {direct import of app: cumulative ms})"""
+    code = "import time; t = time.perf_counter(); import app; print((time.perf_counter() - t) * 1000)"
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=BACKEND, capture_output=True, text=True,
+                       env={**os.environ, "HAVEN_DATA_DIR": data_dir})
+    if p.returncode != 0:
+        raise SystemExit(p.stderr[-2000:])
+    packages, direct = {}, {}
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2  # importtime indents nested imports by two spaces
+        name = name.strip()
+        top = name.split(".")[0]
+        packages[top] = packages.get(top, 0.0) + int(self_us) / 1000.0
+        if depth == 1 or name == "app":
+            direct[name] = int(cum_us) / 1000.0
+    return float(p.stdout.strip().splitlines()[-1]), packages, direct
+
+def first_request_ms(data_dir: str) -> float:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); port = s.getsockname()[1]
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=BACKEND, env={**os.environ, "HAVEN_DATA_DIR": data_dir})
+    try:
+        while True:  # stdlib client: polling must not compete with the server for CPU
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+                conn.request("GET", "/admin/metrics/eventlog")
+                if conn.getresponse().status == 200:
+                    return (time.perf_counter() - t0) * 1000.0
+            except OSError:
+                pass
+            finally:
+                conn.close()
+            if time.perf_counter() - t0 > 60: raise SystemExit("server did not start")
+            time.sleep(0.01)
+    finally:
+        proc.terminate(); proc.wait(timeout=10)
+
+def median_map(runs):
+    keys = set().union(*runs)
+    return {k: round(statistics.median(r.get(k, 0.0) for r in runs), 3) for k in keys}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--json")
+    ap.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = ap.parse_args()
+    if args.compare:
+        with open(args.compare[0]) as f: a = json.load(f)
+        with open(args.compare[1]) as f: b = json.load(f)
+        for key in ("import_ms", "first_request_ms"):
+            print(f"{key:<20} {a[key]:>10} {b[key]:>10} {(b[key] - a[key]) / a[key] * 100:>+7.1f}%")
+        return
+    data_dir = tempfile.mkdtemp(prefix="haven-startup-")
+    walls, packages, direct, first = [], [], [], []
+    for _ in range(args.runs):
+        wall, pk, d = import_profile(data_dir)
+        walls.append(wall); packages.append(pk); direct.append(d)
+        first.append(first_request_ms(data_dir))
+    report = {"runs": args.runs, "import_ms": round(statistics.median(walls), 3),
+              "first_request_ms": round(statistics.median(first), 3),
+              "packages_self_ms": dict(sorted(median_map(packages).items(), key=lambda kv: -kv[1])),
+              "app_imports_ms": dict(sorted(median_map(direct).items(), key=lambda kv: -kv[1]))}
+    print(f"import app: {report['import_ms']} ms, first request: {report['first_request_ms']} ms (median of {args.runs})")
+    print(f"{'package (self time)':<36} {'ms':>9}")
+    for name, ms in list(report["packages_self_ms"].items())[:args.top]:
+        print(f"{name:<36} {ms:>9}")
+    print(f"{'imported by app (cumulative)':<36} {'ms':>9}")
+    for name, ms in list(report["app_imports_ms"].items())[:args.top]:
+        print(f"{name:<36} {ms:>9}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -35,12 +35,40 @@ document.getElementById('storyBtn').onclick = async () => {
   document.getElementById('storyOut').textContent = JSON.stringify(data, null, 2);
 };
 
+// The server measures a session from start to end; heartbeats keep it open (it idles out after 5 min without one)
+let sessionId = null, sessionBeat = null, sessionStop = null;
+const HEARTBEAT_MS = 60 * 1000;
+
+function sessionPost(path, keepalive = false) {
+  return fetch(API_BASE + path, {method:'POST', headers:{'Content-Type':'application/json'}, keepalive,
+                                 body: JSON.stringify({session_id: sessionId})});
+}
+
+async function endSession(keepalive = false) {
+  if (!sessionId) return;
+  clearInterval(sessionBeat); clearTimeout(sessionStop);
+  const res = await sessionPost("/session/end", keepalive).catch(() => null);
+  sessionId = null;
+  document.getElementById('sessionEndBtn').disabled = true;
+  if (res && res.ok) document.getElementById('sessionOut').textContent = JSON.stringify(await res.json(), null, 2);
+}
+
 document.getElementById('sessionBtn').onclick = async () => {
-  const res = await fetch(API_BASE + "/session/start", {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({child, duration_min:30, goal:"engage"})});
+  await endSession();
+  const duration_min = 30;
+  const res = await fetch(API_BASE + "/session/start", {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({child, duration_min, goal:"engage"})});
   const data = await res.json();
   document.getElementById('sessionOut').textContent = JSON.stringify(data, null, 2);
+  if (!data.session_id) return;
+  sessionId = data.session_id;
+  sessionBeat = setInterval(() => sessionPost("/session/heartbeat").catch(() => {}), HEARTBEAT_MS);
+  sessionStop = setTimeout(() => endSession(), duration_min * 60 * 1000);
+  document.getElementById('sessionEndBtn').disabled = false;
 };
 
+document.getElementById('sessionEndBtn').onclick = () => endSession();
+window.addEventListener('pagehide', () => endSession(true));
+
 document.getElementById('metricsBtn').onclick = async () => {
   const res = await fetch(API_BASE + "/metrics/timesaved");
   const data = await res.json();
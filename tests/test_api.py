@@ -1,7 +1,19 @@
-import os, sys, json
+import os, sys, json, tempfile, time
 from fastapi.testclient import TestClient
-sys.path.append(os.path.dirname(__file__) + "/../backend")
-from app import app
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.append(BACKEND)
+os.chdir(BACKEND)  # content/ paths are relative to the backend dir
+os.environ.setdefault("HAVEN_DATA_DIR", tempfile.mkdtemp(prefix="haven-test-"))
+from app import app, SESSIONS, RESPONSES
+from eventlog import EventWriter
+from segments import SegmentStore, day_of
+from metrics import Metrics
+from storage import MemoryStorage, SqliteStorage
+from activity_index import ActivityIndex
+from cache import LRUCache
+from push import PushDispatcher
+from reminders import ReminderScheduler
+from sessions import SessionTracker
 client = TestClient(app)
 
 def test_ics():
@@ -10,3 +22,612 @@ def test_ics():
     r = client.post("/integrations/calendar/ics", json={"child":child,"date":"2025-08-15","plan":plan})
     assert r.status_code == 200
     assert "BEGIN:VCALENDAR" in r.text
+    assert r.text.startswith("BEGIN:VCALENDAR\r\n") and "DTSTART:20250815T090000\r\n" in r.text
+    again = client.post("/integrations/calendar/ics", json={"child":child,"date":"2025-08-15","plan":plan},
+                        headers={"If-None-Match": r.headers["etag"]})
+    assert again.status_code == 304
+    weekly = client.post("/integrations/calendar/ics", json={"child":child,"date":"2025-08-15","plan":plan,
+                                                             "repeat":{"freq":"WEEKLY","count":4,"byday":["FR"]}})
+    assert weekly.headers["etag"] != r.headers["etag"]
+    assert weekly.text.count("BEGIN:VEVENT") == 1 and "RRULE:FREQ=WEEKLY;COUNT=4;BYDAY=FR\r\n" in weekly.text
+    for bad in ("2025-13-45", "2025/08/15"):
+        assert client.post("/integrations/calendar/ics", json={"child":child,"date":bad,"plan":plan}).status_code == 400
+
+def test_ics_folding_and_escaping():
+    import ics
+    line = "SUMMARY:" + ics.escape("Zingen, dansen; en knutselen met Noor " * 4)
+    folded = ics.fold(line)
+    assert all(len(l.encode()) <= 75 for l in folded.split("\r\n"))
+    assert folded.replace("\r\n ", "") == line
+    assert ics.fold("X:" + "é" * 60).replace("\r\n ", "") == "X:" + "é" * 60
+
+def test_calendar_feed():
+    child = {"name":"Feed Kid","age_years":4.0,"language":"en"}
+    day = {"child":child,"date":"2025-08-15","plan":[{"start":"09:00","end":"09:20","plan":{"activity":"Blocks"}}]}
+    r = client.post("/integrations/calendar/feeds", json=day).json()
+    assert r["changed"]
+    assert not client.post("/integrations/calendar/feeds", json=day).json()["changed"]
+    feed = client.get(r["url"])
+    assert feed.status_code == 200 and feed.text.count("BEGIN:VEVENT") == 1
+    assert client.get(r["url"], headers={"If-None-Match": feed.headers["etag"]}).status_code == 304
+    nxt = client.post("/integrations/calendar/feeds", json={**day, "date": "2025-08-16"}).json()
+    assert nxt["url"] == r["url"] and nxt["changed"]
+    updated = client.get(r["url"], headers={"If-None-Match": feed.headers["etag"]})
+    assert updated.status_code == 200 and updated.text.count("BEGIN:VEVENT") == 2
+    client.delete("/privacy/child/Feed Kid")
+    assert client.get(r["url"]).status_code == 404
+
+def test_event_writer_group_commit(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    w = EventWriter(store, flush_every=4, flush_ms=5, durability="fsync")
+    for i in range(10):
+        w.emit({"ts": i, "kind": "t", "payload": {}})
+    w.close()
+    with open(store.segment_path("1970-01-01")) as f:
+        assert [json.loads(l)["ts"] for l in f] == list(range(10))
+    st = w.stats()
+    assert st["events"] == 10 and st["pending"] == 0 and st["queue_depth"] == 0
+
+def test_event_writer_reports_failed_commits(tmp_path):
+    import asyncio, pytest
+    class FlakyStore(SegmentStore):
+        broken = True
+        def append(self, *a, **kw):
+            if self.broken: raise OSError("disk full")
+            return super().append(*a, **kw)
+    store = FlakyStore(str(tmp_path))
+    w = EventWriter(store, flush_ms=1, durability="fsync")
+    with pytest.raises(OSError):
+        w.emit({"ts": 1, "kind": "t", "payload": {}})
+    async def aemit():
+        with pytest.raises(OSError):
+            await w.aemit({"ts": 2, "kind": "t", "payload": {}})
+    asyncio.run(aemit())
+    assert not w.wait(1) and w.stats()["dropped"] == 2 and w.stats()["pending"] == 0
+    store.broken = False
+    assert w.emit({"ts": 3, "kind": "t", "payload": {}}) == 3 and w.wait(3)
+    w.close()
+    with open(store.segment_path("1970-01-01")) as f:
+        assert [json.loads(l)["ts"] for l in f] == [3]
+
+def test_eventlog_metrics():
+    client.post("/child", json={"name":"Bo","age_years":3})
+    r = client.get("/admin/metrics/eventlog")
+    assert r.status_code == 200
+    assert {"queue_depth", "avg_flush_ms", "blocked_puts"} <= set(r.json())
+
+def test_segment_summaries(tmp_path):
+    legacy = tmp_path / "events.jsonl"
+    day = 86400
+    legacy.write_text("".join(json.dumps({"ts": ts, "kind": k, "payload": {"duration": 30}}) + "\n"
+                              for ts, k in [(10, "session_start"), (20, "story"), (day + 5, "session_start")]))
+    store = SegmentStore(str(tmp_path / "events"))
+    assert store.migrate(str(legacy)) == 3
+    assert store.days() == ["1970-01-01", "1970-01-02"]
+    s = store.summary("1970-01-01")
+    assert s["kinds"] == {"session_start": 1, "story": 1} and s["session_minutes"] == 30
+    assert os.path.exists(store.summary_path("1970-01-01"))  # sealed day gets a sidecar
+    store.append("1970-01-01", json.dumps({"ts": 30, "kind": "session_start", "payload": {"duration": 15}}) + "\n")
+    assert store.summary("1970-01-01")["session_minutes"] == 45  # only the appended tail is parsed
+
+def test_timeseries_reads_segments():
+    sid = SESSIONS.start("Ava", "en", None, "engage", 25, now=time.time() - 25 * 60)
+    assert client.post("/session/end", json={"session_id": sid}).json()["minutes"] >= 25
+    r = client.get("/admin/metrics/timeseries").json()
+    assert r["ok"] and r["minutes"][-1] >= 25
+    client.post("/session/start", json={"child": {"name":"Ava","age_years":4}, "duration_min": 25})
+    assert client.get("/admin/metrics/aggregate").json()["events"]["session_start"] >= 1
+
+def test_metrics_checkpoint_and_catch_up(tmp_path):
+    store = SegmentStore(str(tmp_path / "events"))
+    m = Metrics(str(tmp_path / "metrics.json"))
+    w = EventWriter(store, flush_ms=1, on_commit=m.on_commit)
+    w.emit({"ts": 10, "kind": "signup", "payload": {"org": "acme"}})
+    w.emit({"ts": 20, "kind": "session_start", "payload": {"duration": 30, "lang": "nl"}})
+    w.close(); m.checkpoint()
+    store.append("1970-01-01", json.dumps({"ts": 30, "kind": "session_start", "payload": {"duration": 10}}) + "\n")
+    m2 = Metrics(str(tmp_path / "metrics.json"))
+    assert m2.restore(store) == 1  # only the line after the checkpoint is replayed
+    assert m2.totals() == {"sessions": 2, "minutes_saved_total": 40}
+    snap = m2.snapshot()
+    assert snap["by_org"]["acme"]["signup"] == 1 and snap["by_lang"]["nl"]["minutes"] == 30
+    assert m2.rebuild(store) == 3 and m2.totals()["minutes_saved_total"] == 40
+    store.append("1970-01-01", json.dumps({"ts": 40, "kind": "wipe", "payload": {}}) + "\n")
+    assert m2.follow(store) == 1 and m2.totals() == {"sessions": 0, "minutes_saved_total": 0}
+    assert m2.rebuild(store) == 4 and m2.snapshot()["kinds"] == {"wipe": 1}
+
+def test_timesaved_uses_materialized_metrics():
+    before = client.get("/metrics/timesaved").json()
+    sid = client.post("/session/start", json={"child": {"name":"Ava","age_years":4}, "duration_min": 20}).json()["session_id"]
+    assert client.post("/session/heartbeat", json={"session_id": sid}).json()["planned_min"] == 20
+    assert client.get("/metrics/timesaved").json()["minutes_saved_total"] == before["minutes_saved_total"]  # still running
+    SESSIONS.end(sid, now=time.time() + 20 * 60)
+    after = client.get("/metrics/timesaved").json()
+    assert after["sessions"] == before["sessions"] + 1
+    assert abs(after["minutes_saved_total"] - before["minutes_saved_total"] - 20) < 0.1
+    assert client.post("/session/end", json={"session_id": "not-a-session"}).status_code == 404
+
+def test_session_tracker(tmp_path):
+    ended = []
+    store = MemoryStorage()
+    t = SessionTracker(store, ended.append, capacity=2, idle_s=60)
+    a = t.start("Ava", "en", "acme", "calm", 30, now=1000.0)
+    b = t.start("Ben", "nl", None, "engage", 20, now=1010.0)
+    assert t.heartbeat(a, now=1100.0)["elapsed_min"] == 1.67
+    t.start("Cas", "en", None, "learn", 10, now=1120.0)  # ring full: a is forgotten here, its heartbeat written back
+    assert t.stats()["overflow"] == 1 and ended == []
+    other = SessionTracker(store, ended.append, idle_s=60)  # a second worker
+    assert other.heartbeat(a, now=1150.0)["elapsed_min"] == 2.5 and other.stats()["adopted"] == 1
+    assert t.sweep(now=1125.0) == 1 and ended[-1]["session"] == b and ended[-1]["ended"] == 1010.0
+    assert ended[-1]["minutes"] == 20  # never heartbeated: its planned length
+    rec = t.end(a, now=1300.0)  # t no longer holds a: it is ended from the shared record, with its dimensions
+    assert (rec["minutes"], rec["org"], rec["lang"], rec["child"]) == (5.0, "acme", "en", "Ava")
+    assert other.end(a, now=1400.0) is None and t.heartbeat(a, now=1400.0) is None  # ended once, for good
+    other.sweep(now=1400.0)  # other's pending heartbeat of a finds it ended and is dropped
+    assert other.stats()["active"] == 0 and [r["session"] for r in ended].count(a) == 1
+    assert t.heartbeat("18f0c3a2b40-1-1") is None and t.end("18f0c3a2b40-1-1") is None  # forged: never recorded
+    m = Metrics(str(tmp_path / "metrics.json"))
+    for r in ended:
+        m.record({"ts": r["ended"], "kind": "session_end", "payload": r})
+    assert m.snapshot()["by_org"]["acme"]["minutes"] == 5.0
+
+def test_compaction_streams_and_reports(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    day = 86400
+    for ts in (10, 20, day + 10, day + 50000, 2 * day + 10):
+        store.append(day_of(ts), json.dumps({"ts": ts, "kind": "t", "payload": {}}) + "\n")
+    size0 = os.path.getsize(store.segment_path("1970-01-01"))
+    r = store.compact(day + 100)
+    assert r["segments_dropped"] == 1 and r["lines_reclaimed"] == 3
+    assert r["bytes_reclaimed"] > size0
+    assert store.days() == ["1970-01-02", "1970-01-03"]
+    assert store.summary("1970-01-02")["lines"] == 1
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".compact")]
+
+def test_privacy_maintenance_report():
+    r = client.post("/privacy/maintenance").json()
+    assert r["ok"] and {"kept", "bytes_reclaimed", "lines_reclaimed", "segments_dropped"} <= set(r)
+
+def test_storage_backends(tmp_path):
+    import pytest
+    from storage import Storage
+    class Partial(Storage):
+        def add_parent(self, parent): pass
+    with pytest.raises(TypeError):
+        Partial()  # an incomplete backend fails when constructed, not on first use
+    for store in (MemoryStorage(), SqliteStorage(str(tmp_path / "haven.db"))):
+        store.add_parent({"email": "a@x.nl", "name": "A", "org": "acme"})
+        store.add_child({"name": "Ava", "age_years": 4, "language": "en"})
+        store.add_child({"name": "Ava", "age_years": 6, "language": "nl"})
+        store.add_child({"name": "Bo", "age_years": 3, "language": "en"})
+        store.put_org({"org_id": "acme", "name": "Acme", "domain": None})
+        store.add_subscription({"endpoint": "https://p/1", "keys": {}}, "acme", "A@x.nl")
+        store.add_reminders([{"due": 1e10, "parent": "a@x.nl", "child": c, "title": "t", "body": f"{c}: t", "key": c}
+                             for c in ("Ava", "Bo")])
+        assert store.counts() == {"parents": 1, "children": 3, "sessions": 0}
+        assert [r["child"] for r in store.export_subject(child="Ava")["reminders"]] == ["Ava"]
+        assert store.delete_children("Ava") == 2
+        assert [c["name"] for c in store.export()["children"]] == ["Bo"]
+        mine = store.export_subject(email="a@x.nl")
+        assert [r["child"] for r in mine["reminders"]] == ["Bo"]  # Ava's reminder went with her
+        assert mine["subscriptions"] == [{"endpoint": "https://p/1", "org": "acme", "parent": "A@x.nl"}]
+        store.wipe()
+        assert store.counts()["parents"] == 0 and store.list_orgs()[0]["org_id"] == "acme"
+        assert store.subscriptions() == [] and store.pending_reminders() == []
+        assert store.export()["subscriptions"] == [] and store.export()["reminders"] == []
+        store.close()
+
+def test_sqlite_migrations_run_once(tmp_path):
+    import sqlite3
+    from storage import MIGRATIONS
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as c:  # a database from before keyed reminders and live_sessions
+        c.execute("CREATE TABLE reminders (id INTEGER PRIMARY KEY, due REAL NOT NULL, parent_email TEXT, title TEXT, body TEXT)")
+        c.execute("CREATE TABLE sessions (id TEXT)")
+    SqliteStorage(path).close()
+    with sqlite3.connect(path) as c:
+        assert c.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        assert c.execute("SELECT name FROM sqlite_master WHERE name = 'sessions'").fetchone() is None
+        c.execute("CREATE TABLE sessions (id TEXT)")  # e.g. recreated by a rolled-back version
+    store = SqliteStorage(path)
+    assert store.add_reminders([{"due": 1, "key": "k", "child": "Ava"}] * 2)[1] is None
+    store.close()
+    with sqlite3.connect(path) as c:
+        assert c.execute("SELECT name FROM sqlite_master WHERE name = 'sessions'").fetchone() is not None
+
+def test_privacy_delete_child():
+    client.post("/child", json={"name":"Zed","age_years":5})
+    client.post("/plan/day", json={"child": {"name":"Zed","age_years":5,"language":"nl"}, "wake_time":"07:00"})
+    lines = [json.loads(l) for l in client.get("/privacy/export", params={"child": "Zed"}).text.splitlines()]
+    assert lines[0]["type"] == "profile" and lines[0]["children"][0]["name"] == "Zed"
+    assert {l["event"]["kind"] for l in lines[1:-1]} == {"child_add", "plan_day"} and lines[-1] == {"type": "end", "events": 2}
+    import datetime as dt
+    tomorrow = (dt.date.today() + dt.timedelta(days=1)).isoformat()
+    client.post("/plan/day", json={"child": {"name":"Zed","age_years":5}, "wake_time":"07:00", "date": tomorrow,
+                                   "parent": "zed.parent@example.com"})
+    assert client.get("/privacy/export", params={"email": "zed.parent@example.com", "format": "json"}).json()["reminders"]
+    client.post("/session/start", json={"child": {"name":"Zed","age_years":5}})
+    r = client.delete("/privacy/child/Zed").json()
+    assert r["removed"] == 1 and r["events_redacted"] == 4
+    bundle = client.get("/privacy/export").json()
+    assert all(c["name"] != "Zed" for c in bundle["children"]) and all(s["child"] != "Zed" for s in bundle["sessions"])
+    assert all(r["child"] != "Zed" and "Zed" not in r["body"] for r in bundle["reminders"])
+    doc = client.get("/privacy/export", params={"child": "Zed", "format": "json"}).json()
+    assert doc["children"] == [] and doc["events"] == [] and doc["event_count"] == 0
+
+def test_subject_index_redact_and_compact(tmp_path):
+    from privacy import event_subjects, scrub_event
+    store = SegmentStore(str(tmp_path), subjects=event_subjects)
+    w = EventWriter(store, flush_ms=1)
+    day = 86400
+    for ts, kind, payload in [(10, "signup", {"email": "Ann@x.org", "name": "Ann"}),
+                              (20, "plan_day", {"child": {"name": "Ava", "language": "nl", "org": "acme"}}),
+                              (day + 5, "session_end", {"child": "Ava", "minutes": 12.5}),
+                              (day + 9, "session_end", {"child": "Bo", "minutes": 3})]:
+        w.emit({"ts": ts, "kind": kind, "payload": payload})
+    w.close()
+    assert [json.loads(raw)["ts"] for _, raw in store.find("child:Ava")] == [20, day + 5]
+    assert [d for d, _ in store.find("email:ann@x.org")] == ["1970-01-01"]
+    sizes = [os.path.getsize(store.segment_path(d)) for d in store.days()]
+    assert store.redact("child:Ava", scrub_event) == {"events_redacted": 2, "days": 2}
+    assert [os.path.getsize(store.segment_path(d)) for d in store.days()] == sizes  # rewritten in place
+    assert list(store.find("child:Ava")) == [] and b"Ava" not in open(store.segment_path("1970-01-01"), "rb").read()
+    assert store.summary("1970-01-02")["session_minutes"] == 15.5  # kind and minutes survive redaction
+    plan = json.loads(open(store.segment_path("1970-01-01"), "rb").readlines()[1])
+    assert plan["payload"] == {"child": {"language": "nl", "org": "acme"}}
+    store.compact(day + 7)  # drops day 1 and Ava's redacted end; Bo's line moves to offset 0
+    assert [json.loads(raw)["payload"]["minutes"] for _, raw in store.find("child:Bo")] == [3]
+    assert not os.path.exists(store.index_path("1970-01-01"))
+
+def test_compaction_keeps_concurrent_redaction(tmp_path):
+    from privacy import event_subjects, scrub_event
+    class RacingStore(SegmentStore):
+        raced = False
+        def _filter(self, *a, **kw):
+            out = super()._filter(*a, **kw)
+            if not self.raced:  # a redaction lands right after the unlocked first pass
+                self.raced = True
+                assert self.redact("child:Cy", scrub_event)["events_redacted"] == 1
+            return out
+    store = RacingStore(str(tmp_path), subjects=event_subjects)
+    for ts, child in [(10, "Bo"), (20, "Cy")]:
+        line = json.dumps({"ts": ts, "kind": "plan_day", "payload": {"child": {"name": child}}}) + "\n"
+        store.append("1970-01-01", line, index=[(f"child:{child}", 0, len(line))])
+    store.compact(15)  # drops Bo's line, keeps Cy's
+    data = open(store.segment_path("1970-01-01"), "rb").read()
+    assert b"Cy" not in data and b"Bo" not in data and len(data.splitlines()) == 1
+
+def test_activity_index_matches_scan():
+    import random
+    rnd = random.Random(3)
+    acts = [{"name": str(i), "minutes": [lo, lo + rnd.choice([0, 5, 10])], "energy": rnd.choice(["calm", "active"]),
+             "age_min": rnd.randint(1, 6)} for i, lo in enumerate(rnd.choice([5, 10, 20]) for _ in range(300))]
+    idx = ActivityIndex(acts)
+    for minutes in (3, 5, 7, 10, 15, 20, 30, 31):
+        for age in (0.5, 2, 3.5, 6):
+            for calm in (False, True):
+                items, n = idx.lookup(minutes, age, calm)
+                want = {a["name"] for a in acts if a["minutes"][0] <= minutes <= a["minutes"][1]
+                        and age >= a["age_min"] and not (calm and a["energy"] == "active")}
+                assert {a["name"] for a in items[:n]} == want
+
+def test_activities_suggest():
+    r = client.post("/activities/suggest", json={"child": {"name":"Ava","age_years":4}, "minutes": 20, "mode": "solo"})
+    assert r.status_code == 200 and 0 < len(r.json()["suggestions"]) <= 5
+    assert client.post("/plan/day", json={"child": {"name":"Ava","age_years":4}, "wake_time": "07:00"}).json()["ok"]
+
+def test_plan_batch_streams_ndjson():
+    jobs = [{"child": {"name": n, "age_years": 4}, "date": "2025-08-1%d" % d, "blocks": [20, 30]}
+            for n in ("Ava", "Bo") for d in range(5)]
+    jobs.append({"child": {"name": "Cy", "age_years": 4}, "wake_time": "7am"})
+    jobs.append({"child": {"name": "Di", "age_years": 4}, "date": "2025/08/15"})
+    r = client.post("/plan/batch", json={"jobs": jobs, "org": "acme", "include_ics": True})
+    assert r.status_code == 200 and r.headers["content-type"].startswith("application/x-ndjson")
+    frames = [json.loads(l) for l in r.text.splitlines()]
+    assert len(frames) == 13 and frames[-3]["ok"] is False and frames[-2]["ok"] is False
+    assert all(len(f["blocks"]) == 3 for f in frames[:10])
+    assert frames[-1]["ics"].count("BEGIN:VEVENT") == 20
+
+def test_mealplan_cache_and_totals():
+    body = {"child": {"age_years": 3}, "days": 5, "budget": "HIGH"}
+    r1 = client.post("/mealplan/generate", json=body).json()
+    r2 = client.post("/mealplan/generate", json={**body, "child": {"age_years": 4}}).json()  # same bracket
+    assert r1 == r2 and r1["budget"] == "high" and len(r1["plan"]) == 5
+    # grocery totals equal the sum over the recipes actually planned
+    want = {}
+    for day in r1["plan"]:
+        for meal in ("breakfast", "lunch", "snack", "dinner"):
+            for k, v in day[meal]["ingredients"].items():
+                want[k] = want.get(k, 0) + v
+    assert {k: round(v, 2) for k, v in want.items()} == r1["grocery_list"]
+    stats = client.get("/admin/metrics/caches").json()["mealplan"]
+    assert stats["hits"] >= 1 and stats["size"] >= 1
+
+def test_lru_cache_eviction():
+    c = LRUCache(2)
+    c.put("a", 1); c.put("b", 2); c.get("a"); c.put("c", 3)
+    assert c.get("b") is None and c.get("a") == 1
+    assert c.stats()["evictions"] == 1
+
+def test_mealplan_stream_multi_child():
+    body = {"children": [{"name": "Ava", "age_years": 2}, {"name": "Bo", "age_years": 7}], "days": 90, "budget": "low"}
+    r = client.post("/mealplan/stream", json=body)
+    frames = [json.loads(l) for l in r.text.splitlines()]
+    assert len(frames) == 91 and frames[0]["day"] == 1 and len(frames[0]["children"]) == 2
+    final = frames[-1]
+    assert final["done"] and final["days"] == 90
+    # oats: breakfast 0 is used on 45 odd days, 40g scaled 0.5x (Ava) and 1.0x (Bo)
+    assert final["grocery_list"]["rolled oats (g)"] == 45 * (20 + 40)
+    assert final["grocery_links"]["rolled oats (g)"] == ["Breakfast — Oatmeal with banana"]
+    assert r.headers["content-encoding"] == "gzip"  # streamed chunk by chunk through the compressor
+
+def test_response_cache_etag_and_invalidation():
+    def stats():
+        return client.get("/admin/metrics/caches").json()["responses"]["routes"].get("/admin/metrics/aggregate", {"hits": 0, "misses": 0})
+    before = stats()
+    r1 = client.get("/admin/metrics/aggregate")
+    r2 = client.get("/admin/metrics/aggregate")
+    assert r1.json() == r2.json() and r1.headers["etag"] == r2.headers["etag"]
+    assert stats()["hits"] == before["hits"] + 1
+    assert client.get("/admin/metrics/aggregate", headers={"If-None-Match": r1.headers["etag"]}).status_code == 304
+    client.post("/story/generate", json={"child": {"name": "Ava", "age_years": 4}})  # high-volume kind: left to the TTL
+    assert client.get("/admin/metrics/aggregate").headers["etag"] == r1.headers["etag"]
+    client.post("/signup", json={"email": "cache@x.org"})  # an account change invalidates the aggregate
+    r3 = client.get("/admin/metrics/aggregate")
+    assert r3.json()["parents"] == r1.json()["parents"] + 1 and r3.headers["etag"] != r1.headers["etag"]
+    assert stats()["hits"] == before["hits"] + 3 and stats()["misses"] == before["misses"] + 2
+    assert "content-encoding" not in r3.headers  # below the compression threshold
+    RESPONSES.min_compress, saved = 1, RESPONSES.min_compress
+    try:
+        gz = client.get("/admin/metrics/aggregate", headers={"Accept-Encoding": "gzip"})
+        assert gz.headers["content-encoding"] == "gzip" and gz.json() == r3.json()
+        assert gz.headers["etag"] == r3.headers["etag"]  # one entry, compressed variant
+        assert "content-encoding" not in client.get("/notifications/publickey", headers={"Accept-Encoding": "identity"}).headers
+    finally:
+        RESPONSES.min_compress = saved
+
+def _push_keys():
+    import base64
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives import serialization
+    b64 = lambda b: base64.urlsafe_b64encode(b).rstrip(b"=").decode()
+    vapid = ec.generate_private_key(ec.SECP256R1())
+    client_key = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    return b64(vapid.private_numbers().private_value.to_bytes(32, "big")), {"p256dh": b64(client_key), "auth": b64(os.urandom(16))}
+
+def test_push_dispatch_against_local_endpoint():
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    hits = {}
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            hits[self.path] = hits.get(self.path, 0) + 1
+            code = {"/ok": 201, "/gone": 410, "/bad": 400}.get(self.path, 503 if hits[self.path] < 2 else 201)
+            self.send_response(code); self.send_header("Content-Length", "0"); self.end_headers()
+        def log_message(self, *a): pass
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{srv.server_address[1]}"
+    vapid_key, keys = _push_keys()
+    expired = []
+    d = PushDispatcher(vapid_key, {"sub": "mailto:t@example.com"}, workers=4, retries=2, backoff_s=0.01,
+                       on_expired=expired.append)
+    subs = [{"endpoint": base + p, "keys": keys} for p in ("/ok", "/gone", "/bad", "/flaky")]
+    subs.append({"endpoint": base + "/malformed", "keys": {"p256dh": "k", "auth": "a"}})  # cannot be encrypted to
+    r = d.send_all(subs, {"title": "t", "body": "b"})
+    d.close(); srv.shutdown()
+    assert (r["sent"], r["expired"], r["failed"], r["retries"]) == (2, 1, 2, 1)
+    assert sorted(s["endpoint"] for s in expired) == [base + "/gone", base + "/malformed"]
+    assert "/malformed" not in hits
+    assert hits["/bad"] == 1 and r["latency_ms"]["max"] > 0
+
+def test_subscription_registry(tmp_path):
+    for store in (MemoryStorage(), SqliteStorage(str(tmp_path / "subs.db"))):
+        keys = {"p256dh": "k", "auth": "a"}
+        assert store.add_subscription({"endpoint": "https://p/1", "keys": keys}, "acme", "a@x.nl") == (True, 1)
+        assert store.add_subscription({"endpoint": "https://p/1", "keys": keys}, "acme", "a@x.nl") == (False, 1)
+        store.add_subscription({"endpoint": "https://p/2", "keys": keys}, "acme", "b@x.nl")
+        store.add_subscription({"endpoint": "https://p/3", "keys": keys}, "other", None)
+        assert len(store.subscriptions()) == 3
+        assert {s["endpoint"] for s in store.subscriptions(org="acme")} == {"https://p/1", "https://p/2"}
+        assert [s["endpoint"] for s in store.subscriptions(org="acme", parent="b@x.nl")] == ["https://p/2"]
+        assert store.remove_subscription("https://p/2") and not store.remove_subscription("https://p/2")
+        assert store.add_subscription({"endpoint": "https://p/4", "keys": keys}) == (True, 3)
+        store.close()
+
+def test_notifications_register_dedup():
+    sub = {"endpoint": "https://push.example/abc", "keys": {"p256dh": "k", "auth": "a"}, "org": "acme"}
+    n = client.post("/notifications/register", json=sub).json()["registered"]
+    assert client.post("/notifications/register", json=sub).json()["registered"] == n
+    assert client.post("/notifications/test", json={"title": "t", "body": "b", "org": "nobody"}).status_code == 400
+
+def test_reminder_scheduler_coalesces_and_persists(tmp_path):
+    import time as _t
+    store = SqliteStorage(str(tmp_path / "r.db"))
+    fired = []
+    now = _t.time()
+    sched = ReminderScheduler(store, lambda due, rs: fired.append(sorted(r["title"] for r in rs)), coalesce_s=3600)
+    sched.schedule([{"due": now + 3600 * 24, "parent": "p", "title": "later", "body": ""}])  # persisted, not due
+    sched.start()
+    sched.schedule([{"due": now - 1, "parent": "p", "title": t, "body": ""} for t in ("a", "b")])
+    deadline = _t.time() + 2
+    while not fired and _t.time() < deadline:
+        _t.sleep(0.01)
+    sched.close()
+    assert fired == [["a", "b"]]  # same bucket -> one batch
+    # a restarted scheduler picks up the pending reminder from storage
+    again = ReminderScheduler(store, lambda due, rs: None)
+    again.start()
+    assert again.stats()["pending"] == 1
+    again.close(); store.close()
+
+def test_plan_day_schedules_reminders():
+    import datetime as dt
+    tomorrow = (dt.date.today() + dt.timedelta(days=1)).isoformat()
+    r = client.post("/plan/day", json={"child": {"name":"Ava","age_years":4}, "wake_time": "08:00",
+                                       "parent": "p@example.com", "date": tomorrow}).json()
+    assert r["reminders"] == 3
+    pending = client.get("/admin/metrics/reminders").json()["pending"]
+    assert pending >= 3
+    # the same blocks again, from plan/day or as an ICS export, queue no second reminder
+    again = client.post("/plan/day", json={"child": {"name":"Ava","age_years":4}, "wake_time": "08:00",
+                                           "parent": "p@example.com", "date": tomorrow}).json()
+    assert again["reminders"] == 0
+    for _ in range(3):
+        assert client.post("/integrations/calendar/ics", json={"child": {"name":"Ava","age_years":4}, "date": tomorrow,
+                                                               "plan": r["blocks"], "parent": "p@example.com"}).status_code == 200
+    stats = client.get("/admin/metrics/reminders").json()
+    assert stats["pending"] == pending and stats["duplicate"] >= 6
+
+def test_story_engine_and_batch():
+    from stories import StoryEngine
+    eng = StoryEngine({"en": [{"title": "A", "template": "{child} hops. " * 50, "theme": "calm"},
+                              {"title": "B", "template": "{child} naps.", "theme": "calm", "minutes": 2}]})
+    assert eng.render("en", "calm", 1, 0, "Mo")["segments"] == 1
+    long = eng.render("en", "calm", 3, 0, "Mo")
+    assert long["segments"] == 2 and long["story"].endswith("Mo naps.")
+    assert eng.render("en", "calm", 3, 0, "Mo") == long and eng.cache.stats()["hits"] == 1
+    child = {"name": "Ava", "age_years": 4.0, "language": "nl"}
+    one = client.post("/story/generate", json={"child": child, "seed": 3, "bilingual": True}).json()
+    assert "Ava" in one["story"] and "[English]" in one["story"] and one["seed"] == 3
+    week = client.post("/story/batch", json={"child": child, "seed": 3, "nights": 7}).json()["stories"]
+    assert len(week) == 7 and [s["seed"] for s in week] == list(range(3, 10))
+    assert week[0]["title"] != week[1]["title"]
+
+def test_content_registry_hot_swap(tmp_path):
+    import shutil
+    from content import ContentRegistry, FILES
+    for name in FILES:
+        shutil.copy(os.path.join("content", name), tmp_path / name)
+    reg = ContentRegistry(str(tmp_path))
+    old = reg.current
+    assert old.version == 1 and not reg.reload()
+    acts = json.loads((tmp_path / "activities.json").read_text())
+    acts["en"]["solo"].append({"name": "Hot-reloaded puzzle", "minutes": [5, 60], "age_min": 0, "energy": "calm"})
+    (tmp_path / "activities.json").write_text(json.dumps(acts))
+    assert reg.reload() and reg.current.version == 2
+    names = [a["name"] for a in reg.current.activity_index[("en", "solo")].activities]
+    assert "Hot-reloaded puzzle" in names
+    assert "Hot-reloaded puzzle" not in [a["name"] for a in old.activity_index[("en", "solo")].activities]
+    (tmp_path / "meals.json").write_text("{broken")
+    assert not reg.reload() and reg.current.version == 2 and reg.stats()["errors"] == 1
+    assert client.get("/admin/content").json()["version"] >= 1
+
+def test_content_snapshot_restore(tmp_path):
+    import shutil
+    from content import ContentRegistry, FILES
+    for name in FILES:
+        shutil.copy(os.path.join("content", name), tmp_path / name)
+    snap = str(tmp_path / "content.snapshot")
+    first = ContentRegistry(str(tmp_path), snapshot_path=snap)
+    again = ContentRegistry(str(tmp_path), snapshot_path=snap)
+    assert not first.stats()["restored"] and again.stats()["restored"]
+    assert again.current.digest == first.current.digest and not again.reload()
+    assert again.current.stories.render("en", "adventure", 4, 7, "Ava", False) == first.current.stories.render("en", "adventure", 4, 7, "Ava", False)
+    (tmp_path / "meals.json").write_text((tmp_path / "meals.json").read_text() + " ")
+    assert not ContentRegistry(str(tmp_path), snapshot_path=snap).stats()["restored"]  # stale snapshot is rebuilt
+    r = client.get("/admin/startup").json()
+    assert "content" in r["phases_ms"] and set(r["loaded"]) >= {"authlib", "pywebpush"}
+
+def test_event_writer_async_emit(tmp_path):
+    import asyncio
+    store = SegmentStore(str(tmp_path))
+    w = EventWriter(store, flush_every=64, flush_ms=5, durability="fsync", max_queue=4)
+    async def produce():
+        seqs = await asyncio.gather(*(w.aemit({"ts": i, "kind": "t", "payload": {}}) for i in range(20)))
+        assert await w.aflush()
+        return seqs
+    seqs = asyncio.run(produce())
+    w.close()
+    assert sorted(seqs) == list(range(1, 21)) and w.stats()["pending"] == 0
+    with open(store.segment_path("1970-01-01")) as f:
+        assert len(f.readlines()) == 20
+
+def test_event_writer_backpressure_does_not_stall_loop(tmp_path):
+    import asyncio, threading
+    class SlowStore(SegmentStore):
+        def append(self, *a, **kw):
+            time.sleep(0.2)
+            return super().append(*a, **kw)
+    w = EventWriter(SlowStore(str(tmp_path)), flush_every=1, flush_ms=0, max_queue=1)
+    async def produce():
+        stall = 0.0
+        async def ticker():
+            nonlocal stall
+            while True:
+                t = time.perf_counter(); await asyncio.sleep(0.005)
+                stall = max(stall, time.perf_counter() - t)
+        tick = asyncio.create_task(ticker())
+        seqs = await asyncio.gather(*(w.aemit({"ts": i, "kind": "t", "payload": {}}) for i in range(6)))
+        tick.cancel()
+        return stall, seqs
+    # a thread blocked in emit() on the full queue holds the sequence lock meanwhile
+    t = threading.Thread(target=lambda: [w.emit({"ts": 100 + i, "kind": "t", "payload": {}}) for i in range(3)])
+    t.start()
+    stall, seqs = asyncio.run(produce())
+    t.join(); w.close()
+    assert stall < 0.1 and len(set(seqs)) == 6 and w.stats()["pending"] == 0
+
+def test_workers_share_log_and_metrics(tmp_path):
+    import threading
+    # two "workers": separate store/writer/metrics instances over one data dir
+    workers = []
+    for _ in range(2):
+        store = SegmentStore(str(tmp_path))
+        workers.append((store, EventWriter(store, flush_every=50, flush_ms=1), Metrics(str(tmp_path / "m.json"))))
+    big = "x" * 20000  # batches larger than a pipe/stdio buffer must still land as whole lines
+    def produce(w, tag):
+        for i in range(300):
+            w.emit({"ts": 100 + i, "kind": "session_start", "payload": {"duration": 1, "w": tag, "pad": big if i % 50 == 0 else ""}})
+    threads = [threading.Thread(target=produce, args=(w, n)) for n, (_, w, _) in enumerate(workers)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    for _, w, _ in workers: w.close()
+    with open(workers[0][0].segment_path("1970-01-01")) as f:
+        assert sum(1 for l in f if json.loads(l)) == 600
+    for store, _, m in workers:
+        assert m.follow(store) == 600
+    assert workers[0][2].totals() == workers[1][2].totals() == {"sessions": 600, "minutes_saved_total": 600}
+
+def test_prometheus_metrics_and_profiler():
+    child = {"name": "Ava", "age_years": 4.0, "language": "en"}
+    client.post("/plan/day", json={"child": child, "wake_time": "07:00"})
+    text = client.get("/metrics").text
+    assert 'haven_http_request_duration_seconds_count{method="POST",route="/plan/day"}' in text
+    assert 'haven_span_duration_seconds_bucket{span="plan_block",le="+Inf"}' in text
+    assert "haven_http_requests_in_flight" in text and "haven_eventlog_queue_depth" in text
+    assert client.post("/admin/profiler", json={"enabled": True, "slow_ms": 0, "interval_ms": 1}).json()["enabled"]
+    client.post("/mealplan/stream", json={"children": [child], "days": 60})
+    slow = client.get("/admin/profiler").json()["slow"]
+    assert any(r["route"] == "/mealplan/stream" for r in slow)
+    client.post("/admin/profiler", json={"enabled": False})
+    assert client.get("/admin/profiler").json()["enabled"] is False
+
+def test_columnar_query(tmp_path):
+    import pytest
+    pytest.importorskip("numpy")
+    from columnar import ColumnarStore
+    store = SegmentStore(str(tmp_path / "events"))
+    day = 86400
+    rows = [(10, "session_start", {"duration": 30, "org": "acme", "lang": "nl"}),
+            (20, "activities_suggest", {"org": "acme", "lang": "nl", "activity": "Puzzle time"}),
+            (30, "session_start", {"duration": 15, "child": {"language": "en", "org": "globex"}}),
+            (day + 5, "session_start", {"duration": 20, "org": "acme", "lang": "en"})]
+    for ts, kind, payload in rows:
+        store.append(day_of(ts), json.dumps({"ts": ts, "kind": kind, "payload": payload}) + "\n")
+    cs = ColumnarStore(str(tmp_path / "columns"), store)
+    assert cs.convert_sealed()["converted_days"] == 2 and cs.convert_sealed()["partitions_written"] == 0
+    r = cs.query(filters={"org": ["acme"], "kind": ["session_start"]}, group_by=["day", "lang"])
+    assert r["rows"] == [{"day": "1970-01-01", "lang": "nl", "events": 1, "minutes": 30},
+                         {"day": "1970-01-02", "lang": "en", "events": 1, "minutes": 20}]
+    assert r["scanned"]["partition_days"] == 2
+    store.append("1970-01-02", json.dumps({"ts": day + 9, "kind": "session_start", "payload": {"duration": 5, "org": "acme"}}) + "\n")
+    r = cs.query(start="1970-01-02", filters={"org": ["acme"]}, group_by=["org"])
+    assert r["rows"] == [{"org": "acme", "events": 2, "minutes": 25}] and r["scanned"]["log_days"] == 1
+    assert cs.query(group_by=["activity"])["rows"][-1] == {"activity": "Puzzle time", "events": 1, "minutes": 0}
+    client.post("/session/start", json={"child": {"name": "Ava", "age_years": 4, "org": "initech"}, "duration_min": 10})
+    r = client.get("/admin/metrics/query", params={"org": "initech", "group_by": "kind"}).json()
+    assert r["rows"] == [{"kind": "session_start", "events": 1, "minutes": 0}]  # minutes arrive with session_end
+    assert client.get("/admin/metrics/query", params={"group_by": "colour"}).status_code == 400